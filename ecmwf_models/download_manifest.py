@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2019, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Manifest of the chunks (requests) of a download, that records the request,
+status, size and checksum of each downloaded file. Repeated or interrupted
+downloads use it to request only missing days and to split files that were
+downloaded but not split yet.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import warnings
+import threading
+from datetime import datetime, timedelta
+from ecmwf_models.file_index import ImageFileIndex
+
+manifest_name = 'download_manifest.json'
+_manifest_version = 1
+
+
+def file_checksum(filename, blocksize=1048576):
+    """
+    SHA-256 checksum of a file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file.
+    blocksize : int, optional (default: 1048576)
+        Number of bytes that are read at once.
+
+    Returns
+    ----------
+    checksum : str
+        Hex digest of the file content.
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def day_range(startdate, enddate):
+    """
+    All days between two dates (including both).
+
+    Parameters
+    ----------
+    startdate : datetime
+        First day.
+    enddate : datetime
+        Last day.
+
+    Returns
+    ----------
+    days : list
+        datetimes of the days (at 00:00).
+    """
+    first = datetime(startdate.year, startdate.month, startdate.day)
+    last = datetime(enddate.year, enddate.month, enddate.day)
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def complete_days(target_path, ext, h_steps, startdate, enddate):
+    """
+    Find the days between two dates, for which the images of all h_steps
+    were already split into the target path (%Y/%j/*_%Y%m%d_%H%M.ext).
+
+    Parameters
+    ----------
+    target_path : str
+        Root path of the downloaded images.
+    ext : str
+        File extension of the images, 'nc' or 'grb'.
+    h_steps : list
+        Full hours of the images on each day.
+    startdate : datetime
+        First day.
+    enddate : datetime
+        Last day.
+
+    Returns
+    ----------
+    days : set
+        datetimes (at 00:00) of the complete days.
+    """
+    days = day_range(startdate, enddate)
+    index = ImageFileIndex(target_path, '*_{datetime}.' + ext)
+    hours = {}
+    for t in index.timestamps(days[0], days[-1] + timedelta(days=1)):
+        if t.minute == 0:
+            hours.setdefault(datetime(t.year, t.month, t.day), set()).add(
+                t.hour)
+    return set([day for day in days
+                if day in hours and hours[day] >= set(h_steps)])
+
+
+def reusable_downloads(manifest, settings, days, done, downloaded_data_path):
+    """
+    Find the complete files of earlier downloads in the manifest, e.g. that
+    were not split yet when a download was interrupted, so that they are used
+    instead of requesting their days again.
+
+    Parameters
+    ----------
+    manifest : DownloadManifest
+        Manifest of the download.
+    settings : dict
+        Request settings (e.g. variables, h_steps) that the chunks must have.
+    days : list
+        datetimes of the days to download.
+    done : set
+        Days that are not downloaded, e.g. because their images exist.
+    downloaded_data_path : str
+        Directory of the downloaded files.
+
+    Returns
+    ----------
+    files : list
+        Paths of the complete downloaded files that contain days to download.
+    done : set
+        The passed days and the days in these files.
+    """
+    files = []
+    done = set(done)
+    for name, entry in manifest.chunks(settings=settings):
+        chunk_days = set(datetime.strptime(d, '%Y-%m-%d')
+                         for d in entry['request']['days'])
+        dl_file = os.path.join(downloaded_data_path, name)
+        if not (chunk_days & set(days)) or chunk_days <= done or \
+                not manifest.verify(name, dl_file):
+            continue
+        files.append(dl_file)
+        done |= chunk_days
+    return files, done
+
+
+def mark_failed(failed, name, error, manifest=None):
+    """
+    Record a chunk that could not be downloaded or split, it is requested
+    again by the next run.
+
+    Parameters
+    ----------
+    failed : dict
+        Error messages of the failed chunks, the chunk is added.
+    name : str
+        Name of the downloaded file of the chunk.
+    error : str
+        Error message.
+    manifest : DownloadManifest, optional (default: None)
+        Manifest in which the chunk is marked as failed.
+    """
+    warnings.warn('Chunk {} failed: {}'.format(name, error))
+    failed[name] = error
+    if manifest is not None:
+        manifest.update(name, status='failed', error=error)
+
+
+def split_download(dl_file, split_func, failed, manifest=None,
+                   keep_original=False):
+    """
+    Split a downloaded file into one file per image and record the result.
+
+    Parameters
+    ----------
+    dl_file : str
+        Path to the downloaded file.
+    split_func : callable
+        Function that splits the file (its only argument), e.g. a call of
+        ecmwf_models.utils.save_ncs_from_nc.
+    failed : dict
+        Error messages of the failed chunks, the chunk is added if the file
+        could not be split.
+    manifest : DownloadManifest, optional (default: None)
+        Manifest in which the chunk is marked as split (or failed).
+    keep_original : bool, optional (default: False)
+        Keep the downloaded file after it was split.
+
+    Returns
+    ----------
+    success : bool
+        True if the file was split.
+    """
+    name = os.path.basename(dl_file)
+    try:
+        split_func(dl_file)
+    except (IOError, OSError, ValueError, RuntimeError) as e:
+        # e.g. a corrupt file, it is kept and requested again by the next run
+        mark_failed(failed, name, 'Split failed, {}: {}'.format(
+            e.__class__.__name__, e), manifest)
+        return False
+
+    if manifest is not None:
+        manifest.update(name, status='split')
+    if not keep_original:
+        # other chunks may still be downloaded into the folder
+        os.remove(dl_file)
+    return True
+
+
+def print_failed_chunks(failed):
+    """
+    Print the report of the chunks that could not be downloaded (or split).
+
+    Parameters
+    ----------
+    failed : dict
+        Error messages of the failed chunks, by the names of their files.
+    """
+    if not failed:
+        return
+    print("Download of {} chunk(s) failed, they are requested again by the "
+          "next run:".format(len(failed)))
+    for name in sorted(failed):
+        print("  {}: {}".format(name, failed[name]))
+
+
+class DownloadManifest(object):
+    """
+    Manifest of the chunks of a download, stored as json file. Each chunk is
+    stored by the name of its downloaded file, with the request settings, the
+    requested days, the status ('requested', 'downloaded', 'split' or
+    'failed', with the error message) and the size and checksum of the
+    downloaded file.
+    The manifest can be updated from multiple threads.
+
+    Parameters
+    ----------
+    path : str
+        Path to the manifest file, e.g. target_path/download_manifest.json
+    """
+    def __init__(self, path):
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._chunks = self._load()
+
+    def _load(self):
+        """
+        Load the chunks from the manifest file, if there is one.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if manifest.get('version') != _manifest_version:
+            return {}
+        return manifest['chunks']
+
+    def _write(self):
+        """
+        Store the manifest (through a temporary file, so that an interrupted
+        download never leaves an incomplete manifest).
+        """
+        manifest = {'version': _manifest_version, 'chunks': self._chunks}
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)),
+                prefix='.tmp_manifest_')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def get(self, name):
+        """
+        Get the entry of a chunk, None if the chunk is not in the manifest.
+        """
+        with self._lock:
+            entry = self._chunks.get(name)
+            return None if entry is None else dict(entry)
+
+    def update(self, name, **fields):
+        """
+        Update (or create) the entry of a chunk and store the manifest.
+
+        Parameters
+        ----------
+        name : str
+            Name of the downloaded file of the chunk.
+        fields :
+            Fields of the entry to set, e.g. status='split'.
+        """
+        with self._lock:
+            self._chunks.setdefault(name, {}).update(fields)
+            self._write()
+
+    def record_download(self, name, filename):
+        """
+        Mark a chunk as downloaded and store the size and checksum of its
+        downloaded file.
+        """
+        self.update(name, status='downloaded',
+                    size=os.path.getsize(filename),
+                    sha256=file_checksum(filename),
+                    time=datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
+
+    def chunks(self, status=None, settings=None):
+        """
+        Get the entries of the chunks with a status and request settings.
+
+        Parameters
+        ----------
+        status : str, optional (default: None)
+            Status of the chunks, None for all chunks.
+        settings : dict, optional (default: None)
+            Settings (e.g. variables, h_steps) that the stored requests of
+            the chunks must have.
+
+        Returns
+        ----------
+        chunks : list
+            (name, entry) of the chunks, sorted by name.
+        """
+        with self._lock:
+            selected = []
+            for name, entry in sorted(self._chunks.items()):
+                if status is not None and entry.get('status') != status:
+                    continue
+                request = entry.get('request', {})
+                if settings is not None and \
+                        any(request.get(k) != v for k, v in settings.items()):
+                    continue
+                selected.append((name, dict(entry)))
+            return selected
+
+    def verify(self, name, filename):
+        """
+        Check that the downloaded file of a chunk exists and has the size and
+        checksum that were stored after the download.
+
+        Returns
+        ----------
+        valid : bool
+            True if the file is complete.
+        """
+        entry = self.get(name)
+        if entry is None or entry.get('status') not in ['downloaded', 'split'] \
+                or not os.path.exists(filename):
+            return False
+        return os.path.getsize(filename) == entry.get('size') and \
+            file_checksum(filename) == entry.get('sha256')
@@ -29,10 +29,15 @@ from ecmwf_models.utils import *
 import argparse
 import sys
 import os
+import itertools
+import threading
+from multiprocessing.pool import ThreadPool
 from datetime import datetime, timedelta, time
-import shutil
 import cdsapi
 import calendar
+from ecmwf_models.download_manifest import DownloadManifest, manifest_name, \
+    day_range, complete_days, print_failed_chunks, reusable_downloads, \
+    mark_failed, split_download
 
 
 def default_variables():
@@ -43,7 +48,7 @@ def default_variables():
 
 
 def download_era5(c, years, months, days, h_steps, variables, target, grb=False,
-                  dry_run=False):
+                  dry_run=False, area=None, grid=None):
     '''
     Download era5 reanalysis data for single levels of a defined time span
 
@@ -68,6 +73,12 @@ def download_era5(c, years, months, days, h_steps, variables, target, grb=False,
         Download data in grib format
     dry_run: bool, optional (default: False)
         Do not download anything, this is just used for testing the functionality
+    area : list, optional (default: None)
+        Bounding box [N, W, S, E] of the downloaded area in degrees, None for
+        global fields.
+    grid : list, optional (default: None)
+        Resolution [lon, lat] of the downloaded fields in degrees, None for
+        the native 0.25 degree grid.
 
     Returns
     ---------
@@ -76,28 +87,254 @@ def download_era5(c, years, months, days, h_steps, variables, target, grb=False,
     '''
 
     if not dry_run:
-        c.retrieve(
-            'reanalysis-era5-single-levels',
-            {
-                'product_type': 'reanalysis',
-                'format': 'grib' if grb else 'netcdf',
-                'variable': variables,
-                'year': [str(y) for y in years],
-                'month': [str(m).zfill(2) for m in months],
-                'day': [str(d).zfill(2) for d in days],
-                'time': [time(h, 0).strftime('%H:%M') for h in h_steps]
-            },
-            target)
+        request = {
+            'product_type': 'reanalysis',
+            'format': 'grib' if grb else 'netcdf',
+            'variable': variables,
+            'year': [str(y) for y in years],
+            'month': [str(m).zfill(2) for m in months],
+            'day': [str(d).zfill(2) for d in days],
+            'time': [time(h, 0).strftime('%H:%M') for h in h_steps]
+        }
+        if area is not None:
+            request['area'] = list(area)
+        if grid is not None:
+            request['grid'] = list(grid)
+
+        c.retrieve('reanalysis-era5-single-levels', request, target)
 
     return True
 
 
+# values in the downloaded files are packed into 16 bit (grib and netcdf)
+_bytes_per_value = 2
+# points of the global 0.25 degree ERA5 grid
+_global_points = 721 * 1440
+# maximum number of fields (variables x days x h_steps) in a CDS request
+_max_fields = 120000
+# request size that chunks are packed to with the 'auto' chunking
+_target_size = 4 * 1024 ** 3
+
+
+def parse_chunking(v):
+    """
+    Parse a chunking strategy for the download requests.
+
+    Parameters
+    ----------
+    v : str
+        'auto', 'month', 'year' or a number of days.
+
+    Returns
+    ----------
+    chunking : str or int
+        The chunking strategy, or the number of days per chunk.
+    """
+    if v in ['auto', 'month', 'year']:
+        return v
+    try:
+        days = int(v)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Chunking must be auto, month, year or a number of days.")
+    if days < 1:
+        raise argparse.ArgumentTypeError("Number of days must be positive.")
+    return days
+
+
+def estimate_request_size(n_days, n_variables, n_h_steps,
+                          n_points=_global_points):
+    """
+    Estimate the size of the downloaded file of a request.
+
+    Parameters
+    ----------
+    n_days : int
+        Number of requested days.
+    n_variables : int
+        Number of requested variables.
+    n_h_steps : int
+        Number of requested time steps per day.
+    n_points : int, optional (default: 721 * 1440)
+        Number of points in each field, by default the global 0.25 degree
+        grid.
+
+    Returns
+    ----------
+    size : int
+        Estimated size in bytes.
+    """
+    return n_days * n_variables * n_h_steps * n_points * _bytes_per_value
+
+
+def area_points(area=None, grid=None):
+    """
+    Number of points in the fields of a request.
+
+    Parameters
+    ----------
+    area : list, optional (default: None)
+        Bounding box [N, W, S, E] in degrees, None for global fields.
+    grid : list, optional (default: None)
+        Resolution [lon, lat] in degrees, None for the native 0.25 degree grid.
+
+    Returns
+    ----------
+    n_points : int
+        Number of points (lat x lon).
+    """
+    north, west, south, east = area if area is not None else (90, 0, -90, 360)
+    res_lon, res_lat = grid if grid is not None else (0.25, 0.25)
+
+    lon_span = east - west if east >= west else east - west + 360
+    n_lat = int(round((north - south) / res_lat)) + 1
+    n_lon = min(int(round(lon_span / res_lon)) + 1, int(round(360. / res_lon)))
+
+    return n_lat * n_lon
+
+
+def _full_month(days):
+    """
+    Check if a list of days of one month contains all days of the month.
+    """
+    return len(days) == calendar.monthrange(days[0].year, days[0].month)[1]
+
+
+def plan_chunks(days, n_variables, n_h_steps, chunking='auto',
+                n_points=_global_points, target_size=_target_size):
+    """
+    Split the days to download into chunks (requests). CDS requests are
+    the combinations of the requested years, months and days, so chunks
+    contain either days of one month, or complete months of one year.
+
+    Parameters
+    ----------
+    days : list
+        Sorted datetimes of the days to download.
+    n_variables : int
+        Number of requested variables.
+    n_h_steps : int
+        Number of requested time steps per day.
+    chunking : str or int, optional (default: 'auto')
+        'month' for one chunk per month, 'year' for one chunk per year,
+        a number of days for chunks with at most this number of days
+        (within one month), or 'auto' to pack chunks up to the target size.
+    n_points : int, optional (default: 721 * 1440)
+        Number of points in each field, by default the global 0.25 degree
+        grid.
+    target_size : int, optional (default: 4 GB)
+        Estimated size of the requests with 'auto' chunking. Chunks also
+        contain at most the maximum number of fields of a CDS request.
+
+    Returns
+    ----------
+    chunks : list
+        Lists of the days in each chunk.
+    """
+    months = _month_chunks(days)
+
+    if chunking == 'month':
+        return months
+
+    if chunking == 'year':
+        max_days = None
+    elif chunking == 'auto':
+        day_size = estimate_request_size(1, n_variables, n_h_steps, n_points)
+        max_days = max(1, min(target_size // day_size,
+                              _max_fields // (n_variables * n_h_steps)))
+    else:
+        max_days = int(chunking)
+
+    chunks = []
+    for month in months:
+        if max_days is not None and len(month) > max_days:
+            # split the month into chunks of (nearly) the same size
+            n = -(-len(month) // max_days)
+            size = -(-len(month) // n)
+            chunks.extend([month[i:i + size]
+                           for i in range(0, len(month), size)])
+        elif chunks and _full_month(month) and \
+                chunks[-1][0].year == month[0].year and \
+                all(_full_month(m) for m in _month_chunks(chunks[-1])) and \
+                (max_days is None or len(chunks[-1]) + len(month) <= max_days):
+            # complete months of the same year are requested together
+            chunks[-1] = chunks[-1] + month
+        else:
+            chunks.append(month)
+
+    return chunks
+
+
+def _month_chunks(days):
+    """
+    Group days into chunks of calendar months.
+
+    Parameters
+    ----------
+    days : list
+        Sorted datetimes of the days to download.
+
+    Returns
+    ----------
+    chunks : list
+        Lists of the days in each month.
+    """
+    chunks = []
+    for day in days:
+        if chunks and (chunks[-1][0].year, chunks[-1][0].month) == \
+                (day.year, day.month):
+            chunks[-1].append(day)
+        else:
+            chunks.append([day])
+    return chunks
+
+
+def _download_chunk(get_client, days, dl_file, variables, h_steps, grb,
+                    dry_run, manifest=None, area=None, grid=None,
+                    retry_kws=None):
+    """
+    Download the data of one chunk into a file, transient errors are retried
+    with exponential backoff (see ecmwf_models.utils.download_with_retry).
+    This is called by the worker threads of download_and_move.
+
+    Returns
+    ----------
+    dl_file : str
+        Path to the downloaded file.
+    error : str or None
+        Error message if the download failed, None if it was successful.
+    """
+    name = os.path.basename(dl_file)
+    if manifest is not None:
+        manifest.update(name, status='requested')
+
+    def download():
+        return download_era5(get_client(),
+                             years=sorted(set(d.year for d in days)),
+                             months=sorted(set(d.month for d in days)),
+                             days=sorted(set(d.day for d in days)),
+                             h_steps=h_steps, variables=variables, grb=grb,
+                             target=dl_file, dry_run=dry_run,
+                             area=area, grid=grid)
+
+    error = download_with_retry(download, dl_file, **(retry_kws or {}))
+
+    if manifest is not None and error is None:
+        manifest.record_download(name, dl_file)
+
+    return dl_file, error
+
+
 def download_and_move(target_path, startdate, enddate, variables=None,
                       keep_original=False, h_steps=[0, 6, 12, 18],
-                      grb=False, dry_run=False):
+                      grb=False, dry_run=False, split=True, max_parallel=1,
+                      client=None, manifest=None, skip_existing=True,
+                      chunking='month', area=None, grid=None, tries=5,
+                      retry_delay=30.):
     """
     Downloads the data from the ECMWF servers and moves them to the target path.
-    This is done in 30 day increments between start and end date.
+    This is done in chunks (by default months) between start and end date, up
+    to max_parallel chunks are requested at the same time.
 
     The files are then extracted into separate grib files per parameter and stored
     in yearly folders under the target_path.
@@ -120,6 +357,56 @@ def download_and_move(target_path, startdate, enddate, variables=None,
         Download data as grib files
     dry_run: bool
         Do not download anything, this is just used for testing the functions
+    split: bool, optional (default: True)
+        Split the downloaded files into one file per image. If False, the
+        downloaded (monthly) files are kept in target_path/temp_downloaded,
+        they can be read with ERA5NcMonthlyDs / ERA5GrbMonthlyDs.
+    max_parallel: int, optional (default: 1)
+        Maximum number of requests that are sent to the CDS at the same time
+        (in separate threads). Each finished file is split while the other
+        requests are processed.
+    client: object, optional (default: None)
+        Client to pass the requests to, with the retrieve method of
+        cdsapi.Client (e.g. a local stub for tests). It must be thread safe
+        when max_parallel > 1. If None is passed, one cdsapi.Client is
+        created per thread.
+    manifest: str, optional (default: None)
+        Path to the download manifest (json), that records the request,
+        status, size and checksum of each chunk. Files of chunks that were
+        downloaded but not split (e.g. after a crash) are split first, their
+        days are not requested again. If None is passed, no manifest is used.
+    skip_existing: bool, optional (default: True)
+        Request only days, for which not all images (h_steps) exist in the
+        target path yet (or, if split is False, that are not in a downloaded
+        file of the manifest).
+    chunking: str or int, optional (default: 'month')
+        How the days are split into requests, 'month', 'year', a number of
+        days, or 'auto' to pack requests to an estimated size of 4 GB
+        (e.g. a year of one variable, or a few days of many variables),
+        see plan_chunks.
+    area: list, optional (default: None)
+        Bounding box [N, W, S, E] in degrees of the area to download, None
+        for global images.
+    grid: list, optional (default: None)
+        Resolution [lon, lat] in degrees that the images are downloaded in
+        (interpolated by the CDS), None for the native 0.25 degree grid.
+        The area and grid are stored as global attributes (download_area,
+        download_grid) in the split netcdf images, grib images contain them
+        in their grid definition.
+    tries: int, optional (default: 5)
+        Maximum number of tries of each request. Requests that fail with a
+        transient error (e.g. connection errors) are repeated, requests with
+        permanent errors (e.g. invalid requests) are not.
+    retry_delay: float, optional (default: 30.)
+        Seconds to wait after the first failed try of a request, the time is
+        doubled (with random jitter) after each further failed try.
+
+    Returns
+    ----------
+    failed : dict
+        Error messages of the chunks (names of the downloaded files) that
+        could not be downloaded or split. They are also marked as failed in
+        the manifest, and requested again by the next run.
     """
 
     if variables is None:
@@ -129,60 +416,111 @@ def download_and_move(target_path, startdate, enddate, variables=None,
         variables = lookup(name='ERA5', variables=variables)
         variables = variables['dl_name'].values.tolist()
 
-    curr_start = startdate
+    if h_steps is None:
+        h_steps = [0, 6, 12, 18]
+
+    if area is not None:
+        area = [float(a) for a in area]
+    if grid is not None:
+        grid = [float(g) for g in grid]
+        if len(grid) == 1:
+            grid = grid * 2
 
     if dry_run:
         warnings.warn('Dry run does not create connection to CDS')
-        c = None
-    else:
-        c = cdsapi.Client()
-
-    while curr_start <= enddate:
-        sy, sm, sd = curr_start.year, curr_start.month, curr_start.day
-        sm_days = calendar.monthrange(sy, sm)[1]  # days in the current month
-        y, m = sy, sm
-
-        if (enddate.year == y) and (enddate.month == m):
-            d = enddate.day
-        else:
-            d = sm_days
 
-        curr_end = datetime(y, m, d)
-
-        fname = '{start}_{end}.{ext}'.format(start=curr_start.strftime("%Y%m%d"),
-                                             end=curr_end.strftime("%Y%m%d"),
-                                             ext='grb' if grb else 'nc')
-
-        downloaded_data_path = os.path.join(target_path, 'temp_downloaded')
-        if not os.path.exists(downloaded_data_path):
-            os.mkdir(downloaded_data_path)
-        dl_file = os.path.join(downloaded_data_path, fname)
-
-        finished, i = False, 0
-
-        while (not finished) and (i < 5):  # try max 5 times
-            try:
-                finished = download_era5(c, years=[sy], months=[sm], days=range(sd, d+1),
-                                         h_steps=h_steps, variables=variables, grb=grb,
-                                         target=dl_file, dry_run=dry_run)
-                break
-
-            except:
-                # delete the partly downloaded data and retry
-                os.remove(dl_file)
-                finished = False
-                i += 1
-                continue
+    # each thread sends its requests with its own client
+    local = threading.local()
+
+    def get_client():
+        if client is not None or dry_run:
+            return client
+        if not hasattr(local, 'client'):
+            local.client = cdsapi.Client()
+        return local.client
+
+    downloaded_data_path = os.path.join(target_path, 'temp_downloaded')
+    if not os.path.exists(downloaded_data_path):
+        os.makedirs(downloaded_data_path)
+
+    ext = 'grb' if grb else 'nc'
+    # chunks in the manifest are only reused for requests with these settings
+    settings = {'product': 'ERA5', 'variables': variables,
+                'h_steps': list(h_steps), 'format': 'grib' if grb else 'netcdf',
+                'area': area, 'grid': grid}
+    metadata = {}
+    if area is not None:
+        metadata['download_area'] = area
+    if grid is not None:
+        metadata['download_grid'] = grid
+    if manifest is not None:
+        manifest = DownloadManifest(manifest)
+
+    days = day_range(startdate, enddate)
+    done = set()
+    if skip_existing and split:
+        done = complete_days(target_path, ext, h_steps, startdate, enddate)
+
+    pending = []
+    if manifest is not None and skip_existing:
+        files, done = reusable_downloads(manifest, settings, days, done,
+                                         downloaded_data_path)
+        if split:
+            pending = [(dl_file, None) for dl_file in files]
+
+    tasks = []
+    for chunk_days in plan_chunks([d for d in days if d not in done],
+                                  len(variables), len(h_steps),
+                                  chunking=chunking,
+                                  n_points=area_points(area, grid)):
+        fname = '{start}_{end}.{ext}'.format(start=chunk_days[0].strftime("%Y%m%d"),
+                                             end=chunk_days[-1].strftime("%Y%m%d"),
+                                             ext=ext)
+        if manifest is not None:
+            request = dict(settings)
+            request['days'] = [d.strftime('%Y-%m-%d') for d in chunk_days]
+            manifest.update(fname, request=request)
+        tasks.append((get_client, chunk_days,
+                      os.path.join(downloaded_data_path, fname), variables,
+                      h_steps, grb, dry_run, manifest, area, grid,
+                      {'tries': tries, 'delay': retry_delay}))
+
+    if max_parallel > 1:
+        pool = ThreadPool(max(min(max_parallel, len(tasks)), 1))
+        # the chunks contain different days, so the split images are the same
+        # in whatever order the downloads finish
+        results = pool.imap_unordered(lambda task: _download_chunk(*task),
+                                      tasks)
+    else:
+        pool = None
+        results = (_download_chunk(*task) for task in tasks)
 
-        if grb:
+    if grb:
+        def split_func(dl_file):
             save_gribs_from_grib(dl_file, target_path, product_name='ERA5')
-        else:
-            save_ncs_from_nc(dl_file, target_path, product_name='ERA5')
-
-        if not keep_original:
-            shutil.rmtree(downloaded_data_path)
-
-        curr_start = curr_end + timedelta(days=1)
+    else:
+        def split_func(dl_file):
+            save_ncs_from_nc(dl_file, target_path, product_name='ERA5',
+                             metadata=metadata)
+
+    failed = {}
+    try:
+        for dl_file, error in itertools.chain(pending, results):
+            if error is not None:
+                mark_failed(failed, os.path.basename(dl_file), error,
+                            manifest)
+            elif split:
+                split_download(dl_file, split_func, failed, manifest,
+                               keep_original=keep_original)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    if split and not keep_original and \
+            len(os.listdir(downloaded_data_path)) == 0:
+        os.rmdir(downloaded_data_path)
+
+    return failed
 
 
 def parse_args(args):
@@ -232,9 +570,44 @@ def parse_args(args):
     parser.add_argument("--h_steps", type=int, default=None, nargs='+',
                         help=("Manually change the temporal resolution of downloaded images, must be full hours. "
                               "By default 6H images (starting at 0:00 UTC, i.e. 0 6 12 18) will be downloaded"))
+    parser.add_argument("--split", type=str2bool, default='True',
+                        help=("Split the downloaded files into one file per image. If False, the monthly "
+                              "files are kept in localroot/temp_downloaded, they can be converted with "
+                              "era5_reshuffle --from_monthly True. Default: True"))
+    parser.add_argument("--max_parallel", type=int, default=1,
+                        help=("Number of monthly requests that are sent to the CDS at the same time. "
+                              "The CDS processes a limited number of requests per user in parallel. "
+                              "Default: 1"))
+    parser.add_argument("--skip_existing", type=str2bool, default='True',
+                        help=("Request only days for which not all images exist in localroot yet. "
+                              "Downloads are recorded in localroot/download_manifest.json, files that "
+                              "were downloaded but not split by an interrupted run are split first. "
+                              "Default: True"))
+    parser.add_argument("--chunking", type=parse_chunking, default='month',
+                        help=("How the period is split into requests: month, year, a number of days, "
+                              "or auto to pack requests to about 4 GB, estimated from the number of "
+                              "variables, days and h_steps (e.g. a year of one variable, or a few days "
+                              "of many variables). Default: month"))
+    parser.add_argument("--bbox", type=float, default=None, nargs=4,
+                        metavar=('N', 'W', 'S', 'E'),
+                        help=("Bounding box of the area to download in degrees, e.g. "
+                              "--bbox 72 -25 34 45 for Europe. Default: global images"))
+    parser.add_argument("--grid", type=float, default=None, nargs='+',
+                        metavar='RES',
+                        help=("Resolution of the downloaded images in degrees, one value or "
+                              "lon lat resolution, e.g. --grid 0.5. The CDS interpolates the "
+                              "data to this grid. Default: native 0.25 degree grid"))
 
     args = parser.parse_args(args)
 
+    if args.bbox is not None:
+        north, west, south, east = args.bbox
+        if not (-90 <= south < north <= 90):
+            parser.error("--bbox must be passed as N W S E, with S < N.")
+    if args.grid is not None and \
+            (len(args.grid) > 2 or any(g <= 0 for g in args.grid)):
+        parser.error("--grid must be one or two (lon lat) positive resolutions.")
+
     print("Downloading ERA5 {} data from {} to {} into folder {}"
           .format('grib' if args.as_grib is True else 'netcdf',
                   args.start.isoformat(),
@@ -245,13 +618,21 @@ def parse_args(args):
 
 def main(args):
     args = parse_args(args)
-    download_and_move(target_path=args.localroot,
-                      startdate=args.start,
-                      enddate=args.end,
-                      variables=args.variables,
-                      h_steps=args.h_steps,
-                      grb=args.as_grib,
-                      keep_original=args.keep_original)
+    failed = download_and_move(target_path=args.localroot,
+                               startdate=args.start,
+                               enddate=args.end,
+                               variables=args.variables,
+                               h_steps=args.h_steps,
+                               grb=args.as_grib,
+                               keep_original=args.keep_original,
+                               split=args.split,
+                               max_parallel=args.max_parallel,
+                               manifest=os.path.join(args.localroot, manifest_name),
+                               skip_existing=args.skip_existing,
+                               chunking=args.chunking,
+                               area=args.bbox,
+                               grid=args.grid)
+    print_failed_chunks(failed)
 
 
 def run():
@@ -21,7 +21,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from ecmwf_models.interface import ERANcImg, ERANcDs, ERAGrbImg, ERAGrbDs
+import numpy as np
+from ecmwf_models.interface import ERANcImg, ERANcDs, ERAGrbImg, ERAGrbDs, \
+    ERANcMonthlyDs, ERAGrbMonthlyDs
 
 '''
 This module contains ERA5 specific child classes of the netcdf and grib
@@ -31,7 +33,8 @@ base classes, that are used for reading all ecmwf products.
 
 class ERA5NcImg(ERANcImg):
     def __init__(self, filename, parameter=['swvl1', 'swvl2'], mode='r',
-                 subgrid=None, mask_seapoints=False, array_1D=False):
+                 subgrid=None, mask_seapoints=False, array_1D=False,
+                 dtype=np.float32):
 
         product = 'ERA5'
         super(ERA5NcImg, self).__init__(filename=filename,
@@ -40,12 +43,15 @@ class ERA5NcImg(ERANcImg):
                                         mode=mode,
                                         subgrid=subgrid,
                                         mask_seapoints=mask_seapoints,
-                                        array_1D=array_1D)
+                                        array_1D=array_1D,
+                                        dtype=dtype)
 
 
 class ERA5NcDs(ERANcDs):
     def __init__(self, root_path, parameter=['swvl1', 'swvl2'], h_steps=[0,6,12,18],
-                 subgrid=None, mask_seapoints=False, array_1D=False):
+                 subgrid=None, mask_seapoints=False, array_1D=False,
+                 lsm_file=None, file_index=True, manifest=None,
+                 dtype=np.float32):
 
         product = 'ERA5'
         super(ERA5NcDs, self).__init__(root_path=root_path,
@@ -54,12 +60,17 @@ class ERA5NcDs(ERANcDs):
                                        subgrid=subgrid,
                                        h_steps=h_steps,
                                        array_1D=array_1D,
-                                       mask_seapoints=mask_seapoints)
+                                       mask_seapoints=mask_seapoints,
+                                       lsm_file=lsm_file,
+                                       file_index=file_index,
+                                       manifest=manifest,
+                                       dtype=dtype)
 
 
 class ERA5GrbImg(ERAGrbImg):
     def __init__(self, filename, parameter=['swvl1', 'swvl2'], mode='r',
-                 subgrid=None, mask_seapoints=False, array_1D=False):
+                 subgrid=None, mask_seapoints=False, array_1D=False,
+                 dtype=np.float32):
 
         product = 'ERA5'
         super(ERA5GrbImg, self).__init__(filename=filename,
@@ -68,12 +79,15 @@ class ERA5GrbImg(ERAGrbImg):
                                          mode=mode,
                                          subgrid=subgrid,
                                          mask_seapoints=mask_seapoints,
-                                         array_1D=array_1D)
+                                         array_1D=array_1D,
+                                         dtype=dtype)
 
 
 class ERA5GrbDs(ERAGrbDs):
     def __init__(self, root_path, parameter=['swvl1', 'swvl2'], h_steps=[0,6,12,18],
-                 subgrid=None, mask_seapoints=False, array_1D=False):
+                 subgrid=None, mask_seapoints=False, array_1D=False,
+                 lsm_file=None, file_index=True, manifest=None,
+                 dtype=np.float32):
 
         product = 'ERA5'
         super(ERA5GrbDs, self).__init__(root_path=root_path,
@@ -82,5 +96,43 @@ class ERA5GrbDs(ERAGrbDs):
                                         subgrid=subgrid,
                                         h_steps=h_steps,
                                         mask_seapoints=mask_seapoints,
-                                        array_1D=array_1D)
+                                        array_1D=array_1D,
+                                        lsm_file=lsm_file,
+                                        file_index=file_index,
+                                        manifest=manifest,
+                                        dtype=dtype)
 
+
+class ERA5NcMonthlyDs(ERANcMonthlyDs):
+    def __init__(self, root_path, parameter=['swvl1', 'swvl2'], subgrid=None,
+                 mask_seapoints=False, h_steps=[0, 6, 12, 18], array_1D=False,
+                 lsm_file=None, slab_size=24, dtype=np.float32):
+
+        product = 'ERA5'
+        super(ERA5NcMonthlyDs, self).__init__(root_path=root_path,
+                                              product=product,
+                                              parameter=parameter,
+                                              subgrid=subgrid,
+                                              mask_seapoints=mask_seapoints,
+                                              h_steps=h_steps,
+                                              array_1D=array_1D,
+                                              lsm_file=lsm_file,
+                                              slab_size=slab_size,
+                                              dtype=dtype)
+
+
+class ERA5GrbMonthlyDs(ERAGrbMonthlyDs):
+    def __init__(self, root_path, parameter=['swvl1', 'swvl2'], subgrid=None,
+                 mask_seapoints=False, h_steps=[0, 6, 12, 18], array_1D=False,
+                 lsm_file=None, dtype=np.float32):
+
+        product = 'ERA5'
+        super(ERA5GrbMonthlyDs, self).__init__(root_path=root_path,
+                                               product=product,
+                                               parameter=parameter,
+                                               subgrid=subgrid,
+                                               mask_seapoints=mask_seapoints,
+                                               h_steps=h_steps,
+                                               array_1D=array_1D,
+                                               lsm_file=lsm_file,
+                                               dtype=dtype)
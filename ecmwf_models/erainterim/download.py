@@ -29,8 +29,10 @@ from ecmwfapi import ECMWFDataServer
 import argparse
 import sys
 from datetime import datetime, timedelta
-import shutil
 from ecmwf_models.utils import *
+from ecmwf_models.download_manifest import DownloadManifest, manifest_name, \
+    day_range, complete_days, print_failed_chunks, reusable_downloads, \
+    mark_failed, split_download
 
 try:
     import pygrib
@@ -121,10 +123,37 @@ def download_eraint(target_path, start, end, variables, grid_size=None, type='fc
         server.retrieve(dl_params)
 
 
+def _day_runs(days, max_days=31):
+    """
+    Group days into runs of consecutive days, with at most max_days days.
+
+    Parameters
+    ----------
+    days : list
+        Sorted datetimes of the days to download.
+    max_days : int, optional (default: 31)
+        Maximum number of days in a run.
+
+    Returns
+    ----------
+    runs : list
+        Lists of the days in each run.
+    """
+    runs = []
+    for day in days:
+        if runs and len(runs[-1]) < max_days and \
+                day - runs[-1][-1] == timedelta(days=1):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    return runs
+
+
 def download_and_move(target_path, startdate, enddate, variables=None,
                       keep_original=False, grid_size=None,
                       type='an', h_steps=[0, 6, 12, 18], steps=[0],
-                      grb=False, dry_run=False):
+                      grb=False, dry_run=False, split=True, manifest=None,
+                      skip_existing=True, tries=5, retry_delay=30.):
     """
     Downloads the data from the ECMWF servers and moves them to the target path.
     This is done in 30 days increments between start and end date to be efficient
@@ -159,6 +188,33 @@ def download_and_move(target_path, startdate, enddate, variables=None,
         Download data as grib files instead of netcdf files
     dry_run: bool
         Do not download anything, this is just used for testing the functions
+    split: bool, optional (default: True)
+        Split the downloaded files into one file per image. If False, the
+        downloaded (30 day) files are kept in target_path/temp_downloaded,
+        they can be read with ERAIntNcMonthlyDs / ERAIntGrbMonthlyDs.
+    manifest: str, optional (default: None)
+        Path to the download manifest (json), that records the request,
+        status, size and checksum of each chunk. Files of chunks that were
+        downloaded but not split (e.g. after a crash) are split first, their
+        days are not requested again. If None is passed, no manifest is used.
+    skip_existing: bool, optional (default: True)
+        Request only days, for which not all images (h_steps) exist in the
+        target path yet (or, if split is False, that are not in a downloaded
+        file of the manifest).
+    tries: int, optional (default: 5)
+        Maximum number of tries of each request. Requests that fail with a
+        transient error (e.g. connection errors) are repeated, requests with
+        permanent errors (e.g. invalid requests) are not.
+    retry_delay: float, optional (default: 30.)
+        Seconds to wait after the first failed try of a request, the time is
+        doubled (with random jitter) after each further failed try.
+
+    Returns
+    ----------
+    failed : dict
+        Error messages of the chunks (names of the downloaded files) that
+        could not be downloaded or split. They are also marked as failed in
+        the manifest, and requested again by the next run.
     """
     if variables is None:
         variables = default_variables()
@@ -167,37 +223,83 @@ def download_and_move(target_path, startdate, enddate, variables=None,
         variables = lookup(name='ERAINT', variables=variables)
         variables = variables['dl_name'].values.tolist()
 
-    td = timedelta(days=30)
-    current_start = startdate
+    if h_steps is None:
+        h_steps = [0, 6, 12, 18]
+    if steps is None:
+        steps = [0]
+
+    downloaded_data_path = os.path.join(target_path, 'temp_downloaded')
+    if not os.path.exists(downloaded_data_path):
+        os.makedirs(downloaded_data_path)
+
+    ext = 'grb' if grb else 'nc'
+    # chunks in the manifest are only reused for requests with these settings
+    settings = {'product': 'ERAINT', 'variables': variables,
+                'h_steps': list(h_steps), 'format': 'grib' if grb else 'netcdf',
+                'type': type, 'steps': list(steps), 'grid_size': grid_size}
+    if manifest is not None:
+        manifest = DownloadManifest(manifest)
+
+    days = day_range(startdate, enddate)
+    done = set()
+    if skip_existing and split:
+        done = complete_days(target_path, ext, h_steps, startdate, enddate)
+
+    chunks = []
+    if manifest is not None and skip_existing:
+        files, done = reusable_downloads(manifest, settings, days, done,
+                                         downloaded_data_path)
+        if split:
+            chunks = [(None, None, dl_file) for dl_file in files]
+
+    for run in _day_runs([d for d in days if d not in done], max_days=31):
+        fname = '{start}_{end}.{ext}'.format(start=run[0].strftime("%Y%m%d"),
+                                             end=run[-1].strftime("%Y%m%d"),
+                                             ext=ext)
+        chunks.append((run[0], run[-1],
+                       os.path.join(downloaded_data_path, fname)))
+
+    if grb:
+        def split_func(dl_file):
+            save_gribs_from_grib(dl_file, target_path, 'ERAINT')
+    else:
+        def split_func(dl_file):
+            save_ncs_from_nc(dl_file, target_path, 'ERAINT')
 
-    while current_start <= enddate:
-        current_end = current_start + td
-        if current_end >= enddate:
-            current_end = enddate
+    failed = {}
+    for current_start, current_end, dl_file in chunks:
+        name = os.path.basename(dl_file)
 
-        fname = '{start}_{end}.{ext}'.format(start=current_start.strftime("%Y%m%d"),
-                                             end=current_end.strftime(
-                                                 "%Y%m%d"),
-                                             ext='grb' if grb else 'nc')
+        if current_start is not None:
+            if manifest is not None:
+                request = dict(settings)
+                request['days'] = [d.strftime('%Y-%m-%d') for d in
+                                   day_range(current_start, current_end)]
+                manifest.update(name, request=request, status='requested')
 
-        downloaded_data_path = os.path.join(target_path, 'temp_downloaded')
-        if not os.path.exists(downloaded_data_path):
-            os.mkdir(downloaded_data_path)
+            def download():
+                download_eraint(dl_file, current_start, current_end,
+                                variables, grid_size=grid_size,
+                                h_steps=h_steps, type=type, steps=steps,
+                                grb=grb, dry_run=dry_run)
 
-        dl_file = os.path.join(downloaded_data_path, fname)
+            error = download_with_retry(download, dl_file, tries=tries,
+                                        delay=retry_delay)
+            if error is not None:
+                mark_failed(failed, name, error, manifest)
+                continue
+            if manifest is not None:
+                manifest.record_download(name, dl_file)
 
-        download_eraint(dl_file, current_start, current_end, variables,
-                        grid_size=grid_size, h_steps=h_steps, type=type,
-                        steps=steps, grb=grb, dry_run=dry_run)
+        if split:
+            split_download(dl_file, split_func, failed, manifest,
+                           keep_original=keep_original)
 
-        if grb:
-            save_gribs_from_grib(dl_file, target_path, 'ERAINT')
-        else:
-            save_ncs_from_nc(dl_file, target_path, 'ERAINT')
+    if split and not keep_original and \
+            len(os.listdir(downloaded_data_path)) == 0:
+        os.rmdir(downloaded_data_path)
 
-        if not keep_original:
-            shutil.rmtree(downloaded_data_path)
-        current_start = current_end + timedelta(days=1)
+    return failed
 
 
 def parse_args(args):
@@ -246,6 +348,15 @@ def parse_args(args):
     parser.add_argument("--grid_size", type=float, default=None, nargs='+',
                         help=("lon lat. Size of the grid that the data is stored to. "
                               "Should be at least (and is by default) (0.75, 0.75) for ERA-Interim "))
+    parser.add_argument("--split", type=str2bool, default='True',
+                        help=("Split the downloaded files into one file per image. If False, the "
+                              "downloaded files are kept in localroot/temp_downloaded, they can be "
+                              "converted with eraint_reshuffle --from_monthly True. Default: True"))
+    parser.add_argument("--skip_existing", type=str2bool, default='True',
+                        help=("Request only days for which not all images exist in localroot yet. "
+                              "Downloads are recorded in localroot/download_manifest.json, files that "
+                              "were downloaded but not split by an interrupted run are split first. "
+                              "Default: True"))
 
     args = parser.parse_args(args)
 
@@ -261,15 +372,19 @@ def parse_args(args):
 def main(args):
     args = parse_args(args)
 
-    download_and_move(target_path=args.localroot,
-                      startdate=args.start,
-                      enddate=args.end,
-                      variables=args.variables,
-                      keep_original=args.keep_original,
-                      grid_size=args.grid_size,
-                      h_steps=args.h_steps,
-                      type=args.type,
-                      grb=args.as_grib)
+    failed = download_and_move(target_path=args.localroot,
+                               startdate=args.start,
+                               enddate=args.end,
+                               variables=args.variables,
+                               keep_original=args.keep_original,
+                               grid_size=args.grid_size,
+                               h_steps=args.h_steps,
+                               type=args.type,
+                               grb=args.as_grib,
+                               split=args.split,
+                               manifest=os.path.join(args.localroot, manifest_name),
+                               skip_existing=args.skip_existing)
+    print_failed_chunks(failed)
 
 
 def run():
@@ -21,7 +21,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from ecmwf_models.interface import ERANcImg, ERANcDs, ERAGrbImg, ERAGrbDs
+import numpy as np
+from ecmwf_models.interface import ERANcImg, ERANcDs, ERAGrbImg, ERAGrbDs, \
+    ERANcMonthlyDs, ERAGrbMonthlyDs
 
 '''
 This module contains ERA Interim specific child classes of the netcdf and grib
@@ -30,7 +32,8 @@ base classes, that are used for reading all ecmwf products.
 
 class ERAIntNcImg(ERANcImg):
     def __init__(self, filename, parameter=['swvl1', 'swvl2'], mode='r',
-                 subgrid=None, mask_seapoints=False, array_1D=False):
+                 subgrid=None, mask_seapoints=False, array_1D=False,
+                 dtype=np.float32):
 
         product = 'ERAINT'
         super(ERAIntNcImg, self).__init__(filename=filename,
@@ -39,12 +42,15 @@ class ERAIntNcImg(ERANcImg):
                                           mode=mode,
                                           subgrid=subgrid,
                                           mask_seapoints=mask_seapoints,
-                                          array_1D=array_1D)
+                                          array_1D=array_1D,
+                                          dtype=dtype)
 
 
 class ERAIntNcDs(ERANcDs):
     def __init__(self, root_path, parameter=['swvl1', 'swvl2'], subgrid=None,
-                 mask_seapoints=False, h_steps=[0, 6, 12, 18], array_1D=False):
+                 mask_seapoints=False, h_steps=[0, 6, 12, 18], array_1D=False,
+                 lsm_file=None, file_index=True, manifest=None,
+                 dtype=np.float32):
 
         product = 'ERAINT'
         super(ERAIntNcDs, self).__init__(root_path=root_path,
@@ -53,12 +59,17 @@ class ERAIntNcDs(ERANcDs):
                                          subgrid=subgrid,
                                          mask_seapoints=mask_seapoints,
                                          h_steps=h_steps,
-                                         array_1D=array_1D)
+                                         array_1D=array_1D,
+                                         lsm_file=lsm_file,
+                                         file_index=file_index,
+                                         manifest=manifest,
+                                         dtype=dtype)
 
 
 class ERAIntGrbImg(ERAGrbImg):
     def __init__(self, filename, parameter=['swvl1', 'swvl2'], mode='r',
-                 subgrid=None, mask_seapoints=False, array_1D=False):
+                 subgrid=None, mask_seapoints=False, array_1D=False,
+                 dtype=np.float32):
 
         product = 'ERAINT'
         super(ERAIntGrbImg, self).__init__(filename=filename,
@@ -67,12 +78,15 @@ class ERAIntGrbImg(ERAGrbImg):
                                            mode=mode,
                                            subgrid=subgrid,
                                            mask_seapoints=mask_seapoints,
-                                           array_1D=array_1D)
+                                           array_1D=array_1D,
+                                           dtype=dtype)
 
 
 class ERAIntGrbDs(ERAGrbDs):
     def __init__(self, root_path, parameter=['swvl1', 'swvl2'], subgrid=None,
-                 mask_seapoints=False,  h_steps=[0, 6, 12, 18], array_1D=False):
+                 mask_seapoints=False,  h_steps=[0, 6, 12, 18], array_1D=False,
+                 lsm_file=None, file_index=True, manifest=None,
+                 dtype=np.float32):
 
         product = 'ERAINT'
         super(ERAIntGrbDs, self).__init__(root_path=root_path,
@@ -81,4 +95,43 @@ class ERAIntGrbDs(ERAGrbDs):
                                           subgrid=subgrid,
                                           mask_seapoints=mask_seapoints,
                                           h_steps=h_steps,
-                                          array_1D=array_1D)
+                                          array_1D=array_1D,
+                                          lsm_file=lsm_file,
+                                          file_index=file_index,
+                                          manifest=manifest,
+                                          dtype=dtype)
+
+
+class ERAIntNcMonthlyDs(ERANcMonthlyDs):
+    def __init__(self, root_path, parameter=['swvl1', 'swvl2'], subgrid=None,
+                 mask_seapoints=False, h_steps=[0, 6, 12, 18], array_1D=False,
+                 lsm_file=None, slab_size=24, dtype=np.float32):
+
+        product = 'ERAINT'
+        super(ERAIntNcMonthlyDs, self).__init__(root_path=root_path,
+                                                product=product,
+                                                parameter=parameter,
+                                                subgrid=subgrid,
+                                                mask_seapoints=mask_seapoints,
+                                                h_steps=h_steps,
+                                                array_1D=array_1D,
+                                                lsm_file=lsm_file,
+                                                slab_size=slab_size,
+                                                dtype=dtype)
+
+
+class ERAIntGrbMonthlyDs(ERAGrbMonthlyDs):
+    def __init__(self, root_path, parameter=['swvl1', 'swvl2'], subgrid=None,
+                 mask_seapoints=False, h_steps=[0, 6, 12, 18], array_1D=False,
+                 lsm_file=None, dtype=np.float32):
+
+        product = 'ERAINT'
+        super(ERAIntGrbMonthlyDs, self).__init__(root_path=root_path,
+                                                 product=product,
+                                                 parameter=parameter,
+                                                 subgrid=subgrid,
+                                                 mask_seapoints=mask_seapoints,
+                                                 h_steps=h_steps,
+                                                 array_1D=array_1D,
+                                                 lsm_file=lsm_file,
+                                                 dtype=dtype)
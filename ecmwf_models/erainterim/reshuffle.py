@@ -26,21 +26,21 @@ Module for a command line interface to convert the ERA Interim data into a
 time series format using the repurpose package
 '''
 
-import os
 import sys
 import argparse
-import numpy as np
 
-from pygeogrids import BasicGrid
+from ecmwf_models.erainterim.interface import ERAIntGrbDs, ERAIntNcDs, \
+    ERAIntGrbMonthlyDs, ERAIntNcMonthlyDs
+from ecmwf_models.utils import mkdate, parse_filetype, str2bool, \
+    parse_memory
+from ecmwf_models.reshuffle import reshuffle_dataset
 
-from repurpose.img2ts import Img2Ts
-from ecmwf_models.erainterim.interface import ERAIntGrbDs, ERAIntNcDs
-from ecmwf_models.utils import mkdate, parse_filetype
-from datetime import time, datetime
 
 
 def reshuffle(input_root, outputpath, startdate, enddate, variables,
-              mask_seapoints=False, h_steps=[0, 6, 12, 18], imgbuffer=50):
+              mask_seapoints=False, h_steps=[0, 6, 12, 18], imgbuffer=50,
+              land_only=False, lsm_threshold=0.5, workers=1, append=False,
+              resume=False, max_memory=None, from_monthly=False):
     """
     Reshuffle method applied to ERA images for conversion into netcdf time
     series format.
@@ -65,42 +65,53 @@ def reshuffle(input_root, outputpath, startdate, enddate, variables,
         How many images to read at once before writing time series. This number
         affects how many images are stored in memory and should be chosen according
         to the available amount of memory and the size of a single image.
+    land_only: bool, optional (default: False)
+        Read and store only points over land, detected from the land-sea mask
+        (lsm) in the first image. Points over water are not in the time series.
+    lsm_threshold: float, optional (default: 0.5)
+        Points with a land-sea mask value above this threshold are land points,
+        only used when land_only is selected.
+    workers: int, optional (default: 1)
+        Number of processes, the cells (time series files) are split into
+        groups that are reshuffled in parallel. Each process reads only the
+        points of its cells from the images.
+    append: bool, optional (default: False)
+        Extend existing time series in the output path: only images after the
+        last time stamp in the time series files are read and appended. The
+        points and variables must match the existing time series.
+    resume: bool, optional (default: False)
+        Continue an interrupted run from the checkpoint in the output path.
+        The checkpoint is written after each chunk of imgbuffer images was
+        written to all time series files. Time stamps after the checkpoint
+        (chunks that were only written to some cells) are removed from the
+        time series files, then the images after the checkpoint are read.
+    max_memory: int, optional (default: None)
+        Maximum memory usage in bytes. If passed, imgbuffer is replaced by
+        the largest number of images that fits into this memory, computed
+        from the number of points and variables in the first image.
+    from_monthly: bool, optional (default: False)
+        Read the images directly from the multi-time files in input_root,
+        e.g. the monthly files of the download (temp_downloaded), instead
+        of the images that were split from them.
     """
 
     filetype = parse_filetype(input_root)
 
     if filetype == 'grib':
-        input_dataset = ERAIntGrbDs(root_path=input_root, parameter=variables,
-                                    subgrid=None, array_1D=True,
-                                    mask_seapoints=mask_seapoints,
-                                    h_steps=h_steps)
+        ds_class = ERAIntGrbMonthlyDs if from_monthly else ERAIntGrbDs
     elif filetype == 'netcdf':
-        input_dataset = ERAIntNcDs(root_path=input_root, parameter=variables,
-                                   subgrid=None, array_1D=True,
-                                   mask_seapoints=mask_seapoints,
-                                   h_steps=h_steps)
+        ds_class = ERAIntNcMonthlyDs if from_monthly else ERAIntNcDs
     else:
         raise Exception('Unknown file format')
 
-    if not os.path.exists(outputpath):
-        os.makedirs(outputpath)
-
+    ds_kwargs = {'root_path': input_root, 'parameter': variables,
+                 'h_steps': h_steps, 'mask_seapoints': mask_seapoints}
     global_attr = {'product': 'ERA Interim (from {})'.format(filetype)}
 
-    # get time series attributes from first day of data.
-    first_date_time = datetime.combine(startdate.date(), time(h_steps[0], 0))
-
-    data = input_dataset.read(first_date_time)
-    ts_attributes = data.metadata
-
-    grid = BasicGrid(data.lon, data.lat)
-
-    reshuffler = Img2Ts(input_dataset=input_dataset, outputpath=outputpath,
-                        startdate=startdate, enddate=enddate, input_grid=grid,
-                        imgbuffer=imgbuffer, cellsize_lat=5.0, cellsize_lon=5.0,
-                        ts_dtypes=np.dtype('float32'), global_attr=global_attr,
-                        zlib=True, unlim_chunksize=1000, ts_attributes=ts_attributes)
-    reshuffler.calc()
+    reshuffle_dataset(ds_class, ds_kwargs, outputpath, startdate, enddate,
+                      global_attr, imgbuffer=imgbuffer, land_only=land_only,
+                      lsm_threshold=lsm_threshold, workers=workers,
+                      append=append, resume=resume, max_memory=max_memory)
 
 
 def parse_args(args):
@@ -143,6 +154,31 @@ def parse_args(args):
                         help=("How many images to read at once. Bigger numbers make the "
                               "conversion faster but consume more memory. Choose this according to your "
                               "system and the size of a single image."))
+    parser.add_argument("--land_only", type=str2bool, default='False',
+                        help=("Store only time series for points over land. Land points are "
+                              "detected from the lsm variable in the first file of the image data, "
+                              "points over water are not read and not stored."))
+    parser.add_argument("--lsm_threshold", type=float, default=0.5,
+                        help=("Land-sea mask value above which a point is considered as land "
+                              "point when --land_only is used. Default: 0.5"))
+    parser.add_argument("--workers", type=int, default=1,
+                        help=("Number of processes that reshuffle groups of cells in parallel. "
+                              "Default: 1"))
+    parser.add_argument("--append", type=str2bool, default='False',
+                        help=("Extend the existing time series in timeseries_root with the images "
+                              "after their last time stamp (up to end). Points and variables must "
+                              "match the existing time series."))
+    parser.add_argument("--resume", type=str2bool, default='False',
+                        help=("Continue an interrupted conversion from the checkpoint in "
+                              "timeseries_root, with the same arguments as the interrupted run."))
+    parser.add_argument("--max_memory", type=parse_memory, default=None,
+                        help=("Maximum memory to use, e.g. 16G. The number of images that are read "
+                              "at once is chosen from the size of the first image, so that the "
+                              "conversion fits into this memory (replaces --imgbuffer)."))
+    parser.add_argument("--from_monthly", type=str2bool, default='False',
+                        help=("Read the images directly from the multi-time files in dataset_root, e.g. "
+                              "the monthly files of the download (temp_downloaded), instead of the "
+                              "images that were split from them."))
     args = parser.parse_args(args)
 
     print("Converting data from {} to {} into {}."
@@ -161,7 +197,14 @@ def main(args):
               variables=args.variables,
               mask_seapoints=args.mask_seapoints,
               h_steps=args.h_steps,
-              imgbuffer=args.imgbuffer)
+              imgbuffer=args.imgbuffer,
+              land_only=args.land_only,
+              lsm_threshold=args.lsm_threshold,
+              workers=args.workers,
+              append=args.append,
+              resume=args.resume,
+              max_memory=args.max_memory,
+              from_monthly=args.from_monthly)
 
 
 def run():
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2019, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Index of the image files in a directory tree of downloaded ERA images
+(root/%Y/%j/*_%Y%m%d_%H%M.ext), so that files are found without searching
+the file system for each time stamp. Multi-time files (e.g. the monthly
+files of a download) are indexed by the time steps that they contain.
+'''
+
+import os
+import re
+import json
+import bisect
+import tempfile
+from datetime import datetime
+from netCDF4 import Dataset, num2date
+from ecmwf_models.grib_index import grib_timestamps
+
+_manifest_version = 1
+
+
+class ImageFileIndex(object):
+    """
+    Sorted index of time stamps and image files in a root directory.
+    The directory tree is scanned once, the index can be stored in a manifest
+    file, that is updated when new day directories are found. Day directories
+    that are scanned again after a failed lookup are stored in the manifest by
+    flush or refresh.
+
+    Parameters
+    ----------
+    root_path : str
+        Root directory of the images, with sub directories per year and day
+        of year.
+    fname_templ : str, optional (default: '*_{datetime}.nc')
+        Template of the image file names, '*' matches any characters.
+    datetime_format : str, optional (default: '%Y%m%d_%H%M')
+        Format of the date in the file names.
+    manifest : str, optional (default: None)
+        Path to a manifest file, where the index is stored. If None is passed,
+        the index is only kept in memory.
+    """
+    def __init__(self, root_path, fname_templ='*_{datetime}.nc',
+                 datetime_format='%Y%m%d_%H%M', manifest=None):
+
+        self.root_path = root_path
+        self.datetime_format = datetime_format
+        self.manifest = manifest
+
+        dt_pattern = re.escape(datetime_format)
+        for directive, digits in [('%Y', 4), ('%j', 3), ('%m', 2), ('%d', 2),
+                                  ('%H', 2), ('%M', 2), ('%S', 2)]:
+            dt_pattern = dt_pattern.replace(re.escape(directive),
+                                            r'\d{%i}' % digits)
+        pattern = re.escape(fname_templ).replace(r'\*', '.*')
+        pattern = pattern.replace(re.escape('{datetime}'),
+                                  '(?P<datetime>' + dt_pattern + ')')
+        self._fname_pattern = re.compile('^' + pattern + '$')
+
+        # files per day directory ('%Y/%j'), by datetime string
+        self._days = None
+        # day directories that were scanned again after a lookup failed
+        self._rescanned = set()
+        # the index has changes that are not in the manifest yet
+        self._modified = False
+        self._index = {}
+        self._timestamps = []
+
+    def _scan_day(self, day):
+        """
+        List the image files in a day directory.
+        """
+        files = {}
+        path = os.path.join(self.root_path, day)
+        for fname in sorted(os.listdir(path)):
+            match = self._fname_pattern.match(fname)
+            if match is None:
+                continue
+            try:
+                datetime.strptime(match.group('datetime'),
+                                  self.datetime_format)
+            except ValueError:
+                continue
+            files.setdefault(match.group('datetime'), []).append(fname)
+        return files
+
+    def _list_days(self):
+        """
+        List all day directories (%Y/%j) in the root directory.
+        """
+        days = []
+        if not os.path.isdir(self.root_path):
+            return days
+        for year in sorted(os.listdir(self.root_path)):
+            year_path = os.path.join(self.root_path, year)
+            if not (len(year) == 4 and year.isdigit() and
+                    os.path.isdir(year_path)):
+                continue
+            for doy in sorted(os.listdir(year_path)):
+                if len(doy) == 3 and doy.isdigit() and \
+                        os.path.isdir(os.path.join(year_path, doy)):
+                    days.append('/'.join([year, doy]))
+        return days
+
+    def _load_manifest(self):
+        """
+        Load the index from the manifest file, if there is one for the root
+        directory.
+        """
+        if self.manifest is None or not os.path.exists(self.manifest):
+            return None
+        try:
+            with open(self.manifest, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if manifest.get('version') != _manifest_version or \
+                manifest.get('root_path') != os.path.abspath(self.root_path):
+            return None
+        return manifest['days']
+
+    def _write_manifest(self):
+        """
+        Store the index in the manifest file (through a temporary file, so
+        that other processes never read an incomplete manifest).
+        """
+        if self.manifest is None:
+            return
+        manifest = {'version': _manifest_version,
+                    'root_path': os.path.abspath(self.root_path),
+                    'days': self._days}
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.manifest)),
+                prefix='.tmp_manifest_')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f)
+            os.rename(tmp_path, self.manifest)
+        except (IOError, OSError):
+            pass
+
+    def _update_index(self):
+        """
+        Update the sorted time stamps and the file lookup from the scanned
+        day directories.
+        """
+        self._index = {}
+        for day, files in self._days.items():
+            for dt_string, fnames in files.items():
+                timestamp = datetime.strptime(dt_string, self.datetime_format)
+                self._index[timestamp] = [os.path.join(self.root_path, day, f)
+                                          for f in fnames]
+        self._timestamps = sorted(self._index.keys())
+
+    def _index_day(self, day, files):
+        """
+        Replace the entries of one day directory in the index.
+        """
+        for dt_string in self._days.get(day, {}):
+            timestamp = datetime.strptime(dt_string, self.datetime_format)
+            if self._index.pop(timestamp, None) is not None:
+                del self._timestamps[bisect.bisect_left(self._timestamps,
+                                                        timestamp)]
+        self._days[day] = files
+        for dt_string, fnames in files.items():
+            timestamp = datetime.strptime(dt_string, self.datetime_format)
+            if timestamp not in self._index:
+                bisect.insort(self._timestamps, timestamp)
+            self._index[timestamp] = [os.path.join(self.root_path, day, f)
+                                      for f in fnames]
+
+    def flush(self):
+        """
+        Store the days that were scanned again in the manifest, e.g. after
+        looking up a batch of time stamps.
+        """
+        if self._modified:
+            self._write_manifest()
+            self._modified = False
+
+    def refresh(self, full=False):
+        """
+        Update the index. Only day directories that are not in the index yet
+        are scanned, e.g. after new days were downloaded.
+
+        Parameters
+        ----------
+        full : bool, optional (default: False)
+            Scan all day directories again.
+        """
+        if self._days is None and not full:
+            self._days = self._load_manifest()
+        if self._days is None or full:
+            self._days = {}
+
+        new_days = [day for day in self._list_days() if day not in self._days]
+        for day in new_days:
+            self._days[day] = self._scan_day(day)
+
+        if new_days or full or self._modified:
+            self._write_manifest()
+            self._modified = False
+        self._update_index()
+
+    def _rescan_day(self, timestamp):
+        """
+        Scan the day directory of a time stamp again, if this was not done
+        yet, e.g. because files were added after the index was created.
+        Days that were not downloaded yet are checked again on each call.
+        Only the entries of the day are replaced in the index, the manifest
+        is written by flush or refresh.
+        """
+        day = '/'.join([timestamp.strftime('%Y'), timestamp.strftime('%j')])
+        if day in self._rescanned or \
+                not os.path.isdir(os.path.join(self.root_path, day)):
+            return
+        self._rescanned.add(day)
+        self._index_day(day, self._scan_day(day))
+        self._modified = True
+
+    def _ensure_index(self):
+        if self._days is None:
+            self.refresh()
+
+    def timestamps(self, start_date=None, end_date=None):
+        """
+        Sorted time stamps of all indexed images (between two dates).
+
+        Parameters
+        ----------
+        start_date : datetime, optional (default: None)
+            First date to include.
+        end_date : datetime, optional (default: None)
+            Last date to include.
+
+        Returns
+        ----------
+        timestamps : list
+            Sorted list of time stamps.
+        """
+        self._ensure_index()
+        return [t for t in self._timestamps
+                if (start_date is None or t >= start_date) and
+                (end_date is None or t <= end_date)]
+
+    def exists(self, timestamp):
+        """
+        Check if there is an image file for the passed time stamp.
+        """
+        self._ensure_index()
+        if timestamp not in self._index:
+            self._rescan_day(timestamp)
+        return timestamp in self._index
+
+    def filename(self, timestamp):
+        """
+        Get the path to the image file for a time stamp.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Time stamp of the image.
+
+        Returns
+        ----------
+        filename : str
+            Path to the image file.
+        """
+        if not self.exists(timestamp):
+            raise IOError("No file found for {}".format(timestamp.ctime()))
+        filenames = self._index[timestamp]
+        if len(filenames) > 1:
+            raise IOError("File search is ambiguous {}".format(filenames))
+        return filenames[0]
+
+
+def nc_timestamps(dataset):
+    """
+    Time stamps of the time steps in a netcdf file.
+
+    Parameters
+    ----------
+    dataset : netCDF4.Dataset
+        The opened netcdf file.
+
+    Returns
+    ----------
+    timestamps : list
+        datetimes of the time steps, in the order of the time dimension.
+        Empty if the file has no time variable.
+    """
+    if 'time' not in dataset.variables.keys():
+        return []
+    time = dataset.variables['time']
+    dates = num2date(time[:].ravel(), time.units,
+                     only_use_cftime_datetimes=False,
+                     only_use_python_datetimes=True)
+    return list(dates)
+
+
+class TimeStackFileIndex(object):
+    """
+    Index of the time steps in the multi-time image files of a directory,
+    e.g. the monthly files of a download (temp_downloaded), before they are
+    split into one file per image. Each time stamp is looked up as the file
+    and the position of the time step in the file.
+
+    Parameters
+    ----------
+    root_path : str
+        Directory where the multi-time files are stored.
+    fname_templ : str, optional (default: '*.nc')
+        Template of the file names, '*' matches any characters. Files
+        ending with .nc are read as netcdf, all others as grib files.
+    """
+    def __init__(self, root_path, fname_templ='*.nc'):
+
+        self.root_path = root_path
+        pattern = re.escape(fname_templ).replace(r'\*', '.*')
+        self._fname_pattern = re.compile('^' + pattern + '$')
+
+        # (file, position) of the time steps, by time stamp
+        self._index = None
+        self._timestamps = []
+
+    def _file_timestamps(self, filename):
+        """
+        Read the time stamps of the time steps in a file.
+        """
+        if os.path.splitext(filename)[1] == '.nc':
+            with Dataset(filename, mode='r') as dataset:
+                return nc_timestamps(dataset)
+        return grib_timestamps(filename)
+
+    def refresh(self):
+        """
+        Scan the directory and read the time steps of all files again.
+        """
+        self._index = {}
+        if os.path.isdir(self.root_path):
+            fnames = sorted(os.listdir(self.root_path))
+        else:
+            fnames = []
+        for fname in fnames:
+            filename = os.path.join(self.root_path, fname)
+            if self._fname_pattern.match(fname) is None or \
+                    not os.path.isfile(filename):
+                continue
+            for position, timestamp in enumerate(
+                    self._file_timestamps(filename)):
+                self._index.setdefault(timestamp, []).append(
+                    (filename, position))
+        self._timestamps = sorted(self._index.keys())
+
+    def _ensure_index(self):
+        if self._index is None:
+            self.refresh()
+
+    def timestamps(self, start_date=None, end_date=None):
+        """
+        Sorted time stamps of all time steps in the files (between two dates).
+
+        Parameters
+        ----------
+        start_date : datetime, optional (default: None)
+            First date to include.
+        end_date : datetime, optional (default: None)
+            Last date to include.
+
+        Returns
+        ----------
+        timestamps : list
+            Sorted list of time stamps.
+        """
+        self._ensure_index()
+        return [t for t in self._timestamps
+                if (start_date is None or t >= start_date) and
+                (end_date is None or t <= end_date)]
+
+    def exists(self, timestamp):
+        """
+        Check if there is a time step for the passed time stamp.
+        """
+        self._ensure_index()
+        return timestamp in self._index
+
+    def flush(self):
+        """
+        The index of the time stacks is not stored, there is nothing to
+        write (same interface as ImageFileIndex).
+        """
+        pass
+
+    def locate(self, timestamp):
+        """
+        Get the file and the position of the time step for a time stamp.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Time stamp of the image.
+
+        Returns
+        ----------
+        filename : str
+            Path to the file that contains the time step.
+        position : int
+            Position of the time step in the file.
+        """
+        if not self.exists(timestamp):
+            raise IOError("No file found for {}".format(timestamp.ctime()))
+        locations = self._index[timestamp]
+        if len(locations) > 1:
+            raise IOError("File search is ambiguous {}".format(
+                [filename for filename, _ in locations]))
+        return locations[0]
+
+    def filename(self, timestamp):
+        """
+        Get the path to the file that contains the time step of a time stamp.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Time stamp of the image.
+
+        Returns
+        ----------
+        filename : str
+            Path to the multi-time file.
+        """
+        return self.locate(timestamp)[0]
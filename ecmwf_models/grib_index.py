@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2019, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Index of the messages in grib files, so that single parameters can be read
+from a file without decoding all other messages in it.
+The index of a file is stored next to it (as <filename>.index.json), or in a
+central directory (see grib_index_store_path) if the data is not writable.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import warnings
+from datetime import datetime
+try:
+    import pygrib
+except ImportError:
+    warnings.warn("pygrib has not been imported")
+
+# indices that were already loaded in this process, by file name
+_index_cache = {}
+_index_version = 2
+
+# keys of the grid definition section, that identify the geometry of a message
+_grid_keys = ['gridType', 'N', 'Ni', 'Nj', 'numberOfPoints',
+              'latitudeOfFirstGridPointInDegrees',
+              'longitudeOfFirstGridPointInDegrees',
+              'latitudeOfLastGridPointInDegrees',
+              'longitudeOfLastGridPointInDegrees']
+
+
+def grib_index_store_path():
+    '''
+    Directory where the message indices of grib files are stored, that can
+    not be stored next to the files (e.g. read-only archives). Can be changed
+    with the environment variable ECMWF_MODELS_GRIB_INDEX_STORE, setting it
+    to an empty string keeps the indices of these files in memory only.
+
+    Returns
+    ----------
+    path : str or None
+        Versioned index store directory, None if the store is deactivated.
+    '''
+    root = os.environ.get('ECMWF_MODELS_GRIB_INDEX_STORE',
+                          os.path.join(os.path.expanduser('~'),
+                                       '.ecmwf_models', 'grib_index'))
+    if not root:
+        return None
+    return os.path.join(root, 'v{}'.format(_index_version))
+
+
+def grib_index_path(filename):
+    """
+    Path of the index file for a grib file, next to the file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the grib file.
+
+    Returns
+    ----------
+    index_path : str
+        Path to the index file.
+    """
+    return filename + '.index.json'
+
+
+def _index_next_to_data():
+    """
+    Indices are written next to the grib files, unless the environment
+    variable ECMWF_MODELS_GRIB_INDEX is set to an empty string or 0, e.g. for
+    data directories that must not be changed. Then only the index store is
+    used.
+    """
+    return os.environ.get('ECMWF_MODELS_GRIB_INDEX', '1') not in ['', '0']
+
+
+def _index_paths(filename):
+    """
+    Paths where the index of a grib file is looked for, in this order.
+    """
+    paths = [grib_index_path(filename)] if _index_next_to_data() else []
+    store_file = grib_index_store_file(filename)
+    if store_file is not None:
+        paths.append(store_file)
+    return paths
+
+
+def grib_index_store_file(filename):
+    """
+    Path of the index file for a grib file in the index store, the index
+    files are named after the hash of the absolute path of the grib file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the grib file.
+
+    Returns
+    ----------
+    index_path : str or None
+        Path to the index file, None if the index store is deactivated.
+    """
+    store = grib_index_store_path()
+    if store is None:
+        return None
+    path_hash = hashlib.sha1(
+        os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(store, path_hash + '.json')
+
+
+def grid_definition_hash(message):
+    """
+    Hash of the grid definition of a grib message. Messages with the same
+    hash have the same geometry (lat/lon coordinates).
+
+    Parameters
+    ----------
+    message : pygrib.gribmessage
+        The message to hash the grid definition for.
+
+    Returns
+    ----------
+    grid_hash : str
+        Hex digest of the grid definition.
+    """
+    definition = []
+    for key in _grid_keys:
+        try:
+            value = message[key] if message.has_key(key) else None
+        except (RuntimeError, KeyError):  # key exists but is not set
+            value = None
+        definition.append('{}={}'.format(key, value))
+
+    return hashlib.sha1(';'.join(definition).encode('utf-8')).hexdigest()[:16]
+
+
+def _find_message_start(f, pos, blocksize=65536):
+    """
+    Find the start of the next grib message at or after the passed position.
+    """
+    f.seek(pos)
+    while True:
+        block = f.read(blocksize)
+        if len(block) < 4:
+            raise IOError('No grib message found after byte {}'.format(pos))
+        i = block.find(b'GRIB')
+        if i >= 0:
+            return pos + i
+        pos += len(block) - 3
+        f.seek(pos)
+
+
+def _message_entry(message):
+    """
+    Index entry of a grib message, without its position in the file.
+    """
+    dt = datetime.strptime('{:08d}{:04d}'.format(
+        int(message['dataDate']), int(message['dataTime'])), '%Y%m%d%H%M')
+    return {'short_name': str(message.short_name),
+            'level': int(message['level']),
+            'datetime': dt.strftime('%Y-%m-%dT%H:%M'),
+            'grid': grid_definition_hash(message)}
+
+
+def build_grib_index(filename):
+    """
+    Scan all messages in a grib file and collect their byte offsets, lengths,
+    short names, levels, dates and grid definition hashes.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the grib file.
+
+    Returns
+    ----------
+    messages : list
+        One dict per message in the file, with the keys 'short_name',
+        'level', 'datetime' (%Y-%m-%dT%H:%M), 'grid' (see
+        grid_definition_hash), 'offset' and 'length'.
+    """
+    messages = []
+    grbs = pygrib.open(filename)
+    with open(filename, 'rb') as f:
+        pos = 0
+        for message in grbs:
+            offset = _find_message_start(f, pos)
+            entry = _message_entry(message)
+            entry['offset'] = offset
+            entry['length'] = int(message['totalLength'])
+            messages.append(entry)
+            pos = offset + entry['length']
+    grbs.close()
+
+    return messages
+
+
+def _write_index(filename, index):
+    """
+    Write the index of a grib file next to it, or to the index store if the
+    directory of the file is not writable. Files are written to a temporary
+    file first, so that no incomplete index is read by other processes. If
+    neither is writable, the index is not stored.
+    """
+    for path in _index_paths(filename):
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                            prefix='.tmp_index_')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.rename(tmp_path, path)
+            return
+        except (IOError, OSError):
+            continue
+
+
+def _read_index(filename, size, mtime):
+    """
+    Read the stored index of a grib file (next to it or in the index store),
+    None is returned if there is no index or if it does not describe the
+    current version of the file.
+    """
+    for path in _index_paths(filename):
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r') as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+        if index.get('version') == _index_version and \
+                index.get('size') == size and index.get('mtime') == mtime:
+            return index
+    return None
+
+
+def get_grib_index(filename, build=True):
+    """
+    Get the message index of a grib file. The index is loaded from memory or
+    disk or created (and stored) if it does not exist yet or the file was
+    changed after it was indexed.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the grib file.
+    build : bool, optional (default: True)
+        Create the index if there is none for the current version of the
+        file. If False, None is returned instead.
+
+    Returns
+    ----------
+    messages : list or None
+        Index entries as created by build_grib_index.
+    """
+    stat = os.stat(filename)
+    size, mtime = stat.st_size, stat.st_mtime
+
+    index = _index_cache.get(filename)
+    if index is None or index['size'] != size or index['mtime'] != mtime:
+        index = _read_index(filename, size, mtime)
+        if index is None:
+            if not build:
+                return None
+            index = {'version': _index_version, 'size': size, 'mtime': mtime,
+                     'messages': build_grib_index(filename)}
+            _write_index(filename, index)
+        _index_cache[filename] = index
+
+    return index['messages']
+
+
+def grib_timestamps(filename):
+    """
+    Time stamps of the messages in a grib file, e.g. of the time steps in a
+    multi-time (monthly) file. Only the message index of the file is read.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the grib file.
+
+    Returns
+    ----------
+    timestamps : list
+        Distinct datetimes of the messages, in the order of the file.
+    """
+    timestamps, seen = [], set()
+    for entry in get_grib_index(filename):
+        if entry['datetime'] in seen:
+            continue
+        seen.add(entry['datetime'])
+        timestamps.append(datetime.strptime(entry['datetime'],
+                                            '%Y-%m-%dT%H:%M'))
+    return timestamps
+
+
+def _select_time_step(entries, timestamp, filename):
+    """
+    Select the time step (%Y-%m-%dT%H:%M) of the entries of a multi-time file
+    to read, the passed time stamp or the first one if None is passed. None
+    is returned for files with a single time step.
+    """
+    dt_strings = set(entry['datetime'] for entry in entries)
+    if len(dt_strings) <= 1:
+        return None
+    if timestamp is None:
+        return entries[0]['datetime']
+    select = timestamp.strftime('%Y-%m-%dT%H:%M')
+    if select not in dt_strings:
+        raise IOError("No time step for {} in {}".format(
+            timestamp.ctime(), filename))
+    return select
+
+
+def read_grib_messages(filename, short_names, timestamp=None,
+                       build_index=True):
+    """
+    Read only the messages of the passed parameters from a grib file. For
+    files with more than one time step (e.g. monthly downloads), only the
+    messages of one time step are read.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the grib file.
+    short_names : list
+        Short names of the parameters to read.
+    timestamp : datetime, optional (default: None)
+        Time stamp of the messages to read from multi-time files. If None is
+        passed, the messages of the first time step are read.
+    build_index : bool, optional (default: True)
+        Create the message index of the file if there is none. If False,
+        files without an index are read in one pass instead, which is faster
+        for files that are read only once (e.g. single time step images).
+
+    Yields
+    ----------
+    entry : dict
+        Index entry of the message.
+    message : pygrib.gribmessage
+        The decoded message.
+
+    Raises
+    ----------
+    IOError
+        If a multi-time file does not contain the passed time stamp.
+    """
+    index = get_grib_index(filename, build=build_index)
+    if index is None:
+        grbs = pygrib.open(filename)
+        messages = [(_message_entry(message), message) for message in grbs
+                    if message.short_name in short_names]
+        grbs.close()
+        select = _select_time_step([entry for entry, _ in messages],
+                                   timestamp, filename)
+        for entry, message in messages:
+            if select is None or entry['datetime'] == select:
+                yield entry, message
+        return
+
+    entries = [entry for entry in index if entry['short_name'] in short_names]
+    select = _select_time_step(entries, timestamp, filename)
+    if select is not None:
+        entries = [entry for entry in entries if entry['datetime'] == select]
+    if len(entries) == 0:
+        return
+
+    with open(filename, 'rb') as f:
+        for entry in entries:
+            f.seek(entry['offset'])
+            yield entry, pygrib.fromstring(f.read(entry['length']))
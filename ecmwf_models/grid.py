@@ -25,36 +25,189 @@
 Common grid definitions for ECMWF model reanalysis products (regular gridded)
 '''
 
+import os
+import shutil
+import hashlib
+import tempfile
+import warnings
 import numpy as np
-from pygeogrids.grids import BasicGrid
+from pygeogrids.grids import BasicGrid, CellGrid
 
+# process-wide cache of image grids, so that a grid is only created once
+# for all images of a stack (see get_cached_grid)
+_grid_cache = {}
+_grid_cache_stats = {'hits': 0, 'misses': 0}
+
+# version of the on-disk grid store format, change when the layout changes
+_grid_store_version = 1
 
-def get_grid_resolution(lats, lons):
-    lats = np.unique(lats)
-    lons = np.unique(lons)
-    lats_res, lons_res = [], []
-
-    for i, j in zip(lats[:-1], lats[1:]):
-        lats_res.append(np.abs(np.abs(j)-np.abs(i)))
-    lats_res = np.round(np.array(lats_res), 3)
-    if not all(lats_res == lats_res[0]):
-        raise ValueError('Grid not regular')
-    else:
-        lat_res = lats_res[0]
 
-    for i, j in zip(lons[:-1], lons[1:]):
-        lons_res.append(np.abs(np.abs(j)-np.abs(i)))
-    lons_res = np.round(np.array(lons_res), 3)
-    if not all(lons_res == lons_res[0]):
+# (nlat, nlon): (res_lat, res_lon) of the global regular grids of the products
+_known_grid_shapes = {(721, 1440): (0.25, 0.25),  # ERA5
+                      (241, 480): (0.75, 0.75)}  # ERA-Interim
+
+
+def _axis_resolution(axis):
+    # resolution along a coordinate axis, raises ValueError if not regular
+    res = np.round(np.abs(np.diff(axis)), 3)
+    if res.size == 0 or not np.all(res == res[0]):
         raise ValueError('Grid not regular')
+    return res[0]
+
+
+def _coord_axes(lats, lons):
+    # reduce the passed coordinates to one lat and one lon axis vector
+    if lats.ndim == 2:
+        # 2D coordinate fields, lat varies along rows, lon along columns
+        return lats[:, 0], lons[0, :]
+
+    axes = []
+    for coords in (lats, lons):
+        d = np.diff(coords)
+        if np.all(d > 0) or np.all(d < 0):
+            axes.append(coords)  # already a (monotonic) axis vector
+        else:
+            axes.append(np.unique(coords))  # flattened coordinates
+    return tuple(axes)
+
+
+def _lon_conventions(lons):
+    # the longitudes of a grid across the dateline (or the 0 meridian) wrap at
+    # +-180 (or 360), they are continuous in one of the two conventions
+    yield lons
+    yield np.mod(lons, 360.)
+    yield np.mod(lons + 180., 360.) - 180.
+
+
+def get_grid_resolution(lats, lons):
+    '''
+    Detect the resolution of a regular grid from its coordinates.
+
+    Parameters
+    ----------
+    lats : np.array
+        Latitude axis vector (1D), flattened latitudes of all grid points (1D)
+        or 2D latitude field.
+    lons : np.array
+        Longitude axis vector (1D), flattened longitudes of all grid points (1D)
+        or 2D longitude field.
+
+    Returns
+    ----------
+    lat_res : float
+        Resolution in Y direction
+    lon_res : float
+        Resolution in X direction
+    '''
+    lats, lons = np.asarray(lats), np.asarray(lons)
+
+    if lats.ndim == 2:
+        shape = lats.shape
+    elif lats.size != lons.size:  # axis vectors
+        shape = (lats.size, lons.size)
     else:
-        lon_res = lons_res[0]
-    return lat_res, lon_res
+        shape = None
+
+    # early exit for the global grids of ERA5 and ERA Interim
+    if shape in _known_grid_shapes:
+        res_lat, res_lon = _known_grid_shapes[shape]
+        lat_ends = (lats.flat[0], lats.flat[-1])
+        lon_span = np.abs(lons.flat[shape[1] - 1] - lons.flat[0])
+        if np.allclose(np.abs(lat_ends), 90.) and \
+                np.isclose(lon_span, 360. - res_lon):
+            return res_lat, res_lon
 
+    res_lat = _axis_resolution(_coord_axes(lats, lons)[0])
+    for lons in _lon_conventions(lons):
+        try:
+            return res_lat, _axis_resolution(_coord_axes(lats, lons)[1])
+        except ValueError:
+            continue
+    raise ValueError('Grid not regular')
 
-def ERA_RegularImgGrid(res_lat=0.25, res_lon=0.25):
+
+def grid_store_path():
+    '''
+    Directory where created grids are stored, to be loaded in later processes.
+    Can be changed with the environment variable ECMWF_MODELS_GRID_STORE,
+    setting it to an empty string deactivates the grid store.
+
+    Returns
+    ----------
+    path : str or None
+        Versioned grid store directory, None if the store is deactivated.
     '''
-    Create ECMWF regular cell grid
+    root = os.environ.get('ECMWF_MODELS_GRID_STORE',
+                          os.path.join(os.path.expanduser('~'),
+                                       '.ecmwf_models', 'grids'))
+    if not root:
+        return None
+    return os.path.join(root, 'v{}'.format(_grid_store_version))
+
+
+def _remove_stored_grid(path):
+    # move the entry out of the way first, so that no other process loads a
+    # partially removed grid
+    try:
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path))
+        os.rename(path, os.path.join(tmp_path, 'grid'))
+        shutil.rmtree(tmp_path)
+    except (IOError, OSError):  # removed by another process in the meantime
+        pass
+
+
+def _load_stored_grid(name):
+    # load grid arrays as read-only memory maps, None if not stored (yet).
+    # Corrupt entries are removed, so that the grid is created and stored
+    # again.
+    store = grid_store_path()
+    if store is None:
+        return None
+    path = os.path.join(store, name)
+    if not os.path.isdir(path):
+        return None
+
+    try:
+        arrs = {}
+        for f in os.listdir(path):
+            arrs[os.path.splitext(f)[0]] = np.load(os.path.join(path, f),
+                                                   mmap_mode='r')
+        return CellGrid(arrs['lon'], arrs['lat'], arrs['cell'],
+                        gpis=arrs.get('gpi', None))
+    except (IOError, OSError, ValueError, KeyError) as e:
+        warnings.warn('Stored grid {} is corrupt, creating it again: '
+                      '{}'.format(path, e))
+        _remove_stored_grid(path)
+        return None
+
+
+def _store_grid(name, grid):
+    # write grid arrays to the store, files are moved in place when complete,
+    # so that other processes never load a partially written grid
+    store = grid_store_path()
+    if store is None:
+        return
+    try:
+        if not os.path.exists(store):
+            os.makedirs(store)
+        tmp_path = tempfile.mkdtemp(dir=store)
+        np.save(os.path.join(tmp_path, 'lon.npy'), grid.arrlon)
+        np.save(os.path.join(tmp_path, 'lat.npy'), grid.arrlat)
+        np.save(os.path.join(tmp_path, 'cell.npy'), grid.arrcell)
+        if not grid.gpidirect:
+            np.save(os.path.join(tmp_path, 'gpi.npy'), grid.gpis)
+        try:
+            os.rename(tmp_path, os.path.join(store, name))
+        except OSError:  # stored by another process in the meantime
+            shutil.rmtree(tmp_path)
+    except (IOError, OSError) as e:
+        warnings.warn('Could not store grid {} in {}: {}'.format(name, store, e))
+
+
+def ERA_RegularImgGrid(res_lat=0.25, res_lon=0.25, extent=None):
+    '''
+    Create ECMWF regular cell grid. The grid is stored in the grid store
+    (see grid_store_path) and loaded from there when it was already created.
 
     Parameters
     ----------
@@ -62,33 +215,261 @@ def ERA_RegularImgGrid(res_lat=0.25, res_lon=0.25):
         Resolution in Y direction
     res_lon : float, optional (default: 0.25)
         Resolution in X direction
+    extent : tuple, optional (default: None)
+        (lat first, lat last, lon first, lon last) of a regional image, in the
+        order of the image rows and columns (e.g. of a download with an area).
+        None for the global grid (90..-90, 0..360).
 
     Returns
     ----------
     CellGrid : pygeogrids.CellGrid
-        Regular, global CellGrid with 5DEG*5DEG cells
+        Regular CellGrid with 5DEG*5DEG cells, the gpis are the indices of
+        the points in the flattened image.
     '''
+    name = 'regular_{:.3f}_{:.3f}'.format(res_lat, res_lon)
+    if extent is not None:
+        name += '_{:.3f}_{:.3f}_{:.3f}_{:.3f}'.format(*extent)
+    grid = _load_stored_grid(name)
+    if grid is not None:
+        return grid
 
-    lon = np.arange(0, 360 - res_lon / 2, res_lon)
-    lat = np.arange(90, -1 * 90 - res_lat / 2, -1 * res_lat)
+    if extent is None:
+        lon = np.arange(0, 360 - res_lon / 2, res_lon)
+        lat = np.arange(90, -1 * 90 - res_lat / 2, -1 * res_lat)
+    else:
+        lat_first, lat_last, lon_first, lon_last = extent
+        if lon_last < lon_first:  # image crosses the border of the lon range
+            lon_last += 360.
+        lat = np.linspace(lat_first, lat_last,
+                          int(round(abs(lat_last - lat_first) / res_lat)) + 1)
+        lon = np.linspace(lon_first, lon_last,
+                          int(round((lon_last - lon_first) / res_lon)) + 1)
     lons_gt_180 = np.where(lon > 180.0)
     lon[lons_gt_180] = lon[lons_gt_180] - 360
 
     lon, lat = np.meshgrid(lon, lat)
 
-    return BasicGrid(lon.flatten(), lat.flatten()).to_cell_grid(cellsize=5.)
+    grid = BasicGrid(lon.flatten(), lat.flatten(),
+                     setup_kdTree=False).to_cell_grid(cellsize=5.)
+    _store_grid(name, grid)
+
+    return grid
 
 
 def ERA_IrregularImgGrid(lons, lats):
+    '''
+    Create ECMWF cell grid from the passed coordinates. The grid is stored in
+    the grid store (see grid_store_path) and loaded from there when it was
+    already created from the same coordinates.
+
+    Parameters
+    ----------
+    lons : np.array
+        Longitudes of all grid points (0..360 or -180..180)
+    lats : np.array
+        Latitudes of all grid points
+
+    Returns
+    ----------
+    CellGrid : pygeogrids.CellGrid
+        CellGrid with 5DEG*5DEG cells
+    '''
+    lons = np.array(lons, dtype=np.float64).flatten()
+    lats = np.array(lats, dtype=np.float64).flatten()
+
+    coords_hash = hashlib.sha1(lons.tobytes() + lats.tobytes()).hexdigest()
+    name = 'irregular_{}'.format(coords_hash[:16])
+    grid = _load_stored_grid(name)
+    if grid is not None:
+        return grid
+
     lons_gt_180 = np.where(lons > 180.0)
     lons[lons_gt_180] = lons[lons_gt_180] - 360
-    return BasicGrid(lons.flatten(), lats.flatten()).to_cell_grid(cellsize=5.)
 
+    grid = BasicGrid(lons, lats, setup_kdTree=False).to_cell_grid(cellsize=5.)
+    _store_grid(name, grid)
+
+    return grid
+
+
+def ERA_LandGrid(lsm, lons, lats, threshold=0.5):
+    '''
+    Create a cell grid that contains only land points, derived from the
+    land-sea mask (param: 172) of a (global) image. The gpis of the land
+    points are the same as in the full grid of the image, so the land grid can
+    be passed as a subgrid to the image readers and the reshuffle module.
+
+    Parameters
+    ----------
+    lsm : np.array
+        Land-sea mask values (0 - 1) for all points of the image
+    lons : np.array
+        Longitudes of all points of the image
+    lats : np.array
+        Latitudes of all points of the image
+    threshold : float, optional (default: 0.5)
+        Points with a land-sea mask value above this threshold are land points.
+
+    Returns
+    ----------
+    CellGrid : pygeogrids.CellGrid
+        Land points subgrid with 5DEG*5DEG cells
+    '''
+    grid = ERA_IrregularImgGrid(lons, lats)
+    land = np.asarray(lsm).flatten() > threshold
+
+    return grid.subgrid_from_gpis(grid.activegpis[land])
+
+
+def get_cached_grid(key, create_grid, *args, **kwargs):
+    '''
+    Look up a grid in the process-wide grid cache. If there is no grid stored
+    for the passed key, it is created with the passed function and stored.
+
+    Parameters
+    ----------
+    key : tuple
+        Hashable key that identifies the grid, e.g. (resolution, extent,
+        subgrid identity).
+    create_grid : callable
+        Function that creates the grid, called as create_grid(*args, **kwargs)
+        if the key is not in the cache yet.
+
+    Returns
+    ----------
+    grid : pygeogrids.CellGrid
+        The cached (or newly created) grid
+    '''
+    try:
+        grid = _grid_cache[key]
+        _grid_cache_stats['hits'] += 1
+    except KeyError:
+        _grid_cache_stats['misses'] += 1
+        grid = create_grid(*args, **kwargs)
+        _grid_cache[key] = grid
 
-def ERA_LandGrid():
-    # use land mask (param: 172) to detect land points and create a subgrid that
-    # is passe to the reshuffle module.
-    raise NotImplementedError
-    # TODO: add function to generate TS from land points only, so that points over
-    # TODO: water are not only replaced by NaN, but not in the time series files.
+    return grid
+
+
+def _is_global_extent(extent, res_lon):
+    # images with the layout of the global ERA_RegularImgGrid (90..-90, 0..360)
+    return np.allclose(extent, (90., -90., 0., 360. - res_lon), atol=1e-3)
+
+
+def ERA_CachedImgGrid(res_lat, res_lon, extent=None, subgrid=None):
+    '''
+    Get the grid for an image with the passed resolution and extent from the
+    grid cache. The regular grid is only created once per process, if a subgrid
+    is passed, it is used instead of the global grid. Images that are not
+    global or have another layout (e.g. -180..180) get a grid of their extent.
+
+    Parameters
+    ----------
+    res_lat : float
+        Resolution in Y direction
+    res_lon : float
+        Resolution in X direction
+    extent : tuple, optional (default: None)
+        (lat first, lat last, lon first, lon last) of the image, None for the
+        global image (90..-90, 0..360).
+    subgrid : pygeogrids.CellGrid, optional (default: None)
+        Grid that is used instead of the regular grid.
+
+    Returns
+    ----------
+    CellGrid : pygeogrids.CellGrid
+        Cached grid for reading images
+    '''
+    if extent is not None:
+        extent = tuple(float(np.round(e, 3)) for e in extent)
 
+    # the cache holds a reference to the subgrid, so its id is not reused
+    key = ('regular', float(res_lat), float(res_lon), extent,
+           None if subgrid is None else id(subgrid))
+
+    if subgrid is not None:
+        return get_cached_grid(key, lambda: subgrid)
+    elif extent is None or _is_global_extent(extent, res_lon):
+        return get_cached_grid(key, ERA_RegularImgGrid, res_lat, res_lon)
+    else:
+        return get_cached_grid(key, ERA_RegularImgGrid, res_lat, res_lon,
+                               extent=extent)
+
+
+def _subgrid_window(subgrid, nlat, nlon):
+    # rows and columns of the subgrid points in the image
+    rows, cols = np.divmod(np.asarray(subgrid.activegpis), nlon)
+    if rows.size == 0 or rows.max() >= nlat:
+        raise ValueError('Subgrid does not fit into an image with shape '
+                         '({}, {})'.format(nlat, nlon))
+
+    lat_slice = slice(rows.min(), rows.max() + 1)
+
+    # smallest (circular) range of columns, i.e. skip the largest gap, so that
+    # a region crossing the image border in lon is not read as global window
+    ucols = np.unique(cols)
+    gaps = np.diff(np.append(ucols, ucols[0] + nlon))
+    start = ucols[(np.argmax(gaps) + 1) % ucols.size]
+    end = ucols[np.argmax(gaps)] + 1
+    if start < end:
+        lon_slices = [slice(start, end)]
+        wcols = cols - start
+    else:
+        lon_slices = [slice(start, nlon), slice(0, end)]
+        wcols = np.where(cols >= start, cols - start, cols + nlon - start)
+
+    ncols = sum(s.stop - s.start for s in lon_slices)
+    index = (rows - lat_slice.start) * ncols + wcols
+
+    return {'lat': lat_slice, 'lon': lon_slices, 'index': index,
+            'grid': subgrid}
+
+
+def get_subgrid_window(subgrid, nlat, nlon):
+    '''
+    Get the index window of the subgrid points in an image of the passed shape
+    from the grid cache. The gpis of the subgrid must be the indices of the
+    points in the flattened (global) image, as for subgrids of
+    ERA_RegularImgGrid and ERA_LandGrid.
+
+    Parameters
+    ----------
+    subgrid : pygeogrids.CellGrid
+        Grid of points to read from the image.
+    nlat : int
+        Number of rows (latitudes) in the image.
+    nlon : int
+        Number of columns (longitudes) in the image.
+
+    Returns
+    ----------
+    window : dict
+        'lat': slice of rows, 'lon': list of slices of columns (two if the
+        window crosses the image border in lon), 'index': index of the
+        subgrid points in the flattened window data.
+    '''
+    key = ('window', id(subgrid), nlat, nlon)
+    return get_cached_grid(key, _subgrid_window, subgrid, nlat, nlon)
+
+
+def grid_cache_info():
+    '''
+    Statistics on the usage of the process-wide grid cache.
+
+    Returns
+    ----------
+    info : dict
+        Number of cache 'hits', 'misses' and the number of cached grids 'size'.
+    '''
+    info = dict(_grid_cache_stats)
+    info['size'] = len(_grid_cache)
+    return info
+
+
+def clear_grid_cache():
+    '''
+    Remove all grids from the grid cache and reset the statistics.
+    '''
+    _grid_cache.clear()
+    _grid_cache_stats['hits'] = 0
+    _grid_cache_stats['misses'] = 0
@@ -22,26 +22,159 @@
 
 import warnings
 import os
+import threading
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from pygeobase.io_base import ImageBase, MultiTemporalImageBase
 from pygeobase.object_base import Image
 import numpy as np
-from datetime import timedelta
 
 from pygeogrids.netcdf import load_grid
 from pynetcf.time_series import GriddedNcOrthoMultiTs
-from ecmwf_models.grid import ERA_RegularImgGrid, get_grid_resolution, ERA_IrregularImgGrid
+from ecmwf_models.grid import ERA_CachedImgGrid, get_grid_resolution, \
+    ERA_IrregularImgGrid, get_cached_grid, get_subgrid_window
 from datetime import datetime
 from ecmwf_models.utils import lookup
+from ecmwf_models.grib_index import get_grib_index, read_grib_messages
+from ecmwf_models.file_index import ImageFileIndex, TimeStackFileIndex, \
+    nc_timestamps
+from netCDF4 import Dataset
 import xarray as xr
 try:
-    import pygrib
+    import dask.array as da
+    from dask import delayed
 except ImportError:
-    warnings.warn("pygrib has not been imported")
+    warnings.warn("dask has not been imported")
 
 '''
 Base classes for reading downloaded ERA netcdf and grib images and 6H image stacks
 '''
 
+
+# attributes that describe the packing of netcdf variables, not the data
+_packing_attrs = ['scale_factor', 'add_offset', '_FillValue', 'missing_value']
+
+# netcdf files are only accessed by one thread at a time
+_netcdf_lock = threading.Lock()
+
+
+def _packing(variable):
+    """
+    Packing attributes (scale_factor, add_offset, fill values) of a netcdf
+    variable, read while the file is open so that the data can be unpacked
+    after it is closed.
+    """
+    return dict([(attr, variable.getncattr(attr)) for attr in _packing_attrs
+                 if attr in variable.ncattrs()])
+
+
+def _read_window(variable, window=None, time_index=None):
+    """
+    Read the raw (packed) data of a netcdf variable (in the passed subgrid
+    index window) as 1D array of the points. This is the only part of reading
+    a netcdf image that needs the lock of the netcdf library, the data is
+    unpacked afterwards with _unpack.
+
+    Parameters
+    ----------
+    variable : netCDF4.Variable
+        Variable to read, automatic masking and scaling must be deactivated.
+    window : dict, optional (default: None)
+        Index window as returned by ecmwf_models.grid.get_subgrid_window,
+        None to read the full image.
+    time_index : int or slice, optional (default: None)
+        Position of the time step to read from a variable with a (first)
+        time dimension. For a slice, the contiguous time steps are read into
+        a 2D array (time, points).
+
+    Returns
+    ----------
+    raw : np.array
+        Raw data for all points (of the window)
+    """
+    if time_index is None:
+        time_sel, shape = (), (-1,)
+    else:
+        time_sel = (time_index,)
+        n_times = len(range(*time_index.indices(variable.shape[0]))) \
+            if isinstance(time_index, slice) else None
+        shape = (-1,) if n_times is None else (n_times, -1)
+
+    if window is None:
+        return variable[time_sel + (Ellipsis,)].reshape(shape)
+
+    raw = [variable[time_sel + (window['lat'], lon_slice)]
+           for lon_slice in window['lon']]
+    if len(raw) > 1:
+        raw = np.concatenate(raw, axis=-1)
+    else:
+        raw = raw[0]
+    return raw.reshape(shape)[..., window['index']]
+
+
+def _unpack(raw, packing, dtype=np.float32, out=None):
+    """
+    Unpack raw (packed) data of a netcdf variable into the passed dtype.
+    Packed (integer) data is scaled directly into the output buffer and fill
+    values are set to nan.
+
+    Parameters
+    ----------
+    raw : np.array
+        Raw data as stored in the file.
+    packing : dict
+        Packing attributes of the variable, as returned by _packing.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type of the returned data.
+    out : np.array, optional (default: None)
+        Array of the same shape as raw, to write the unpacked data into
+        (e.g. a row of a block of images), if None is passed, a new array
+        is created.
+
+    Returns
+    ----------
+    data : np.array
+        Unpacked data
+    """
+    data = np.empty(raw.shape, dtype=dtype) if out is None else out
+    if 'scale_factor' in packing:
+        np.multiply(raw, packing['scale_factor'], out=data, casting='unsafe')
+    else:
+        data[:] = raw
+    if 'add_offset' in packing:
+        data += np.array(packing['add_offset'], dtype=data.dtype)
+
+    for fill_attr in ['_FillValue', 'missing_value']:
+        if fill_attr in packing:
+            np.putmask(data, raw == packing[fill_attr], np.nan)
+
+    return data
+
+
+def _grib_img_grid(message):
+    """
+    Create the image grid for the geometry of a grib message.
+
+    Parameters
+    ----------
+    message : pygrib.gribmessage
+        Message to read the lat/lon coordinates from.
+
+    Returns
+    ----------
+    grid : pygeogrids.CellGrid
+        Regular grid or irregular grid (e.g. reduced gaussian) of the message.
+    """
+    lats, lons = message.latlons()
+    extent = (lats[0, 0], lats[-1, -1], lons[0, 0], lons[-1, -1])
+    try:
+        res_lat, res_lon = get_grid_resolution(lats, lons)
+        return ERA_CachedImgGrid(res_lat, res_lon, extent=extent)
+    except ValueError:  # when grid not regular
+        return ERA_IrregularImgGrid(lons, lats)
+
+
 class ERANcImg(ImageBase):
     """
     Reader for a single ERA netcdf file.
@@ -63,9 +196,17 @@ class ERANcImg(ImageBase):
         This option needs the 'lsm' parameter to be in the file!
     array_1D: bool, optional (default: False)
         Read data as list, instead of 2D array, used for reshuffling.
+    sea_mask : np.array, optional (default: None)
+        Static 1D mask, True for points (of the subgrid) over water, that is
+        used instead of the land-sea mask in the file when mask_seapoints is
+        selected.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type of the returned data, data is unpacked and masked in this
+        type.
     """
     def __init__(self, filename, product, parameter=['swvl1', 'swvl2'], mode='r',
-                 subgrid=None, mask_seapoints=False, array_1D=False):
+                 subgrid=None, mask_seapoints=False, array_1D=False,
+                 sea_mask=None, dtype=np.float32):
 
         super(ERANcImg, self).__init__(filename, mode=mode)
 
@@ -78,67 +219,179 @@ class ERANcImg(ImageBase):
         self.mask_seapoints = mask_seapoints
         self.array_1D = array_1D
         self.subgrid = subgrid
+        self.sea_mask = sea_mask
+        self.dtype = dtype
 
-    def read(self, timestamp=None):
-        '''
-        Read data from the loaded image file.
-
-        Parameters
-        ---------
-        timestamp : datetime, optional (default: None)
-            Specific date (time) to read the data for.
-        '''
-        return_img = {}
-        return_metadata = {}
+    def _read_raw(self, dataset, timestamp, time_slice, metadata):
+        """
+        Read the raw data of the selected parameters (and the land-sea mask)
+        from an open netcdf file, called while the netcdf lock is held.
 
-        try:
-            dataset = xr.open_dataset(self.filename, engine='netcdf4',
-                                      mask_and_scale=True)
-        except IOError as e:
-            print(e)
-            print(" ".join([self.filename, "can not be opened"]))
-            raise e
+        Returns
+        ----------
+        raw : dict
+            Raw (packed) data of the parameters in the file.
+        packing : dict
+            Packing attributes of the parameters.
+        dims : tuple
+            Time stamp(s), time index, lats and lons of the read data.
+        lsm : tuple or None
+            Raw data and packing of the land-sea mask, if it is needed to mask
+            the data.
+        """
+        # data is unpacked in _unpack
+        dataset.set_auto_maskandscale(False)
+
+        # multi-time files (e.g. monthly downloads) contain more than one
+        # time step, single images are split from them without time
+        # dimension or with a time dimension of length 1.
+        if time_slice is not None:
+            time_index = time_slice
+            timestamp = nc_timestamps(dataset)[time_slice]
+        elif 'time' in dataset.dimensions.keys() and \
+                len(dataset.dimensions['time']) > 1:
+            file_timestamps = nc_timestamps(dataset)
+            if timestamp is None:
+                time_index = 0
+            elif timestamp in file_timestamps:
+                time_index = file_timestamps.index(timestamp)
+            else:
+                raise IOError("No time step for {} in {}".format(
+                    timestamp.ctime(), self.filename))
+        else:
+            time_index = None
 
-        res_lat, res_lon = get_grid_resolution(dataset.variables['latitude'][:],
-                                               dataset.variables['longitude'][:])
+        lats = dataset.variables['latitude'][:]
+        lons = dataset.variables['longitude'][:]
 
-        grid = ERA_RegularImgGrid(
-            res_lat, res_lon) if not self.subgrid else self.subgrid
+        # read only the slab of the file that contains the subgrid
+        if self.subgrid is None:
+            window = None
+        else:
+            window = get_subgrid_window(self.subgrid, lats.size, lons.size)
 
-        if self.mask_seapoints:
+        lsm = None
+        if self.mask_seapoints and self.sea_mask is None:
             if 'lsm' not in dataset.variables.keys():
                 raise IOError(
                     'No land sea mask parameter (lsm) in passed image for masking.')
-            else:
-                sea_mask = dataset.variables['lsm'].values
+            variable = dataset.variables['lsm']
+            # the mask is static, it is taken from the first time step
+            lsm = (_read_window(variable, window,
+                                time_index=0 if time_index is not None and
+                                'time' in variable.dimensions else None),
+                   _packing(variable))
+
+        # read only the selected parameters, not all variables in the file
+        raw, packing = {}, {}
+        for name in self.parameter:
+            if name not in dataset.variables.keys():
+                continue
+            variable = dataset.variables[name]
+            raw[name] = _read_window(
+                variable, window, time_index=time_index
+                if 'time' in variable.dimensions else None)
+            packing[name] = _packing(variable)
+            metadata[name] = dict([(attr, variable.getncattr(attr))
+                                   for attr in variable.ncattrs()
+                                   if attr not in _packing_attrs])
+
+        return raw, packing, (timestamp, time_index, lats, lons), lsm
+
+    def _read(self, timestamp=None, out=None, time_slice=None):
+        """
+        Read the selected parameters for the time stamp (or the time steps in
+        the slice of a multi-time file).
 
-        for name in dataset.variables:
-            if name in self.parameter:
-                variable = dataset[name]
+        Returns
+        ----------
+        grid : pygeogrids.CellGrid
+            Grid of the read points.
+        data : dict
+            1D (or 2D for a time slice) arrays of the parameters.
+        metadata : dict
+            Attributes of the parameters.
+        timestamps : datetime or list
+            The passed time stamp or the time stamps of the slice.
+        """
+        return_img = {}
+        return_metadata = {}
+        if out is None:
+            out = {}
+
+        # the netcdf / hdf5 libraries are not thread safe, files are only
+        # opened and read by one thread at a time. The raw data is unpacked
+        # and masked after the lock is released.
+        with _netcdf_lock:
+            try:
+                dataset = Dataset(self.filename, mode='r')
+            except IOError as e:
+                print(e)
+                print(" ".join([self.filename, "can not be opened"]))
+                raise e
+
+            try:
+                raw, packing, dims, lsm = self._read_raw(
+                    dataset, timestamp, time_slice, return_metadata)
+            finally:
+                dataset.close()
+
+        timestamp, time_index, lats, lons = dims
+        res_lat, res_lon = get_grid_resolution(lats, lons)
+
+        # the grid is the same for all images, so it is only created once
+        grid = ERA_CachedImgGrid(res_lat, res_lon,
+                                 extent=(lats[0], lats[-1], lons[0], lons[-1]),
+                                 subgrid=self.subgrid)
+
+        sea_mask = self.sea_mask
+        if self.mask_seapoints and sea_mask is None:
+            sea_mask = _unpack(*lsm) == 0
+
+        if isinstance(time_index, slice):
+            shape = (len(timestamp), grid.activegpis.size)
+        else:
+            shape = grid.activegpis.size
+
+        for name in self.parameter:
+            if name not in raw:
+                path, thefile = os.path.split(self.filename)
+                warnings.warn('Cannot load variable {var} from file {thefile}. '
+                              'Filling image with NaNs.'.format(var=name, thefile=thefile))
+                if name in out:
+                    out[name][:] = np.nan
+                    return_img[name] = out[name]
+                else:
+                    return_img[name] = np.full(shape, np.nan, dtype=self.dtype)
+                return_metadata[name] = {}
+                continue
 
-                param_data = variable.data
+            param_data = _unpack(raw[name], packing[name], dtype=self.dtype,
+                                 out=out.get(name))
 
-                if self.mask_seapoints:
-                    param_data = np.ma.array(param_data, mask=np.logical_not(sea_mask),
-                                             fill_value=np.nan)
-                    param_data = param_data.filled()
+            if self.mask_seapoints:
+                param_data[..., sea_mask] = np.nan
 
-                param_data = param_data.flatten()
+            return_img[str(name)] = param_data
 
-                return_metadata[name] = variable.attrs
-                return_img.update(
-                    dict([(str(name), param_data[grid.activegpis])]))
+        return grid, return_img, return_metadata, timestamp
 
-                try:
-                    return_img[name]
-                except KeyError:
-                    path, thefile = os.path.split(self.filename)
-                    warnings.warn('Cannot load variable {var} from file {thefile}. '
-                                  'Filling image with NaNs.'.format(var=name, thefile=thefile))
-                    return_img[name] = np.empty(
-                        grid.activegpis.size).fill(np.nan)
+    def read(self, timestamp=None, out=None):
+        '''
+        Read data from the loaded image file.
 
-        dataset.close()
+        Parameters
+        ---------
+        timestamp : datetime, optional (default: None)
+            Specific date (time) to read the data for. For files with more
+            than one time step, the time step of this time stamp is read (the
+            first one if None is passed).
+        out : dict, optional (default: None)
+            1D arrays (values) to read the data of the parameters (keys) into,
+            only used for 1D arrays.
+        '''
+        grid, return_img, return_metadata, timestamp = self._read(
+            timestamp, out=out)
 
         if self.array_1D:
             return Image(grid.activearrlon, grid.activearrlat,
@@ -156,6 +409,32 @@ class ERANcImg(ImageBase):
                          return_metadata,
                          timestamp)
 
+    def read_slab(self, start, stop):
+        '''
+        Read a contiguous slab of time steps from a multi-time file, one read
+        per parameter.
+
+        Parameters
+        ---------
+        start : int
+            Position of the first time step in the file.
+        stop : int
+            Position after the last time step in the file, slabs are cut at
+            the end of the file.
+
+        Returns
+        ---------
+        slab : pygeobase.object_base.Image
+            Image with arrays of shape (n_times, n_points) per parameter, 1D
+            lon/lat arrays of the points and the list of time stamps as
+            timestamp.
+        '''
+        grid, return_img, return_metadata, timestamps = self._read(
+            time_slice=slice(start, stop))
+
+        return Image(grid.activearrlon, grid.activearrlat,
+                     return_img, return_metadata, timestamps)
+
     def write(self, data):
         raise NotImplementedError()
 
@@ -166,7 +445,430 @@ class ERANcImg(ImageBase):
         pass
 
 
-class ERANcDs(MultiTemporalImageBase):
+def _read_image(ioclass, filename, ioclass_kws, timestamp, **kwargs):
+    """
+    Read a single image file, this is called by the workers of the parallel
+    image iterator of ERADs. Keywords are passed to the read function.
+    """
+    return ioclass(filename, mode='r', **ioclass_kws).read(timestamp=timestamp,
+                                                           **kwargs)
+
+
+# image reader of the worker processes of ERADs.iter_images
+_process_reader = {}
+
+
+def _init_process_reader(ioclass, ioclass_kws):
+    """
+    Store the image reader class and its keywords (e.g. subgrid, sea mask)
+    once per worker process, so that they are not sent with each image.
+    """
+    _process_reader['ioclass'] = ioclass
+    _process_reader['ioclass_kws'] = ioclass_kws
+
+
+def _process_read_image(filename, timestamp, **kwargs):
+    """
+    Read a single image file in a worker process, with the reader stored by
+    _init_process_reader.
+    """
+    return _read_image(_process_reader['ioclass'], filename,
+                       _process_reader['ioclass_kws'], timestamp, **kwargs)
+
+
+class ERADs(MultiTemporalImageBase):
+    """
+    Base class for reading stacks of ERA images, with static fields (i.e. the
+    land-sea mask) that are read once for the whole stack.
+
+    Parameters
+    ----------
+    root_path: str
+        Root path where image data is stored.
+    ioclass : class
+        Class for reading a single image (file).
+    fname_templ : str
+        Template for the image file names.
+    ioclass_kws : dict
+        Keyword arguments that are passed to the ioclass.
+    h_steps : list, optional (default: [0,6,12,18])
+        List of full hours for which images exist.
+    lsm_file : str, optional (default: None)
+        Image file to read the land-sea mask (lsm) from, when points over water
+        are masked. If None is passed, the land-sea mask from the first read
+        image is used for the whole stack.
+    file_index : bool, optional (default: True)
+        Scan the root directory once and look up image files in the index,
+        instead of searching the file system for each time stamp.
+    manifest : str, optional (default: None)
+        File to store the index of image files in, so that only new day
+        directories are scanned when the stack is opened again.
+    """
+    def __init__(self, root_path, ioclass, fname_templ, ioclass_kws,
+                 h_steps=[0, 6, 12, 18], lsm_file=None, file_index=True,
+                 manifest=None):
+
+        self.h_steps = h_steps
+        self.lsm_file = lsm_file
+
+        if file_index:
+            self.file_index = ImageFileIndex(root_path, fname_templ,
+                                             "%Y%m%d_%H%M", manifest=manifest)
+        else:
+            self.file_index = None
+
+        subpath_templ = ["%Y", "%j"]
+
+        # the static sea mask is passed to the image reader, once it is loaded
+        ioclass_kws['sea_mask'] = None
+
+        super(ERADs, self).__init__(root_path, ioclass,
+                                    fname_templ=fname_templ,
+                                    datetime_format="%Y%m%d_%H%M",
+                                    subpath_templ=subpath_templ,
+                                    exact_templ=False,
+                                    ioclass_kws=ioclass_kws)
+
+    def _build_filename(self, timestamp, custom_templ=None, str_param=None):
+        """
+        Get the image file for a time stamp from the file index (or search
+        for it, if the index is not used).
+        """
+        if self.file_index is None or custom_templ is not None or \
+                str_param is not None:
+            return super(ERADs, self)._build_filename(
+                timestamp, custom_templ=custom_templ, str_param=str_param)
+
+        return self.file_index.filename(timestamp)
+
+    def exists(self, timestamp):
+        """
+        Check if there is an image for the passed time stamp.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Time stamp of the image.
+
+        Returns
+        ----------
+        exists : bool
+            True if there is an image file for the time stamp.
+        """
+        if self.file_index is not None:
+            return self.file_index.exists(timestamp)
+        return len(self._search_files(timestamp)) == 1
+
+    def _read_sea_mask(self, timestamp, subgrid=None):
+        """
+        Read the static sea mask from the land-sea mask file, or the image
+        at the passed time stamp.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Time stamp of the image to read the land-sea mask from, if no
+            land-sea mask file was passed.
+        subgrid : pygeogrids.CellGrid, optional (default: None)
+            Subgrid to read the mask for, if None is passed, the subgrid of the
+            image reader is used.
+
+        Returns
+        ----------
+        sea_mask : np.array
+            1D mask that is True for points (of the subgrid) over water.
+        """
+        if self.lsm_file is None:
+            filename = self._build_filename(timestamp)
+        else:
+            filename = self.lsm_file
+
+        lsm_kws = dict(self.ioclass_kws)
+        lsm_kws.update({'parameter': 'lsm', 'mask_seapoints': False,
+                        'array_1D': True, 'sea_mask': None})
+        if subgrid is not None:
+            lsm_kws['subgrid'] = subgrid
+
+        # the time stamp selects the time step in multi-time files
+        lsm = self.ioclass(filename, **lsm_kws).read(
+            timestamp=timestamp if self.lsm_file is None else None)
+        if 'lsm' not in lsm.data.keys():
+            raise IOError(
+                'No land sea mask parameter (lsm) in {} for masking.'.format(filename))
+
+        return lsm.data['lsm'] == 0
+
+    def _load_sea_mask(self, timestamp):
+        """
+        Load the static sea mask for the image reader, if points over water
+        are masked and the mask was not loaded yet.
+        """
+        if self.ioclass_kws['mask_seapoints'] and \
+                self.ioclass_kws['sea_mask'] is None:
+            self.ioclass_kws['sea_mask'] = self._read_sea_mask(timestamp)
+
+    def read(self, timestamp, **kwargs):
+        """
+        Return an image for a specific timestamp.
+
+        Parameters
+        ----------
+        timestamp : datetime.datetime
+            Time stamp.
+
+        Returns
+        -------
+        image : object
+            pygeobase.object_base.Image object
+        """
+        self._load_sea_mask(timestamp)
+
+        return super(ERADs, self).read(timestamp, **kwargs)
+
+    def iter_images(self, start_date, end_date, workers=1, prefetch=None,
+                    processes=False, **kwargs):
+        """
+        Yield all images for a given date range, in the order of their time
+        stamps. If more than one worker (or a prefetch size) is passed, the
+        following images are read in the background while the current one is
+        processed.
+
+        Parameters
+        ----------
+        start_date : datetime
+            Start date
+        end_date : datetime
+            End date
+        workers : int, optional (default: 1)
+            Number of threads (or processes) that read images in parallel.
+        prefetch : int, optional (default: None)
+            Maximum number of images that are read ahead (and kept in memory)
+            at any time. By default 2 * workers.
+        processes : bool, optional (default: False)
+            Use a pool of processes instead of threads for reading. netcdf
+            files are opened and read by one thread at a time (the netcdf
+            library is not thread safe), threads only unpack and mask the
+            data in parallel, processes also read files in parallel. The
+            reader settings (e.g. subgrid, sea mask) are sent to each process
+            once.
+
+        Returns
+        -------
+        image : object
+            pygeobase.object_base.Image object
+        """
+        timestamps = self.tstamps_for_daterange(start_date, end_date)
+        if timestamps.size == 0:
+            raise IOError("no files found for given date range")
+
+        if workers <= 1 and prefetch is None:
+            for timestamp in timestamps:
+                yield self.read(timestamp, **kwargs)
+            return
+
+        # the mask must be available before images are read by the workers
+        self._load_sea_mask(timestamps[0])
+
+        if prefetch is None:
+            prefetch = 2 * workers
+        prefetch = max(prefetch, 1)
+
+        if processes:
+            pool = Pool(workers, initializer=_init_process_reader,
+                        initargs=(self.ioclass, self.ioclass_kws))
+        else:
+            pool = ThreadPool(workers)
+        pending = deque()
+        try:
+            for timestamp in timestamps:
+                filename = self._build_filename(timestamp)
+                if processes:
+                    task = (_process_read_image, (filename, timestamp))
+                else:
+                    task = (_read_image, (self.ioclass, filename,
+                                          self.ioclass_kws, timestamp))
+                pending.append(pool.apply_async(*task, kwds=kwargs))
+                # keep at most prefetch images in the queue
+                if len(pending) >= prefetch:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+    def read_block(self, start_date, end_date, parameters=None, subgrid=None):
+        """
+        Read all images between two dates into one block (2D array) per
+        parameter. The blocks are filled in place, image by image.
+        Missing images are filled with nan.
+
+        Parameters
+        ----------
+        start_date : datetime
+            Start date
+        end_date : datetime
+            End date
+        parameters : list or str, optional (default: None)
+            Parameters to read, if None are passed, the parameters of the
+            image reader are read.
+        subgrid : pygeogrids.CellGrid, optional (default: None)
+            Read only data for points of this grid, if None is passed, the
+            subgrid of the image reader is used.
+
+        Returns
+        -------
+        block : pygeobase.object_base.Image
+            Image with arrays (in the dtype of the reader) of shape
+            (n_times, n_points) per parameter, 1D lon/lat arrays of the points
+            and the list of time stamps as timestamp.
+        """
+        available, missing = self.available_tstamps(start_date, end_date)
+        if available.size == 0:
+            raise IOError("no files found for given date range")
+        if missing.size > 0:
+            warnings.warn('{} of {} images between {} and {} are missing, '
+                          'filling them with NaNs.'.format(
+                              missing.size, missing.size + available.size,
+                              start_date, end_date))
+
+        timestamps = np.sort(np.concatenate([available, missing]))
+        first = available[0].tolist()
+
+        kws = dict(self.ioclass_kws)
+        kws['array_1D'] = True
+        if parameters is not None:
+            kws['parameter'] = parameters
+        if subgrid is not None:
+            kws['subgrid'] = subgrid
+            if kws['mask_seapoints']:
+                kws['sea_mask'] = self._read_sea_mask(first, subgrid)
+        elif kws['mask_seapoints']:
+            self._load_sea_mask(first)
+            kws['sea_mask'] = self.ioclass_kws['sea_mask']
+
+        block = None
+        for i in np.flatnonzero(np.isin(timestamps, available)):
+            timestamp = timestamps[i].tolist()
+            filename = self._build_filename(timestamp)
+
+            reader = self.ioclass(filename, mode='r', **kws)
+            if block is None:
+                # the first image determines the points and the parameters
+                img = reader.read(timestamp=timestamp)
+                data = {}
+                for name in img.data.keys():
+                    data[name] = np.full((len(timestamps), img.lon.size),
+                                         np.nan, dtype=kws['dtype'])
+                    data[name][i] = img.data[name]
+                block = Image(img.lon, img.lat, data, img.metadata,
+                              timestamps.tolist())
+            else:
+                reader.read(timestamp=timestamp,
+                            out=dict([(name, block.data[name][i])
+                                      for name in block.data.keys()]))
+
+        return block
+
+    def tstamps_array(self, start_date, end_date):
+        """
+        Get all time stamps in the sub-daily resolution (h_steps) of the
+        images between 2 dates, whether the images exist or not.
+
+        Parameters
+        ----------
+        start_date: datetime
+            Start datetime, time stamps of the h_steps on the first day before
+            it are not included.
+        end_date: datetime
+            End datetime, time stamps of the h_steps on the last day are
+            included.
+
+        Returns
+        ----------
+        timestamps : np.array
+            Sorted datetime64 time stamps
+        """
+        start = np.datetime64(start_date, 's')
+        first_day = start.astype('datetime64[D]')
+        ndays = (np.datetime64(end_date, 'D') - first_day) // \
+            np.timedelta64(1, 'D')
+        if ndays < 0:
+            return np.array([], dtype='datetime64[s]')
+
+        days = first_day + np.arange(ndays + 1).astype('timedelta64[D]')
+        offsets = np.array(self.h_steps, dtype='timedelta64[h]')
+
+        timestamps = np.sort((days[:, np.newaxis] +
+                              offsets[np.newaxis, :]).ravel())
+        return timestamps[timestamps >= start].astype('datetime64[s]')
+
+    def available_tstamps(self, start_date, end_date):
+        """
+        Split the time stamps of images between 2 dates into time stamps of
+        available and of missing images, using the index of image files.
+
+        Parameters
+        ----------
+        start_date: datetime
+            Start datetime
+        end_date: datetime
+            End datetime
+
+        Returns
+        ----------
+        available : np.array
+            datetime64 time stamps of existing images
+        missing : np.array
+            datetime64 time stamps of missing images
+        """
+        timestamps = self.tstamps_array(start_date, end_date)
+
+        if self.file_index is None:
+            exists = np.array([self.exists(t) for t in timestamps.tolist()],
+                              dtype=bool)
+        else:
+            indexed = np.array(self.file_index.timestamps(),
+                               dtype='datetime64[s]')
+            exists = np.isin(timestamps, indexed)
+            # look for files that were added after the index was created
+            for i in np.flatnonzero(~exists):
+                exists[i] = self.file_index.exists(timestamps[i].tolist())
+            # days that were scanned again are stored once, after the batch
+            self.file_index.flush()
+
+        return timestamps[exists], timestamps[~exists]
+
+    def tstamps_for_daterange(self, start_date, end_date):
+        """
+        Get datetimes in the correct sub-daily resolution between 2 dates,
+        for which images exist (the available time stamps of
+        available_tstamps). A warning is raised for missing images.
+
+        Parameters
+        ----------
+        start_date: datetime
+            Start datetime
+        end_date: datetime
+            End datetime
+
+        Returns
+        ----------
+        timestamps : np.array
+            datetime objects, to be passed to read
+        """
+        available, missing = self.available_tstamps(start_date, end_date)
+
+        if missing.size > 0:
+            warnings.warn('{} of {} images between {} and {} are missing: {}'
+                          .format(missing.size, missing.size + available.size,
+                                  start_date, end_date,
+                                  ', '.join([str(t) for t in missing[:5]]) +
+                                  (', ...' if missing.size > 5 else '')))
+
+        return available.astype(object)
+
+
+class ERANcDs(ERADs):
     """
     Class for reading ERA 5 images in nc format.
 
@@ -179,18 +881,26 @@ class ERANcDs(MultiTemporalImageBase):
     subgrid: pygeogrids.CellGrid, optional (default: None)
         Read only data for points of this grid and not global values.
     mask_seapoints : bool, optional (default: False)
-        Use the land-sea-mask parameter in the file to mask points over water.
+        Use the land-sea-mask parameter to mask points over water. The mask is
+        static, it is read once for all images.
     h_step : list, optional (default: [0,6,12,18])
         List of full hours for which images exist.
     array_1D: bool, optional (default: False)
         Read data as list, instead of 2D array, used for reshuffling.
+    lsm_file : str, optional (default: None)
+        Image file to read the land-sea mask from. If None is passed, the mask
+        from the first read image is used.
+    file_index : bool, optional (default: True)
+        Look up image files in an index of the root path, that is created once.
+    manifest : str, optional (default: None)
+        File to store the index of image files in.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type of the read images.
     """
     def __init__(self, root_path, product, parameter=['swvl1', 'swvl2'],
                  subgrid=None, mask_seapoints=False, h_steps=[0, 6, 12, 18],
-                 array_1D=False):
-
-        self.h_steps = h_steps
-        subpath_templ = ["%Y", "%j"]
+                 array_1D=False, lsm_file=None, file_index=True,
+                 manifest=None, dtype=np.float32):
 
         if type(parameter) == str:
             parameter = [parameter]
@@ -199,41 +909,224 @@ class ERANcDs(MultiTemporalImageBase):
                        'parameter': parameter,
                        'subgrid': subgrid,
                        'mask_seapoints': mask_seapoints,
-                       'array_1D': array_1D}
+                       'array_1D': array_1D,
+                       'dtype': dtype}
 
         super(ERANcDs, self).__init__(root_path, ERANcImg,
                                       fname_templ='*_{datetime}.nc',
-                                      datetime_format="%Y%m%d_%H%M",
-                                      subpath_templ=subpath_templ,
-                                      exact_templ=False,
-                                      ioclass_kws=ioclass_kws)
+                                      ioclass_kws=ioclass_kws,
+                                      h_steps=h_steps,
+                                      lsm_file=lsm_file,
+                                      file_index=file_index,
+                                      manifest=manifest)
 
-    def tstamps_for_daterange(self, start_date, end_date):
+
+class ERANcMonthlyDs(ERANcDs):
+    """
+    Class for reading ERA images from multi-time netcdf files in a directory,
+    e.g. the monthly files of a download (temp_downloaded), without splitting
+    them into one file per image first. Consecutive time steps are read from
+    a file in slabs, one read per parameter.
+
+    Parameters
+    ----------
+    root_path: str
+        Directory where the multi-time netcdf files are stored.
+    product : str
+        ERA5 or ERAINT
+    parameter: list or str, optional (default: ['swvl1', 'swvl2'])
+        Parameter or list of parameters to read from the files.
+    subgrid: pygeogrids.CellGrid, optional (default: None)
+        Read only data for points of this grid and not global values.
+    mask_seapoints : bool, optional (default: False)
+        Use the land-sea-mask parameter to mask points over water. The mask is
+        static, it is read once for all images.
+    h_step : list, optional (default: [0,6,12,18])
+        List of full hours for which images are read.
+    array_1D: bool, optional (default: False)
+        Read data as list, instead of 2D array, used for reshuffling.
+    lsm_file : str, optional (default: None)
+        Image file to read the land-sea mask from. If None is passed, the mask
+        from the first read image is used.
+    slab_size : int, optional (default: 24)
+        Number of consecutive time steps that are read from a file at once
+        and kept in memory until the images are requested.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type of the read images.
+    """
+    def __init__(self, root_path, product, parameter=['swvl1', 'swvl2'],
+                 subgrid=None, mask_seapoints=False, h_steps=[0, 6, 12, 18],
+                 array_1D=False, lsm_file=None, slab_size=24,
+                 dtype=np.float32):
+
+        super(ERANcMonthlyDs, self).__init__(root_path, product,
+                                             parameter=parameter,
+                                             subgrid=subgrid,
+                                             mask_seapoints=mask_seapoints,
+                                             h_steps=h_steps,
+                                             array_1D=array_1D,
+                                             lsm_file=lsm_file,
+                                             file_index=False,
+                                             dtype=dtype)
+
+        # the image files are found in the time stacks, not in %Y/%j
+        # directories
+        self.file_index = TimeStackFileIndex(root_path, '*.nc')
+        self.slab_size = slab_size
+        # the last read slab and the position of its time steps
+        self._slab = None
+        self._slab_rows = {}
+
+    def read(self, timestamp, **kwargs):
         """
-        Get datetimes in the correct sub-daily resolution between 2 dates
+        Return an image for a specific timestamp. If the time step is not in
+        the last read slab, the next slab_size time steps of its file are read.
 
         Parameters
         ----------
-        start_date: datetime
-            Start datetime
-        end_date: datetime
-            End datetime
+        timestamp : datetime.datetime
+            Time stamp.
 
         Returns
-        ----------
-        timestamps : list
-            List of datetimes
+        -------
+        image : object
+            pygeobase.object_base.Image object
         """
+        self._load_sea_mask(timestamp)
+
+        if timestamp not in self._slab_rows:
+            filename, position = self.file_index.locate(timestamp)
+            reader = self.ioclass(filename, mode='r', **self.ioclass_kws)
+            self._slab = reader.read_slab(position,
+                                          position + self.slab_size)
+            self._slab_rows = dict((t, i) for i, t in
+                                   enumerate(self._slab.timestamp))
+
+        i = self._slab_rows[timestamp]
+        lon, lat = self._slab.lon, self._slab.lat
+        data = dict((name, values[i])
+                    for name, values in self._slab.data.items())
 
-        img_offsets = np.array([timedelta(hours=h) for h in self.h_steps])
+        if not self.ioclass_kws['array_1D']:
+            nlat = np.unique(lat).size
+            nlon = np.unique(lon).size
+            for name in data:
+                data[name] = data[name].reshape((nlat, nlon))
+            lon, lat = lon.reshape(nlat, nlon), lat.reshape(nlat, nlon)
 
-        timestamps = []
-        diff = end_date - start_date
-        for i in range(diff.days + 1):
-            daily_dates = start_date + timedelta(days=i) + img_offsets
-            timestamps.extend(daily_dates.tolist())
+        return Image(lon, lat, data, self._slab.metadata, timestamp)
+
+
+def _read_nc_block(filenames, name, lat_slice, lon_slice, dtype=np.float32):
+    """
+    Read a (time, latitude, longitude) block of a parameter from a list of
+    netcdf image files. Images without the parameter are filled with nan.
+    """
+    nlat = lat_slice.stop - lat_slice.start
+    nlon = lon_slice.stop - lon_slice.start
+    block = np.full((len(filenames), nlat, nlon), np.nan, dtype=dtype)
+
+    for i, filename in enumerate(filenames):
+        with _netcdf_lock:
+            dataset = Dataset(filename, mode='r')
+            dataset.set_auto_maskandscale(False)
+            if name in dataset.variables.keys():
+                variable = dataset.variables[name]
+                raw, packing = variable[lat_slice, lon_slice], _packing(variable)
+            else:
+                raw = None
+            dataset.close()
+        if raw is not None:
+            _unpack(raw, packing, dtype=dtype, out=block[i])
+
+    return block
+
+
+def open_archive(root, product, parameters=['swvl1', 'swvl2'], start=None,
+                 end=None, chunks=None, dtype=np.float32):
+    """
+    Open the downloaded netcdf images (root/%Y/%j/*_%Y%m%d_%H%M.nc) as one
+    lazy xarray Dataset with the dimensions (time, latitude, longitude).
+    Data is only read when it is computed, block by block (dask), so that
+    reductions and regional slices over the archive need little memory.
 
-        return timestamps
+    Parameters
+    ----------
+    root : str
+        Root path where the netcdf images are stored.
+    product : str
+        ERA5 or ERAINT
+    parameters : list or str, optional (default: ['swvl1', 'swvl2'])
+        Parameters to include in the Dataset.
+    start : datetime, optional (default: None)
+        First time stamp to include, if None is passed, from the first image.
+    end : datetime, optional (default: None)
+        Last time stamp to include, if None is passed, until the last image.
+    chunks : dict, optional (default: None)
+        Block sizes for the dimensions 'time', 'latitude' and 'longitude'.
+        Dimensions that are not passed are not split, except time, which is
+        split into single images by default. Use small spatial blocks for
+        regional analyses, so that only the blocks of the region are read.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type that the data is unpacked to.
+
+    Returns
+    ----------
+    ds : xarray.Dataset
+        Lazy dataset of the images.
+    """
+    if type(parameters) == str:
+        parameters = [parameters]
+    parameters = lookup(product, parameters)['short_name'].values
+
+    index = ImageFileIndex(root, '*_{datetime}.nc')
+    timestamps = index.timestamps(start, end)
+    if len(timestamps) == 0:
+        raise IOError("no files found for given date range")
+    filenames = [index.filename(t) for t in timestamps]
+
+    dataset = Dataset(filenames[0], mode='r')
+    lats = np.ma.filled(dataset.variables['latitude'][:])
+    lons = np.ma.filled(dataset.variables['longitude'][:])
+    attrs = {}
+    for name in parameters:
+        if name in dataset.variables.keys():
+            variable = dataset.variables[name]
+            attrs[name] = dict([(attr, variable.getncattr(attr))
+                                for attr in variable.ncattrs()
+                                if attr not in _packing_attrs])
+        else:
+            attrs[name] = {}
+    dataset.close()
+
+    sizes = {'time': 1, 'latitude': lats.size, 'longitude': lons.size}
+    if chunks is not None:
+        sizes.update(chunks)
+
+    time_blocks = [slice(i, min(i + sizes['time'], len(filenames)))
+                   for i in range(0, len(filenames), sizes['time'])]
+    lat_blocks = [slice(i, min(i + sizes['latitude'], lats.size))
+                  for i in range(0, lats.size, sizes['latitude'])]
+    lon_blocks = [slice(i, min(i + sizes['longitude'], lons.size))
+                  for i in range(0, lons.size, sizes['longitude'])]
+
+    data_vars = {}
+    for name in parameters:
+        blocks = [[[da.from_delayed(
+            delayed(_read_nc_block, pure=True)(filenames[t], name, lat, lon,
+                                               dtype),
+            shape=(t.stop - t.start, lat.stop - lat.start,
+                   lon.stop - lon.start),
+            dtype=dtype)
+            for lon in lon_blocks] for lat in lat_blocks]
+            for t in time_blocks]
+        data_vars[name] = (('time', 'latitude', 'longitude'),
+                           da.block(blocks), attrs[name])
+
+    coords = {'time': np.array(timestamps, dtype='datetime64[ns]'),
+              'latitude': lats, 'longitude': lons}
+
+    return xr.Dataset(data_vars, coords=coords)
 
 
 class ERAGrbImg(ImageBase):
@@ -257,9 +1150,17 @@ class ERAGrbImg(ImageBase):
         This option needs the 'lsm' parameter to be in the file!
     array_1D: bool, optional (default: False)
         Read data as list, instead of 2D array, used for reshuffling.
+    sea_mask : np.array, optional (default: None)
+        Static 1D mask, True for points (of the subgrid) over water, that is
+        used instead of the land-sea mask in the file when mask_seapoints is
+        selected.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type of the returned data, data is unpacked and masked in this
+        type.
     """
     def __init__(self, filename, product, parameter=['swvl1', 'swvl2'], mode='r',
-                 subgrid=None, mask_seapoints=False, array_1D=True):
+                 subgrid=None, mask_seapoints=False, array_1D=True,
+                 sea_mask=None, dtype=np.float32):
 
         super(ERAGrbImg, self).__init__(filename, mode=mode)
 
@@ -272,50 +1173,64 @@ class ERAGrbImg(ImageBase):
         self.mask_seapoints = mask_seapoints
         self.array_1D = array_1D
         self.subgrid = subgrid
+        self.sea_mask = sea_mask
+        self.dtype = dtype
 
-    def read(self, timestamp=None):
+    def read(self, timestamp=None, out=None):
         '''
         Read data from the loaded image file.
 
         Parameters
         ---------
         timestamp : datetime, optional (default: None)
-            Specific date (time) to read the data for.
+            Specific date (time) to read the data for. For files with more
+            than one time step, the messages of this time stamp are read (of
+            the first one if None is passed).
+        out : dict, optional (default: None)
+            1D arrays (values) to read the data of the parameters (keys) into,
+            only used for 1D arrays.
         '''
-        grbs = pygrib.open(self.filename)
-
         grid = self.subgrid
 
         return_img = {}
         return_metadata = {}
 
-        sea_mask = None
+        sea_mask = self.sea_mask
+        lsm_data = None
+
+        # decode only the messages of the selected parameters (and the lsm)
+        short_names = list(self.parameter)
+        if self.mask_seapoints and sea_mask is None:
+            short_names.append('lsm')
 
-        for message in grbs:
-            param_name = message.short_name
+        # multi-time files (e.g. monthly downloads): decode only the messages
+        # of the time stamp (or of the first one, if None is passed). The
+        # index is not built for files that are read once (e.g. single time
+        # step images), these are read in one pass.
+        for entry, message in read_grib_messages(self.filename, short_names,
+                                                 timestamp=timestamp,
+                                                 build_index=False):
+            param_name = entry['short_name']
 
             if param_name == 'lsm':
                 if self.mask_seapoints and sea_mask is None:
-                    sea_mask = message.values.flatten()
+                    lsm_data = message.values.flatten()
 
-            param_name = message.short_name
             if param_name not in self.parameter:
                 continue
 
             return_metadata[param_name] = {}
-            param_data = message.values.flatten()
+            # values are decoded as float64, keep them in the target type
+            param_data = np.ma.filled(message.values, np.nan).astype(
+                self.dtype).ravel()
 
             return_img[param_name] = param_data
 
             if grid is None:
-                lats, lons = message.latlons()
-                try:
-                    res_lat, res_lon = get_grid_resolution(lats, lons)
-                    grid = ERA_RegularImgGrid(res_lat, res_lon)
-                except ValueError:  # when grid not regular
-                    lons_gt_180 = np.where(lons > 180.0)
-                    lons[lons_gt_180] = lons[lons_gt_180] - 360
-                    grid = ERA_IrregularImgGrid(lons, lats)
+                # the geometry is only decoded for the first message with
+                # this grid definition
+                grid = get_cached_grid(('grib', entry['grid']),
+                                       _grib_img_grid, message)
 
             return_metadata[param_name]['units'] = message['units']
             return_metadata[param_name]['long_name'] = message['parameterName']
@@ -324,20 +1239,28 @@ class ERAGrbImg(ImageBase):
                 return_metadata[param_name]['depth'] = '{:} cm'.format(
                     message['levels'])
 
+        if self.subgrid is not None:
+            # keep only the points of the subgrid (gpis of the full image)
+            for name in return_img.keys():
+                return_img[name] = return_img[name][grid.activegpis]
+            if lsm_data is not None:
+                lsm_data = lsm_data[grid.activegpis]
+
         if self.mask_seapoints:
             if sea_mask is None:
-                raise IOError(
-                    'No land sea mask parameter (lsm) in passed image for masking.')
-            else:
-                # mask the loaded data
-                for name in return_img.keys():
-                    param_data = return_img[name]
-                    param_data = np.ma.array(param_data, mask=np.logical_not(sea_mask),
-                                             fill_value=np.nan)
-                    param_data = param_data.filled()
-                    return_img[name] = param_data
-
-        grbs.close()
+                if lsm_data is None:
+                    raise IOError(
+                        'No land sea mask parameter (lsm) in passed image for masking.')
+                sea_mask = lsm_data == 0
+            # mask the loaded data
+            for name in return_img.keys():
+                np.putmask(return_img[name], sea_mask, np.nan)
+
+        if out is not None:
+            for name in return_img.keys():
+                if name in out:
+                    out[name][:] = return_img[name]
+                    return_img[name] = out[name]
 
         if self.array_1D:
             return Image(grid.activearrlon, grid.activearrlat,
@@ -366,7 +1289,7 @@ class ERAGrbImg(ImageBase):
         pass
 
 
-class ERAGrbDs(MultiTemporalImageBase):
+class ERAGrbDs(ERADs):
     """
     Reader for a stack of ERA grib files.
 
@@ -380,14 +1303,20 @@ class ERAGrbDs(MultiTemporalImageBase):
         Parameter or list of parameters to read
     expand_grid: bool, optional (default: True)
         If the reduced gaussian grid should be expanded to a full gaussian grid.
+    lsm_file : str, optional (default: None)
+        Image file to read the land-sea mask from, when points over water are
+        masked. If None is passed, the mask from the first read image is used.
+    file_index : bool, optional (default: True)
+        Look up image files in an index of the root path, that is created once.
+    manifest : str, optional (default: None)
+        File to store the index of image files in.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type of the read images.
     """
     def __init__(self, root_path, product, parameter=['swvl1', 'swvl2'],
                  subgrid=None, mask_seapoints=False, h_steps=[0, 6, 12, 18],
-                 array_1D=True):
-
-        self.h_steps = h_steps
-
-        subpath_templ = ["%Y", "%j"]
+                 array_1D=True, lsm_file=None, file_index=True,
+                 manifest=None, dtype=np.float32):
 
         if type(parameter) == str:
             parameter = [parameter]
@@ -396,40 +1325,76 @@ class ERAGrbDs(MultiTemporalImageBase):
                        'parameter': parameter,
                        'subgrid': subgrid,
                        'mask_seapoints': mask_seapoints,
-                       'array_1D': array_1D}
+                       'array_1D': array_1D,
+                       'dtype': dtype}
 
         super(ERAGrbDs, self).__init__(root_path, ERAGrbImg,
                                        fname_templ='*_{datetime}.grb',
-                                       datetime_format="%Y%m%d_%H%M",
-                                       subpath_templ=subpath_templ,
-                                       exact_templ=False,
-                                       ioclass_kws=ioclass_kws)
+                                       ioclass_kws=ioclass_kws,
+                                       h_steps=h_steps,
+                                       lsm_file=lsm_file,
+                                       file_index=file_index,
+                                       manifest=manifest)
 
-    def tstamps_for_daterange(self, start_date, end_date):
+    def parameters_at(self, timestamp):
         """
-        Get datetimes in the correct sub-daily resolution between 2 dates
+        Get the parameters that are stored in the image for a time stamp.
+        Only the message index of the file is read, not the data.
 
         Parameters
         ----------
-        start_date: datetime
-            Start datetime
-        end_date: datetime
-            End datetime
+        timestamp : datetime
+            Time stamp of the image.
 
         Returns
         ----------
-        timestamps : list
-            List of datetimes
+        parameters : list
+            Short names of the parameters in the image file.
         """
-        img_offsets = np.array([timedelta(hours=h) for h in self.h_steps])
+        filename = self._build_filename(timestamp)
+        return sorted(set([entry['short_name']
+                           for entry in get_grib_index(filename)]))
 
-        timestamps = []
-        diff = end_date - start_date
-        for i in range(diff.days + 1):
-            daily_dates = start_date + timedelta(days=i) + img_offsets
-            timestamps.extend(daily_dates.tolist())
 
-        return timestamps
+class ERAGrbMonthlyDs(ERAGrbDs):
+    """
+    Reader for ERA images in multi-time grib files in a directory, e.g. the
+    monthly files of a download (temp_downloaded), without splitting them
+    into one file per image first. Only the messages of the read time stamp
+    are decoded, using the message index of the files.
+
+    Parameters
+    ----------
+    root_path: string
+        Directory where the multi-time grib files are stored.
+    product : str
+        ERA5 or ERAINT
+    parameter: list or str, optional (default: ['swvl1', 'swvl2'])
+        Parameter or list of parameters to read
+    lsm_file : str, optional (default: None)
+        Image file to read the land-sea mask from, when points over water are
+        masked. If None is passed, the mask from the first read image is used.
+    dtype : np.dtype, optional (default: np.float32)
+        Data type of the read images.
+    """
+    def __init__(self, root_path, product, parameter=['swvl1', 'swvl2'],
+                 subgrid=None, mask_seapoints=False, h_steps=[0, 6, 12, 18],
+                 array_1D=True, lsm_file=None, dtype=np.float32):
+
+        super(ERAGrbMonthlyDs, self).__init__(root_path, product,
+                                              parameter=parameter,
+                                              subgrid=subgrid,
+                                              mask_seapoints=mask_seapoints,
+                                              h_steps=h_steps,
+                                              array_1D=array_1D,
+                                              lsm_file=lsm_file,
+                                              file_index=False,
+                                              dtype=dtype)
+
+        # the image files are found in the time stacks, not in %Y/%j
+        # directories
+        self.file_index = TimeStackFileIndex(root_path, '*.grb')
+
 
 class ERATs(GriddedNcOrthoMultiTs):
     '''
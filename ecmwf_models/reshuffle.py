@@ -0,0 +1,722 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2019, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Image to time series conversion functions, that are shared by the reshuffle
+modules of the ERA products.
+'''
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import tempfile
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset, num2date
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+from pygeogrids import BasicGrid
+from pygeogrids.netcdf import save_grid, load_grid
+from repurpose.img2ts import Img2Ts
+
+from ecmwf_models.grid import ERA_LandGrid
+
+# size of the time series cells (files) in degrees
+cellsize = 5.0
+
+# name of the checkpoint file(s), that record the last time stamp that was
+# written to all time series files
+checkpoint_name = 'reshuffle_checkpoint.json'
+_checkpoint_version = 1
+
+# copies of a chunk of images that are in memory at the same time while it
+# is converted (list of images, stacked images, converted/split stack)
+_buffer_copies = 3
+
+
+def _current_rss():
+    """
+    Resident set size of this process in bytes (or the peak size where the
+    current size is not available).
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        return peak_rss()[0]
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process and of its largest (finished)
+    child process, e.g. the reshuffle workers.
+
+    Returns
+    ----------
+    rss_self : int
+        Peak memory usage of this process in bytes, 0 if unknown.
+    rss_children : int
+        Peak memory usage of the largest child process in bytes, 0 if unknown.
+    """
+    if resource is None:
+        return 0, 0
+    # ru_maxrss is in kilobytes on linux, in bytes on macOS
+    factor = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * factor,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * factor)
+
+
+def format_bytes(n):
+    """
+    Format a number of bytes for reports, e.g. 1.5G.
+    """
+    for unit in ['B', 'K', 'M', 'G']:
+        if abs(n) < 1024.:
+            return '{:.1f}{}'.format(n, unit)
+        n /= 1024.
+    return '{:.1f}T'.format(n)
+
+
+def imgbuffer_for_memory(max_memory, n_points, n_variables, ts_dtype,
+                         workers=1):
+    """
+    Choose the largest number of images that are read at once, so that the
+    memory usage of a reshuffle run stays below the passed limit.
+
+    Parameters
+    ----------
+    max_memory : int
+        Maximum memory usage in bytes.
+    n_points : int
+        Number of points that are read from each image.
+    n_variables : int
+        Number of variables that are read from each image.
+    ts_dtype : np.dtype
+        Data type of the images and time series.
+    workers : int, optional (default: 1)
+        Number of worker processes. The workers read different points, so
+        the buffered images of all workers are not larger than for a single
+        process, but the memory of each process (without buffers) counts.
+
+    Returns
+    ----------
+    imgbuffer : int
+        Number of images to read at once.
+    image_bytes : int
+        Memory in bytes that one buffered image needs.
+    """
+    # one byte per value for the mask of the stacked images
+    image_bytes = n_points * n_variables * (np.dtype(ts_dtype).itemsize + 1)
+    processes = workers + 1 if workers > 1 else 1
+    available = max_memory - _current_rss() * processes
+    imgbuffer = int(available // (_buffer_copies * image_bytes))
+    if imgbuffer < 1:
+        raise ValueError("max_memory of {} is too small to buffer a single "
+                         "image of {}".format(format_bytes(max_memory),
+                                              format_bytes(image_bytes)))
+    return imgbuffer, image_bytes
+
+
+def split_cells(grid, n_groups):
+    """
+    Split the cells of a grid into groups of neighbouring cells.
+
+    Parameters
+    ----------
+    grid : pygeogrids.CellGrid
+        Grid to split.
+    n_groups : int
+        Number of groups to create (at most one group per cell).
+
+    Returns
+    ----------
+    groups : list
+        Arrays of the cell numbers in each group.
+    """
+    cells = np.unique(grid.activearrcell)
+    return np.array_split(cells, min(n_groups, cells.size))
+
+
+def _cell_files(outputpath):
+    """
+    List the time series (cell) files in a directory.
+    """
+    return sorted(glob.glob(os.path.join(outputpath, '[0-9][0-9][0-9][0-9].nc')))
+
+
+def last_timestamp(outputpath):
+    """
+    Find the last time stamp that is stored in the time series files of a
+    directory, e.g. to extend the time series with new images.
+
+    Parameters
+    ----------
+    outputpath : str
+        Path where the time series files are stored.
+
+    Returns
+    ----------
+    last : datetime or None
+        Last time stamp in the time series, None if there are no time series
+        files or they contain no time stamps.
+    """
+    last = set()
+    for filename in _cell_files(outputpath):
+        with Dataset(filename) as ds:
+            time = ds.variables['time']
+            if time.shape[0] == 0:
+                continue
+            last.add(num2date(time[-1], time.units,
+                              only_use_cftime_datetimes=False,
+                              only_use_python_datetimes=True))
+
+    if len(last) == 0:
+        return None
+    if len(last) > 1:
+        raise ValueError("The time series files in {} end at different time "
+                         "stamps ({} to {}), they can not be extended."
+                         .format(outputpath, min(last), max(last)))
+    return last.pop()
+
+
+def check_timeseries(outputpath, grid, variables):
+    """
+    Check that the time series files in a directory contain the points of
+    the passed grid and the passed variables, so that they can be extended
+    with new images.
+
+    Parameters
+    ----------
+    outputpath : str
+        Path where the time series files are stored.
+    grid : pygeogrids.BasicGrid
+        Grid of the points that are reshuffled.
+    variables : list
+        Names of the variables that are reshuffled.
+    """
+    gridfile = os.path.join(outputpath, 'grid.nc')
+    if not os.path.exists(gridfile):
+        raise IOError("No grid file found in {}".format(outputpath))
+
+    stored = load_grid(gridfile)
+    stored_order = np.argsort(stored.activegpis)
+    order = np.argsort(grid.activegpis)
+    if not (np.array_equal(stored.activegpis[stored_order],
+                           grid.activegpis[order]) and
+            np.allclose(stored.activearrlon[stored_order],
+                        grid.activearrlon[order]) and
+            np.allclose(stored.activearrlat[stored_order],
+                        grid.activearrlat[order])):
+        raise ValueError("The points of the images do not match the grid of "
+                         "the time series in {}".format(outputpath))
+
+    with Dataset(_cell_files(outputpath)[0]) as ds:
+        # time series variables are stored per location and time
+        stored_vars = [name for name, var in ds.variables.items()
+                       if var.ndim == 2]
+    if sorted(stored_vars) != sorted(variables):
+        raise ValueError("The variables {} do not match the variables {} of "
+                         "the time series in {}".format(
+                             sorted(variables), sorted(stored_vars),
+                             outputpath))
+
+
+def timeseries_fingerprint(grid, variables, ts_dtype):
+    """
+    Fingerprint of the points, variables and data type of time series, to
+    check that a reshuffle run is continued with the same settings.
+
+    Parameters
+    ----------
+    grid : pygeogrids.BasicGrid
+        Grid of the points that are reshuffled.
+    variables : list
+        Names of the variables that are reshuffled.
+    ts_dtype : np.dtype
+        Data type of the time series.
+
+    Returns
+    ----------
+    fingerprint : str
+        Hex digest of the settings.
+    """
+    order = np.argsort(grid.activegpis)
+    sha = hashlib.sha1()
+    sha.update(np.ascontiguousarray(grid.activegpis[order],
+                                    dtype=np.int64).tobytes())
+    for coords in [grid.activearrlon, grid.activearrlat]:
+        sha.update(np.ascontiguousarray(coords[order],
+                                        dtype=np.float64).tobytes())
+    sha.update(';'.join(sorted(variables) + [np.dtype(ts_dtype).str])
+               .encode('utf-8'))
+    return sha.hexdigest()
+
+
+def write_checkpoint(filename, fingerprint, last):
+    """
+    Write a checkpoint file (through a temporary file, so that an interrupted
+    run never leaves an incomplete checkpoint).
+
+    Parameters
+    ----------
+    filename : str
+        Path to the checkpoint file.
+    fingerprint : str
+        Fingerprint of the time series, see timeseries_fingerprint.
+    last : datetime or None
+        Last time stamp, that was written to all time series files.
+    """
+    checkpoint = {'version': _checkpoint_version, 'fingerprint': fingerprint,
+                  'last': None if last is None else
+                  last.strftime('%Y-%m-%dT%H:%M:%S')}
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                    prefix='.tmp_checkpoint_')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(checkpoint, f)
+    os.rename(tmp_path, filename)
+
+
+def _checkpoint_files(outputpath):
+    """
+    List the checkpoint files (of all cell groups) in a directory.
+    """
+    name, ext = os.path.splitext(checkpoint_name)
+    return sorted(glob.glob(os.path.join(outputpath, name + '*' + ext)))
+
+
+def clear_checkpoints(outputpath):
+    """
+    Remove the checkpoint files of a previous run in a directory.
+    """
+    for filename in _checkpoint_files(outputpath):
+        os.remove(filename)
+
+
+def read_checkpoint(outputpath, fingerprint):
+    """
+    Read the checkpoint files in a directory, to continue an interrupted run.
+
+    Parameters
+    ----------
+    outputpath : str
+        Path where the time series files are stored.
+    fingerprint : str
+        Fingerprint of the time series that are reshuffled, it must match the
+        fingerprint of the checkpoint.
+
+    Returns
+    ----------
+    found : bool
+        True if there is a checkpoint in the directory.
+    last : datetime or None
+        Last time stamp that was written to the time series files of all
+        cell groups, None if the first chunk was not finished.
+    """
+    filenames = _checkpoint_files(outputpath)
+    if len(filenames) == 0:
+        return False, None
+
+    last = []
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('version') != _checkpoint_version:
+            raise IOError("Unknown checkpoint version in {}".format(filename))
+        if checkpoint['fingerprint'] != fingerprint:
+            raise ValueError("The points or variables of the images do not "
+                             "match the checkpoint {}".format(filename))
+        if checkpoint['last'] is None:
+            return True, None
+        last.append(datetime.strptime(checkpoint['last'],
+                                      '%Y-%m-%dT%H:%M:%S'))
+
+    # cell groups that were further are rolled back to the same time stamp
+    return True, min(last)
+
+
+def _truncate_time(filename, n, last):
+    """
+    Rewrite a time series file with only its first n time stamps.
+    """
+    tmp_path = filename + '.tmp'
+    with Dataset(filename) as src:
+        src.set_auto_maskandscale(False)
+        with Dataset(tmp_path, 'w', format=src.data_model) as dst:
+            dst.setncatts(dict((k, src.getncattr(k)) for k in src.ncattrs()))
+            dst.setncattr('time_coverage_end', str(last))
+            for name, dim in src.dimensions.items():
+                dst.createDimension(
+                    name, None if dim.isunlimited() else len(dim))
+            for name, var in src.variables.items():
+                attrs = dict((k, var.getncattr(k)) for k in var.ncattrs())
+                filters = var.filters() or {}
+                chunking = var.chunking()
+                out = dst.createVariable(
+                    name, var.datatype, var.dimensions,
+                    zlib=filters.get('zlib', False),
+                    complevel=filters.get('complevel', 4),
+                    chunksizes=None if chunking == 'contiguous' else chunking,
+                    fill_value=attrs.pop('_FillValue', None))
+                out.set_auto_maskandscale(False)
+                out.setncatts(attrs)
+                index = tuple(slice(0, n) if dim == 'time' else slice(None)
+                              for dim in var.dimensions)
+                if var.ndim > 0:
+                    out[index] = var[index]
+                else:
+                    out.assignValue(var.getValue())
+    os.rename(tmp_path, filename)
+
+
+def rollback_timeseries(outputpath, last):
+    """
+    Remove the time stamps after the passed time stamp from the time series
+    files in a directory, e.g. after an interrupted run that wrote a chunk of
+    images only to some of the cells.
+
+    Parameters
+    ----------
+    outputpath : str
+        Path where the time series files are stored.
+    last : datetime or None
+        Last time stamp to keep, if None is passed all time series files are
+        removed.
+    """
+    for filename in _cell_files(outputpath):
+        if last is None:
+            os.remove(filename)
+            continue
+        with Dataset(filename) as ds:
+            time = ds.variables['time']
+            dates = num2date(time[:], time.units,
+                             only_use_cftime_datetimes=False,
+                             only_use_python_datetimes=True)
+        n = int(np.sum(np.asarray(dates) <= last))
+        if n == 0:
+            os.remove(filename)
+        elif n < len(dates):
+            _truncate_time(filename, n, last)
+
+
+class _CheckpointImg2Ts(Img2Ts):
+    """
+    Img2Ts, that writes a checkpoint after each chunk of images was written
+    to all time series files.
+    """
+    def __init__(self, checkpoint, fingerprint, **kwargs):
+        self.checkpoint = checkpoint
+        self.fingerprint = fingerprint
+        super(_CheckpointImg2Ts, self).__init__(**kwargs)
+
+    def img_bulk(self):
+        for img_dict, timestamps in super(_CheckpointImg2Ts, self).img_bulk():
+            yield img_dict, timestamps
+            # the chunk is requested again after it was written (and the
+            # cell files were closed)
+            if len(timestamps) > 0:
+                write_checkpoint(self.checkpoint, self.fingerprint,
+                                 pd.Timestamp(timestamps[-1]).to_pydatetime())
+
+
+def reshuffle_images(input_dataset, grid, outputpath, startdate, enddate,
+                     imgbuffer, ts_dtype, global_attr, ts_attributes,
+                     gridname='grid.nc', checkpoint=checkpoint_name,
+                     fingerprint=None, last=None):
+    """
+    Convert the images of a stack into time series files, for the points of
+    the passed grid.
+
+    Parameters
+    ----------
+    input_dataset : ecmwf_models.interface.ERADs
+        Image stack to read.
+    grid : pygeogrids.BasicGrid
+        Grid of the points in the images (gpis of the full image).
+    outputpath : str
+        Output path, where the time series are stored.
+    startdate : datetime
+        First date of the time series.
+    enddate : datetime
+        Last date of the time series.
+    imgbuffer : int
+        How many images are read at once before time series are written.
+    ts_dtype : np.dtype
+        Data type of the time series.
+    global_attr : dict
+        Global attributes of the time series files.
+    ts_attributes : dict
+        Variable attributes of the time series.
+    gridname : str, optional (default: 'grid.nc')
+        Name of the grid file that is written.
+    checkpoint : str, optional (default: 'reshuffle_checkpoint.json')
+        Name of the checkpoint file, that is written after each chunk of
+        images was written to the time series files.
+    fingerprint : str, optional (default: None)
+        Fingerprint of the time series (see timeseries_fingerprint) that is
+        stored in the checkpoint. If None is passed, no checkpoint is written.
+    last : datetime, optional (default: None)
+        Last time stamp that is already in the time series files.
+    """
+    kwargs = {'input_dataset': input_dataset, 'outputpath': outputpath,
+              'startdate': startdate, 'enddate': enddate, 'input_grid': grid,
+              'imgbuffer': imgbuffer, 'cellsize_lat': cellsize,
+              'cellsize_lon': cellsize, 'ts_dtypes': ts_dtype,
+              'global_attr': global_attr, 'zlib': True,
+              'unlim_chunksize': 1000, 'ts_attributes': ts_attributes,
+              'gridname': gridname}
+
+    if fingerprint is None:
+        reshuffler = Img2Ts(**kwargs)
+    else:
+        checkpoint = os.path.join(outputpath, checkpoint)
+        write_checkpoint(checkpoint, fingerprint, last)
+        reshuffler = _CheckpointImg2Ts(checkpoint, fingerprint, **kwargs)
+    reshuffler.calc()
+
+
+def _reshuffle_cell_group(args):
+    """
+    Reshuffle the images for the points of a group of cells, this is called
+    by the worker processes of reshuffle_parallel.
+    """
+    ds_class, ds_kwargs, subgrid, gridname, checkpoint, reshuffle_kwargs = \
+        args
+
+    # only the window of the images that contains the cells is read
+    input_dataset = ds_class(subgrid=subgrid, **ds_kwargs)
+    grid = BasicGrid(subgrid.activearrlon, subgrid.activearrlat,
+                     gpis=subgrid.activegpis)
+
+    reshuffle_images(input_dataset, grid, gridname=gridname,
+                     checkpoint=checkpoint, **reshuffle_kwargs)
+
+    # the grid of all cells is written by the main process
+    os.remove(os.path.join(reshuffle_kwargs['outputpath'], gridname))
+
+    return np.unique(subgrid.activearrcell).size
+
+
+def reshuffle_parallel(ds_class, ds_kwargs, grid, workers, **reshuffle_kwargs):
+    """
+    Convert images into time series with multiple processes. The cells of
+    the grid are split into one group per worker, each group is reshuffled by
+    one worker process, that reads only the points in its cells and writes its
+    own cell files. Each process decodes every image (grib messages are
+    decoded completely, netcdf chunks that overlap the window of the cells),
+    so the decoding work grows with the number of groups.
+
+    Parameters
+    ----------
+    ds_class : class
+        Image stack class, e.g. ERA5NcDs.
+    ds_kwargs : dict
+        Keyword arguments for the image stack (except subgrid).
+    grid : pygeogrids.BasicGrid
+        Grid of the points in the images (gpis of the full image).
+    workers : int
+        Number of worker processes.
+    reshuffle_kwargs :
+        Keyword arguments that are passed to reshuffle_images (outputpath,
+        startdate, enddate, imgbuffer, ts_dtype, global_attr, ts_attributes,
+        fingerprint, last). Each group writes its own checkpoint file.
+    """
+    cellgrid = grid.to_cell_grid(cellsize_lat=cellsize, cellsize_lon=cellsize)
+    save_grid(os.path.join(reshuffle_kwargs['outputpath'], 'grid.nc'),
+              cellgrid)
+
+    # one group per worker, as each group decodes all images
+    groups = split_cells(cellgrid, workers)
+    name, ext = os.path.splitext(checkpoint_name)
+    tasks = [(ds_class, ds_kwargs, cellgrid.subgrid_from_cells(cells),
+              '.grid_{:04d}.nc'.format(i), '{}_{:04d}{}'.format(name, i, ext),
+              reshuffle_kwargs)
+             for i, cells in enumerate(groups)]
+
+    if reshuffle_kwargs.get('fingerprint') is not None:
+        # the checkpoints of all groups are written before any group starts,
+        # so that a resumed run also knows about groups that did not start
+        for task in tasks:
+            write_checkpoint(
+                os.path.join(reshuffle_kwargs['outputpath'], task[4]),
+                reshuffle_kwargs['fingerprint'], reshuffle_kwargs.get('last'))
+
+    ncells = np.unique(cellgrid.activearrcell).size
+    done = 0
+    pool = Pool(workers)
+    try:
+        for n, group_cells in enumerate(
+                pool.imap_unordered(_reshuffle_cell_group, tasks)):
+            done += group_cells
+            print("Finished {} of {} cell groups ({} of {} cells)."
+                  .format(n + 1, len(tasks), done, ncells))
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def reshuffle_dataset(ds_class, ds_kwargs, outputpath, startdate, enddate,
+                      global_attr, imgbuffer=50, land_only=False,
+                      lsm_threshold=0.5, workers=1, append=False,
+                      resume=False, max_memory=None):
+    """
+    Convert the images of an ERA image stack into netcdf time series, this
+    is the conversion that is shared by the reshuffle modules of the ERA
+    products (which select the image stack).
+
+    Parameters
+    ----------
+    ds_class : class
+        Image stack class, e.g. ERA5NcDs.
+    ds_kwargs : dict
+        Keyword arguments for the image stack (root_path, parameter,
+        h_steps, ...), except subgrid and dtype.
+    outputpath : str
+        Output path, where the reshuffled netcdf time series are stored.
+    startdate : datetime
+        Start date, from which images are read and time series are generated.
+    enddate : datetime
+        End date, from which images are read and time series are generated.
+    global_attr : dict
+        Global attributes of the time series files.
+    imgbuffer : int, optional (default: 50)
+        How many images to read at once before writing time series.
+    land_only : bool, optional (default: False)
+        Read and store only points over land, detected from the land-sea mask
+        (lsm) in the first image.
+    lsm_threshold : float, optional (default: 0.5)
+        Points with a land-sea mask value above this threshold are land
+        points, only used when land_only is selected.
+    workers : int, optional (default: 1)
+        Number of processes that reshuffle groups of cells in parallel.
+    append : bool, optional (default: False)
+        Extend existing time series in the output path with the images after
+        their last time stamp.
+    resume : bool, optional (default: False)
+        Continue an interrupted run from the checkpoint in the output path,
+        the checkpoint is removed when a run is finished.
+    max_memory : int, optional (default: None)
+        Maximum memory usage in bytes, replaces imgbuffer if passed.
+    """
+    # images are read in the data type of the time series, so that buffered
+    # images need no more memory than necessary
+    ts_dtype = np.dtype('float32')
+    ds_kwargs = dict(ds_kwargs, array_1D=True, dtype=ts_dtype)
+    input_dataset = ds_class(**ds_kwargs)
+
+    timestamps = input_dataset.available_tstamps(startdate, enddate)[0]
+    if timestamps.size == 0:
+        raise IOError("No images found between {} and {}".format(
+            startdate.isoformat(), enddate.isoformat()))
+
+    # first image, used to detect land points and time series attributes.
+    first_date_time = timestamps[0].astype(datetime)
+
+    subgrid = None
+    if land_only:
+        # the land-sea mask is static, so the land points are detected once
+        lsm_ds = ds_class(root_path=ds_kwargs['root_path'], parameter='lsm',
+                          array_1D=True, h_steps=ds_kwargs.get('h_steps'))
+        lsm_img = lsm_ds.read(first_date_time)
+        subgrid = ERA_LandGrid(lsm_img.data['lsm'], lsm_img.lon, lsm_img.lat,
+                               threshold=lsm_threshold)
+        input_dataset = ds_class(subgrid=subgrid, **ds_kwargs)
+
+    if not os.path.exists(outputpath):
+        os.makedirs(outputpath)
+
+    # get time series attributes from first day of data.
+    data = input_dataset.read(first_date_time)
+    ts_attributes = data.metadata
+
+    if subgrid is None:
+        grid = BasicGrid(data.lon, data.lat)
+    else:
+        # keep the gpis of the full image for the land points
+        grid = BasicGrid(data.lon, data.lat, gpis=subgrid.activegpis)
+
+    ts_variables = list(data.data.keys())
+    fingerprint = timeseries_fingerprint(grid, ts_variables, ts_dtype)
+
+    resumed, last = False, None
+    if resume:
+        resumed, last = read_checkpoint(outputpath, fingerprint)
+        if resumed:
+            # remove chunks that were not written to all cells
+            rollback_timeseries(outputpath, last)
+    if append and not resumed:
+        last = last_timestamp(outputpath)
+        if last is not None:
+            check_timeseries(outputpath, grid, ts_variables)
+
+    if last is not None:
+        # only images after the last time stamp of the time series are read
+        if not np.any(timestamps > np.datetime64(last)):
+            print("No new images after {}.".format(last.isoformat()))
+            return
+        startdate = last + timedelta(seconds=1)
+
+    if max_memory is not None:
+        imgbuffer, image_bytes = imgbuffer_for_memory(
+            max_memory, grid.activegpis.size, len(ts_variables), ts_dtype,
+            workers=workers)
+        # no larger buffer than images to convert
+        imgbuffer = min(imgbuffer, int(np.sum(
+            timestamps >= np.datetime64(startdate, 's'))))
+        print("Using imgbuffer={} ({} per image) for max_memory {}.".format(
+            imgbuffer, format_bytes(image_bytes), format_bytes(max_memory)))
+
+    clear_checkpoints(outputpath)
+
+    reshuffle_kwargs = {'outputpath': outputpath, 'startdate': startdate,
+                        'enddate': enddate, 'imgbuffer': imgbuffer,
+                        'ts_dtype': ts_dtype, 'global_attr': global_attr,
+                        'ts_attributes': ts_attributes,
+                        'fingerprint': fingerprint, 'last': last}
+
+    if workers > 1:
+        reshuffle_parallel(ds_class, ds_kwargs, grid, workers,
+                           **reshuffle_kwargs)
+    else:
+        reshuffle_images(input_dataset, grid, **reshuffle_kwargs)
+
+    # the run is finished, there is nothing to resume
+    clear_checkpoints(outputpath)
+
+    rss_main, rss_workers = peak_rss()
+    report = "Finished with imgbuffer={}, peak memory usage (RSS): {}".format(
+        imgbuffer, format_bytes(rss_main))
+    if workers > 1:
+        report += " (main process), {} (largest worker)".format(
+            format_bytes(rss_workers))
+    print(report + ".")
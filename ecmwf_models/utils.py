@@ -27,6 +27,9 @@ Utility functions for all data products in this package.
 
 import warnings
 import os
+import time
+import errno
+import random
 from datetime import datetime
 import xarray as xr
 import pandas as pd
@@ -59,8 +62,38 @@ def str2bool(v):
     else:
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
+def parse_memory(v):
+    '''
+    Parse a memory size string (e.g. 16G, 512M, 1.5G or a number of bytes)
+
+    Parameters
+    ---------
+    v : str
+        String to parse, a number with an optional unit K, M, G or T
+        (powers of 1024, an appended B is ignored).
+
+    Return
+    ---------
+    parse_memory : int
+        The parsed number of bytes
+    '''
+    units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = v.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    unit = value[-1:] if value[-1:] in units else ''
+    try:
+        size = float(value[:len(value) - len(unit)])
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'Memory size expected (e.g. 16G), got {}.'.format(v))
+    if size <= 0:
+        raise argparse.ArgumentTypeError('Memory size must be positive.')
+    return int(size * units[unit])
+
 def save_ncs_from_nc(input_nc, output_path, product_name,
-                     filename_templ='{product}_AN_%Y%m%d_%H%M.nc'):
+                     filename_templ='{product}_AN_%Y%m%d_%H%M.nc',
+                     metadata=None):
     """
     Split the downloaded netcdf file into daily files and add to folder structure
     necessary for reshuffling.
@@ -75,10 +108,15 @@ def save_ncs_from_nc(input_nc, output_path, product_name,
         Name of the ECMWF model (only for filename generation)
     filename_templ : str, optional (default: product_grid_date_time)
         Template for naming each separated nc file
+    metadata : dict, optional (default: None)
+        Global attributes that are added to each file, e.g. the area and grid
+        of the download request.
     """
     localsubdirs = ['%Y', '%j']
 
     nc_in = xr.open_dataset(input_nc, mask_and_scale=True)
+    if metadata is not None:
+        nc_in.attrs.update(metadata)
 
     filename_templ = filename_templ.format(product=product_name)
 
@@ -139,6 +177,141 @@ def save_gribs_from_grib(input_grib, output_path, product_name,
         grb_out.close()
     grib_in.close()
 
+# messages of request errors, that are not solved by repeating the request
+_permanent_error_messages = ['invalid', 'not valid', 'unauthorized', 'forbidden',
+                             'authentication', 'licence', 'license',
+                             'permission denied']
+
+
+def is_transient_error(e):
+    """
+    Check if an error of a download request is transient, i.e. the request
+    may succeed when it is repeated later (e.g. connection errors, timeouts,
+    server errors, queued requests that were aborted). Errors of the request
+    itself (e.g. invalid parameters, missing licences or credentials) and
+    of the local file system are permanent.
+
+    Parameters
+    ----------
+    e : Exception
+        Error raised by the request.
+
+    Returns
+    ----------
+    transient : bool
+        True if the request should be repeated.
+    """
+    # http errors, e.g. of the requests package used by the cdsapi
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    if status is not None:
+        return status >= 500 or status in [408, 429]
+
+    if getattr(e, 'errno', None) in [errno.EACCES, errno.ENOENT, errno.ENOSPC]:
+        return False
+
+    message = str(e).lower()
+    if any(m in message for m in _permanent_error_messages):
+        return False
+
+    if isinstance(e, (IOError, OSError)):
+        return True
+    if isinstance(e, (ValueError, TypeError, KeyError, AttributeError,
+                      NotImplementedError, ImportError, Warning)):
+        return False
+
+    # e.g. the generic exceptions of the cdsapi and ecmwfapi for failed requests
+    return True
+
+
+def retry(func, tries=5, delay=30., backoff=2., max_delay=900., jitter=0.5,
+          is_transient=is_transient_error, sleep=time.sleep):
+    """
+    Call a function until it succeeds, waiting exponentially longer between
+    the tries. Permanent errors are raised without repeating the call.
+
+    Parameters
+    ----------
+    func : callable
+        Function to call without arguments, e.g. a download request.
+    tries : int, optional (default: 5)
+        Maximum number of calls.
+    delay : float, optional (default: 30.)
+        Seconds to wait after the first failed call.
+    backoff : float, optional (default: 2.)
+        Factor that the waiting time is multiplied by after each failed call.
+    max_delay : float, optional (default: 900.)
+        Maximum number of seconds to wait between two calls.
+    jitter : float, optional (default: 0.5)
+        Fraction of the waiting time that is randomly added or subtracted, so
+        that parallel requests that failed together are not repeated together.
+    is_transient : callable, optional (default: is_transient_error)
+        Function that checks if an error is transient.
+    sleep : callable, optional (default: time.sleep)
+        Function that waits the passed number of seconds.
+
+    Returns
+    ----------
+    result : object
+        Return value of the successful call.
+
+    Raises
+    ----------
+    Exception
+        The error of the last call, if it is permanent or all calls failed.
+    """
+    wait = delay
+    for i in range(tries):
+        try:
+            return func()
+        except Exception as e:
+            if i == tries - 1 or not is_transient(e):
+                raise
+            seconds = min(wait, max_delay) * random.uniform(1. - jitter,
+                                                            1. + jitter)
+            warnings.warn('Try {} of {} failed ({}), repeating in {:.0f} s.'
+                          .format(i + 1, tries, e, seconds))
+            sleep(seconds)
+            wait *= backoff
+
+
+def download_with_retry(download, target, **retry_kws):
+    """
+    Download a file, transient errors are retried with exponential backoff
+    (see retry). A partly downloaded file is deleted before the next try.
+
+    Parameters
+    ----------
+    download : callable
+        Function without arguments that downloads the data into target.
+    target : str
+        Path to the downloaded file.
+    retry_kws : optional
+        Keywords passed to retry, e.g. tries and delay.
+
+    Returns
+    ----------
+    error : str or None
+        Error message if the download failed, None if it was successful.
+    """
+    def attempt():
+        try:
+            return download()
+        except Exception:
+            # delete the partly downloaded data before the next try
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+
+    try:
+        retry(attempt, **retry_kws)
+    except Exception as e:
+        return '{}: {}'.format(e.__class__.__name__, e)
+    # in a dry run, only existing files are used
+    if not os.path.exists(target):
+        return 'No file was downloaded'
+    return None
+
+
 def mkdate(datestring):
     '''
     Turns a datetime string into a datetime object
@@ -161,8 +334,10 @@ def mkdate(datestring):
 def parse_filetype(inpath):
     """
     Tries to find out the file type by searching for
-    grib or nc files two subdirectories into the passed input path.
-    If function fails, grib is assumed.
+    grib or nc files in the first day directory (%Y/%j) of the passed input
+    path, or directly in the input path (e.g. multi-time files of a download).
+    Other files and directories in the input path (e.g. the download manifest)
+    are ignored. If function fails, grib is assumed.
 
     Parameters
     ----------
@@ -174,14 +349,24 @@ def parse_filetype(inpath):
     filetype : str
         File type string.
     """
-    onedown = os.path.join(inpath, os.listdir(inpath)[0])
-    twodown = os.path.join(onedown, os.listdir(onedown)[0])
-
-    filelist = []
-    for path, subdirs, files in os.walk(twodown):
-        for name in files:
-            filename, extension = os.path.splitext(name)
-            filelist.append(extension)
+    filelist = [os.path.splitext(name)[1] for name in os.listdir(inpath)
+                if os.path.isfile(os.path.join(inpath, name))]
+
+    if '.nc' not in filelist and '.grb' not in filelist:
+        filelist = []
+        years = [d for d in sorted(os.listdir(inpath)) if len(d) == 4 and
+                 d.isdigit() and os.path.isdir(os.path.join(inpath, d))]
+        for year in years:
+            days = [d for d in sorted(os.listdir(os.path.join(inpath, year)))
+                    if os.path.isdir(os.path.join(inpath, year, d))]
+            if not days:
+                continue
+            for path, subdirs, files in os.walk(os.path.join(inpath, year,
+                                                             days[0])):
+                for name in files:
+                    filename, extension = os.path.splitext(name)
+                    filelist.append(extension)
+            break
 
     if '.nc' in filelist and '.grb' not in filelist:
         return 'netcdf'
@@ -7,4 +7,20 @@
     https://pytest.org/latest/plugins.html
 """
 from __future__ import print_function, absolute_import, division
-import pytest
\ No newline at end of file
+import pytest
+
+@pytest.fixture(autouse=True)
+def grid_store(tmpdir_factory, monkeypatch):
+    # don't write grids to the default grid store in the home directory
+    path = tmpdir_factory.getbasetemp().join('grid_store')
+    monkeypatch.setenv('ECMWF_MODELS_GRID_STORE', str(path))
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def grib_index_store(tmpdir_factory, monkeypatch):
+    # don't write message indices into the test data directory or to the
+    # default store in the home directory
+    monkeypatch.setenv('ECMWF_MODELS_GRIB_INDEX', '0')
+    path = tmpdir_factory.getbasetemp().join('grib_index_store')
+    monkeypatch.setenv('ECMWF_MODELS_GRIB_INDEX_STORE', str(path))
+    return str(path)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2019, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Tests for the manifest of downloaded chunks.
+'''
+
+import os
+from datetime import datetime
+import pytest
+from ecmwf_models.download_manifest import DownloadManifest, complete_days, \
+    day_range, reusable_downloads, split_download
+
+
+def make_images(root, timestamps, ext='nc'):
+    for t in timestamps:
+        path = os.path.join(root, t.strftime('%Y'), t.strftime('%j'))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        fname = 'ERA5_AN_{}.{}'.format(t.strftime('%Y%m%d_%H%M'), ext)
+        open(os.path.join(path, fname), 'w').close()
+
+
+def test_complete_days(tmpdir):
+    root = str(tmpdir)
+    make_images(root, [datetime(2010, 1, 1, 0), datetime(2010, 1, 1, 12),
+                       datetime(2010, 1, 2, 0), datetime(2010, 1, 3, 12)])
+    make_images(root, [datetime(2010, 1, 3, 0)], ext='grb')
+
+    assert day_range(datetime(2010, 1, 1, 6), datetime(2010, 1, 3)) == \
+        [datetime(2010, 1, 1), datetime(2010, 1, 2), datetime(2010, 1, 3)]
+    assert complete_days(root, 'nc', [0, 12], datetime(2010, 1, 1),
+                         datetime(2010, 1, 3)) == set([datetime(2010, 1, 1)])
+    assert complete_days(root, 'nc', [0], datetime(2010, 1, 1),
+                         datetime(2010, 1, 3)) == \
+        set([datetime(2010, 1, 1), datetime(2010, 1, 2)])
+
+
+def test_download_manifest(tmpdir):
+    path = os.path.join(str(tmpdir), 'download_manifest.json')
+    dl_file = os.path.join(str(tmpdir), '20100101_20100131.nc')
+    with open(dl_file, 'wb') as f:
+        f.write(b'data')
+
+    manifest = DownloadManifest(path)
+    request = {'product': 'ERA5', 'variables': ['swvl1'],
+               'days': ['2010-01-01']}
+    manifest.update('20100101_20100131.nc', request=request,
+                    status='requested')
+    assert not manifest.verify('20100101_20100131.nc', dl_file)
+    manifest.record_download('20100101_20100131.nc', dl_file)
+    assert manifest.verify('20100101_20100131.nc', dl_file)
+
+    # the manifest is stored after each update
+    manifest = DownloadManifest(path)
+    assert manifest.get('20100101_20100131.nc')['size'] == 4
+    assert len(manifest.chunks(status='downloaded',
+                               settings={'variables': ['swvl1']})) == 1
+    assert manifest.chunks(settings={'variables': ['swvl2']}) == []
+
+    # a changed file is not used
+    with open(dl_file, 'wb') as f:
+        f.write(b'atad')
+    assert not manifest.verify('20100101_20100131.nc', dl_file)
+
+
+def test_reusable_and_split_downloads(tmpdir):
+    manifest = DownloadManifest(os.path.join(str(tmpdir), 'manifest.json'))
+    settings = {'variables': ['swvl1']}
+    for name, days in [('20100101_20100102.nc', ['2010-01-01', '2010-01-02']),
+                       ('20100103_20100103.nc', ['2010-01-03'])]:
+        dl_file = os.path.join(str(tmpdir), name)
+        with open(dl_file, 'wb') as f:
+            f.write(b'data')
+        manifest.update(name, request=dict(settings, days=days),
+                        status='requested')
+        manifest.record_download(name, dl_file)
+
+    days = day_range(datetime(2010, 1, 1), datetime(2010, 1, 3))
+    files, done = reusable_downloads(manifest, settings, days,
+                                     set([datetime(2010, 1, 3)]), str(tmpdir))
+    assert files == [os.path.join(str(tmpdir), '20100101_20100102.nc')]
+    assert done == set(days)
+
+    def fail(dl_file):
+        raise IOError('corrupt')
+
+    failed = {}
+    assert not split_download(files[0], fail, failed, manifest)
+    with pytest.warns(UserWarning):
+        split_download(files[0], fail, failed, manifest)
+    assert failed == {'20100101_20100102.nc': 'Split failed, OSError: corrupt'}
+    assert manifest.get('20100101_20100102.nc')['status'] == 'failed'
+    assert os.path.exists(files[0])
+
+    assert split_download(files[0], lambda dl_file: None, failed, manifest)
+    assert manifest.get('20100101_20100102.nc')['status'] == 'split'
+    assert not os.path.exists(files[0])
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+from netCDF4 import Dataset
+from ecmwf_models import interface
+from ecmwf_models.file_index import ImageFileIndex, TimeStackFileIndex
+from ecmwf_models.era5.interface import ERA5NcDs, ERA5NcMonthlyDs
+
+
+def make_files(root, timestamps, ext='.nc'):
+    for t in timestamps:
+        path = os.path.join(root, t.strftime('%Y'), t.strftime('%j'))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        fname = 'ERA5_AN_{}{}'.format(t.strftime('%Y%m%d_%H%M'), ext)
+        open(os.path.join(path, fname), 'w').close()
+
+
+def test_file_index(tmpdir):
+    root = str(tmpdir)
+    make_files(root, [datetime(2010, 1, 1), datetime(2010, 1, 1, 12),
+                      datetime(2010, 1, 2, 6), datetime(2011, 12, 31, 18)])
+    make_files(root, [datetime(2010, 1, 1, 6)], ext='.grb')
+
+    index = ImageFileIndex(root, '*_{datetime}.nc')
+    assert index.timestamps() == [datetime(2010, 1, 1),
+                                  datetime(2010, 1, 1, 12),
+                                  datetime(2010, 1, 2, 6),
+                                  datetime(2011, 12, 31, 18)]
+    assert index.timestamps(datetime(2010, 1, 1, 6),
+                            datetime(2010, 1, 2, 6)) == \
+        [datetime(2010, 1, 1, 12), datetime(2010, 1, 2, 6)]
+    assert index.filename(datetime(2010, 1, 2, 6)) == \
+        os.path.join(root, '2010', '002', 'ERA5_AN_20100102_0600.nc')
+    assert not index.exists(datetime(2010, 1, 1, 6))
+    with pytest.raises(IOError):
+        index.filename(datetime(2010, 1, 1, 6))
+
+    # two files for the same time stamp
+    open(os.path.join(root, '2010', '001', 'ERA5_FC_20100101_0000.nc'),
+         'w').close()
+    index.refresh(full=True)
+    with pytest.raises(IOError):
+        index.filename(datetime(2010, 1, 1))
+
+
+def test_file_index_manifest(tmpdir, monkeypatch):
+    root = os.path.join(str(tmpdir), 'data')
+    manifest = os.path.join(str(tmpdir), 'manifest.json')
+    make_files(root, [datetime(2010, 1, 1), datetime(2010, 1, 2)])
+    ImageFileIndex(root, manifest=manifest).refresh()
+    assert os.path.exists(manifest)
+
+    scanned = []
+    scan_day = ImageFileIndex._scan_day
+
+    def counting_scan_day(self, day):
+        scanned.append(day)
+        return scan_day(self, day)
+    monkeypatch.setattr(ImageFileIndex, '_scan_day', counting_scan_day)
+
+    # only the new day is scanned, the others are taken from the manifest
+    make_files(root, [datetime(2010, 1, 3)])
+    index = ImageFileIndex(root, manifest=manifest)
+    assert len(index.timestamps()) == 3
+    assert scanned == ['2010/003']
+
+    # files added to a known day are found when they are looked up
+    make_files(root, [datetime(2010, 1, 3, 6)])
+    assert index.exists(datetime(2010, 1, 3, 6))
+    assert index.timestamps()[-2:] == [datetime(2010, 1, 3),
+                                       datetime(2010, 1, 3, 6)]
+    # the manifest is only written once for a batch of lookups
+    assert len(ImageFileIndex(root, manifest=manifest).timestamps()) == 3
+    index.flush()
+    assert len(ImageFileIndex(root, manifest=manifest).timestamps()) == 4
+
+
+def test_file_index_rescan_missing(tmpdir, monkeypatch):
+    # images only at 0 and 12 UTC, looked up with 6-hourly time stamps
+    root = str(tmpdir)
+    days = [datetime(2010, 1, 1) + timedelta(days=i) for i in range(10)]
+    make_files(root, [d + timedelta(hours=h) for d in days for h in [0, 12]])
+    index = ImageFileIndex(root, manifest=os.path.join(root, 'index.json'))
+    index.refresh()
+
+    writes, scanned = [], []
+    monkeypatch.setattr(ImageFileIndex, '_write_manifest',
+                        lambda self: writes.append(1))
+    monkeypatch.setattr(ImageFileIndex, '_update_index',
+                        lambda self: pytest.fail('index rebuilt'))
+    scan_day = ImageFileIndex._scan_day
+
+    def counting_scan_day(self, day):
+        scanned.append(day)
+        return scan_day(self, day)
+    monkeypatch.setattr(ImageFileIndex, '_scan_day', counting_scan_day)
+
+    for d in days:
+        for h in [0, 6, 12, 18]:
+            assert index.exists(d + timedelta(hours=h)) == (h in [0, 12])
+    # each day is scanned once, the index is not rebuilt for each miss
+    assert len(scanned) == 10
+    assert writes == []
+    assert len(index.timestamps()) == 20
+    index.flush()
+    assert writes == [1]
+
+
+def test_ERA5_nc_ds_file_index():
+    root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "ecmwf_models-test-data", "ERA5", "netcdf")
+    ds = ERA5NcDs(root_path, h_steps=[0, 12])
+    ds_glob = ERA5NcDs(root_path, h_steps=[0, 12], file_index=False)
+
+    for t in [datetime(2010, 1, 1), datetime(2010, 1, 1, 12)]:
+        assert ds.exists(t) and ds_glob.exists(t)
+        assert ds._build_filename(t) == ds_glob._build_filename(t)
+    assert not ds.exists(datetime(2010, 1, 1, 6))
+    assert not ds_glob.exists(datetime(2010, 1, 1, 6))
+
+
+def test_ERA5_nc_ds_tstamps(tmpdir):
+    root = str(tmpdir)
+    make_files(root, [datetime(2010, 1, 1, 0), datetime(2010, 1, 1, 12),
+                      datetime(2010, 1, 2, 0), datetime(2010, 1, 3, 12)])
+    ds = ERA5NcDs(root, h_steps=[12, 0])
+
+    start, end = datetime(2010, 1, 1), datetime(2010, 1, 3)
+    tstamps = ds.tstamps_array(start, end)
+    assert tstamps.dtype == np.dtype('datetime64[s]')
+
+    # same time stamps as the loop over days and hours
+    should = []
+    for i in range((end - start).days + 1):
+        for h in sorted(ds.h_steps):
+            should.append(start + timedelta(days=i, hours=h))
+    assert tstamps.tolist() == should
+    assert ds.tstamps_array(end, start).size == 0
+
+    available, missing = ds.available_tstamps(start, end)
+    assert available.tolist() == [datetime(2010, 1, 1, 0),
+                                  datetime(2010, 1, 1, 12),
+                                  datetime(2010, 1, 2, 0),
+                                  datetime(2010, 1, 3, 12)]
+    assert missing.tolist() == [datetime(2010, 1, 2, 12),
+                                datetime(2010, 1, 3, 0)]
+
+    with pytest.warns(UserWarning, match='2 of 6 images'):
+        tstamps = ds.tstamps_for_daterange(start, end)
+    assert isinstance(tstamps, np.ndarray)
+    assert tstamps.tolist() == available.tolist()
+    assert all(isinstance(t, datetime) for t in tstamps)
+
+    # images of days that are downloaded later are found as well
+    end = datetime(2010, 1, 4)
+    assert ds.available_tstamps(start, end)[1].size == 4
+    make_files(root, [datetime(2010, 1, 4, 0), datetime(2010, 1, 4, 12)])
+    assert ds.available_tstamps(start, end)[1].size == 2
+
+
+def make_multi_time_file(filename, timestamps):
+    lats = np.arange(90., -91., -45.)
+    lons = np.arange(0., 360., 90.)
+    with Dataset(filename, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('latitude', lats.size)
+        ds.createDimension('longitude', lons.size)
+        ds.createVariable('latitude', 'f4', ('latitude',))[:] = lats
+        ds.createVariable('longitude', 'f4', ('longitude',))[:] = lons
+        time = ds.createVariable('time', 'i4', ('time',))
+        time.units = 'hours since 1900-01-01 00:00:00.0'
+        time[:] = [(t - datetime(1900, 1, 1)).total_seconds() / 3600
+                   for t in timestamps]
+        swvl1 = ds.createVariable('swvl1', 'f4',
+                                  ('time', 'latitude', 'longitude'))
+        # the value of each time step is its position in the file
+        swvl1[:] = np.arange(len(timestamps))[:, np.newaxis, np.newaxis] * \
+            np.ones((len(timestamps), lats.size, lons.size))
+
+
+def test_ERA5_nc_ds_iter_images(tmpdir):
+    root = str(tmpdir)
+    timestamps = [datetime(2010, 1, 1) + timedelta(hours=h)
+                  for h in range(0, 72, 6)]
+    for t in timestamps:
+        path = os.path.join(root, t.strftime('%Y'), t.strftime('%j'))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        make_multi_time_file(os.path.join(
+            path, t.strftime('ERA5_AN_%Y%m%d_%H%M.nc')), [t])
+
+    ds = ERA5NcDs(root, parameter='swvl1', array_1D=True)
+    # the default serial iteration over the array of time stamps
+    imgs = list(ds.iter_images(datetime(2010, 1, 1), datetime(2010, 1, 3)))
+    assert [img.timestamp for img in imgs] == timestamps
+    for img in imgs:
+        assert img.data['swvl1'].shape == (20,)
+    with pytest.raises(IOError):
+        list(ds.iter_images(datetime(2011, 1, 1), datetime(2011, 1, 2)))
+
+
+def test_time_stack_file_index(tmpdir):
+    root = str(tmpdir)
+    jan = [datetime(2010, 1, 31, h) for h in [0, 6, 12, 18]]
+    feb = [datetime(2010, 2, 1, h) for h in [0, 6, 12, 18]]
+    make_multi_time_file(os.path.join(root, '20100131_20100131.nc'), jan)
+    make_multi_time_file(os.path.join(root, '20100201_20100201.nc'), feb)
+
+    index = TimeStackFileIndex(root, '*.nc')
+    assert index.timestamps() == jan + feb
+    assert index.timestamps(datetime(2010, 1, 31, 12),
+                            datetime(2010, 2, 1)) == jan[2:] + feb[:1]
+    assert index.locate(datetime(2010, 2, 1, 12)) == \
+        (os.path.join(root, '20100201_20100201.nc'), 2)
+    assert not index.exists(datetime(2010, 2, 2))
+    with pytest.raises(IOError):
+        index.filename(datetime(2010, 2, 2))
+
+
+def test_ERA5_nc_monthly_ds(tmpdir, monkeypatch):
+    root = str(tmpdir)
+    timestamps = [datetime(2010, 1, 1, h) for h in [0, 6, 12, 18]]
+    make_multi_time_file(os.path.join(root, '20100101_20100101.nc'),
+                         timestamps)
+
+    def no_image_index(*args, **kwargs):
+        raise AssertionError("The time stacks are not in an image index")
+    # the monthly stack uses only the index of the time stacks
+    monkeypatch.setattr(interface, 'ImageFileIndex', no_image_index)
+
+    ds = ERA5NcMonthlyDs(root, parameter='swvl1', array_1D=True,
+                         slab_size=3)
+    tstamps = ds.tstamps_for_daterange(datetime(2010, 1, 1),
+                                       datetime(2010, 1, 1))
+    assert tstamps.tolist() == timestamps
+    for i, t in enumerate(timestamps):
+        img = ds.read(t)
+        assert img.timestamp == t
+        assert img.data['swvl1'].shape == (20,)
+        np.testing.assert_equal(img.data['swvl1'], i)
+    # the last time step was read in a second slab
+    assert list(ds._slab_rows.keys()) == timestamps[3:]
+
+    # the multi-time file can also be read with the single image reader
+    img = ds.ioclass(os.path.join(root, '20100101_20100101.nc'),
+                     **ds.ioclass_kws).read(timestamps[2])
+    np.testing.assert_equal(img.data['swvl1'], 2)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import shutil
+import numpy.testing as nptest
+from datetime import datetime
+import pygrib
+from ecmwf_models.grib_index import get_grib_index, grib_index_path, \
+    grib_index_store_file, read_grib_messages, grid_definition_hash
+from ecmwf_models.grid import clear_grid_cache
+import ecmwf_models.grid as grid_cache
+import ecmwf_models.grib_index as grib_index
+from ecmwf_models.era5.interface import ERA5GrbDs, ERA5GrbImg
+
+grib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "ecmwf_models-test-data", "ERA5", "grib")
+grib_file = os.path.join(grib_path, "2010", "001", "ERA5_AN_20100101_0000.grb")
+
+
+def test_grib_index_messages(tmpdir, monkeypatch, grib_index_store):
+    monkeypatch.setenv('ECMWF_MODELS_GRIB_INDEX', '1')
+    fname = os.path.join(str(tmpdir), os.path.basename(grib_file))
+    shutil.copy(grib_file, fname)
+
+    messages = get_grib_index(fname)
+    # the index is stored next to the file, not in the index store
+    assert os.path.exists(grib_index_path(fname))
+    assert not os.path.exists(grib_index_store_file(fname))
+    assert [m['short_name'] for m in messages] == ['swvl1', 'swvl2', 'lsm']
+
+    grbs = pygrib.open(fname)
+    with open(fname, 'rb') as f:
+        for entry, message in zip(messages, grbs):
+            f.seek(entry['offset'])
+            assert f.read(4) == b'GRIB'
+            assert entry['length'] == message['totalLength']
+            assert entry['level'] == message['level']
+    grbs.close()
+
+    # the stored index is used in a new process, without scanning the file
+    grib_index._index_cache.clear()
+    monkeypatch.setattr(grib_index, 'build_grib_index', None)
+    assert get_grib_index(fname) == messages
+
+
+def test_grib_index_store_fallback(tmpdir, monkeypatch, grib_index_store):
+    monkeypatch.setenv('ECMWF_MODELS_GRIB_INDEX', '1')
+    fname = os.path.join(str(tmpdir), os.path.basename(grib_file))
+    shutil.copy(grib_file, fname)
+    # the data directory is not writable, e.g. a read-only archive
+    monkeypatch.setattr(grib_index, 'grib_index_path',
+                        lambda filename: os.path.join(fname, 'index.json'))
+
+    assert len(get_grib_index(fname)) == 3
+    assert grib_index_store_file(fname).startswith(grib_index_store)
+    assert os.path.exists(grib_index_store_file(fname))
+    assert os.listdir(str(tmpdir)) == [os.path.basename(grib_file)]
+
+
+def test_grib_index_store_deactivated(tmpdir, monkeypatch):
+    monkeypatch.setenv('ECMWF_MODELS_GRIB_INDEX_STORE', '')
+    fname = os.path.join(str(tmpdir), os.path.basename(grib_file))
+    shutil.copy(grib_file, fname)
+
+    assert grib_index_store_file(fname) is None
+    assert len(get_grib_index(fname)) == 3
+    assert os.listdir(str(tmpdir)) == [os.path.basename(grib_file)]
+
+
+def test_read_grib_messages_without_index(tmpdir, monkeypatch):
+    fname = os.path.join(str(tmpdir), os.path.basename(grib_file))
+    shutil.copy(grib_file, fname)
+
+    # a single read does not build the index, the file is read in one pass
+    monkeypatch.setattr(grib_index, 'build_grib_index', None)
+    img = ERA5GrbImg(fname, parameter=['swvl1']).read()
+    nptest.assert_allclose(img.data['swvl1'],
+                           ERA5GrbImg(grib_file, parameter=['swvl1'])
+                           .read().data['swvl1'])
+    messages = list(read_grib_messages(fname, ['swvl2'], build_index=False))
+    assert [entry['short_name'] for entry, _ in messages] == ['swvl2']
+    assert get_grib_index(fname, build=False) is None
+
+
+def test_grib_index_outdated(tmpdir):
+    fname = os.path.join(str(tmpdir), os.path.basename(grib_file))
+    shutil.copy(grib_file, fname)
+    get_grib_index(fname)
+
+    # the file now contains only the last message, the index is rebuilt
+    with open(grib_file, 'rb') as f:
+        content = f.read()
+    last = get_grib_index(grib_file)[-1]
+    with open(fname, 'wb') as f:
+        f.write(content[last['offset']:last['offset'] + last['length']])
+
+    messages = get_grib_index(fname)
+    assert len(messages) == 1
+    assert messages[0]['short_name'] == 'lsm'
+    assert messages[0]['offset'] == 0
+
+
+def test_read_grib_messages():
+    messages = list(read_grib_messages(grib_file, ['swvl2']))
+    assert len(messages) == 1
+    entry, message = messages[0]
+    assert entry['short_name'] == message.short_name == 'swvl2'
+
+    should = pygrib.open(grib_file).select(shortName='swvl2')[0]
+    nptest.assert_allclose(message.values, should.values)
+
+
+def test_ERA5_grb_ds_parameters_at():
+    ds = ERA5GrbDs(grib_path, parameter=['swvl1'])
+    assert ds.parameters_at(datetime(2010, 1, 1)) == ['lsm', 'swvl1', 'swvl2']
+
+
+def test_ERA5_grb_ds_grid_per_definition():
+    clear_grid_cache()
+    ds = ERA5GrbDs(grib_path, parameter=['swvl1'], array_1D=True)
+    img1 = ds.read(datetime(2010, 1, 1, 0))
+    img2 = ds.read(datetime(2010, 1, 1, 12))
+
+    # both images share the grid, that was created from the first message
+    assert img1.lon is img2.lon
+    assert len([key for key in grid_cache._grid_cache
+                if key[0] == 'grib']) == 1
+
+    entry = get_grib_index(grib_file)[0]
+    assert entry['grid'] == grid_definition_hash(
+        pygrib.open(grib_file).message(1))
@@ -25,8 +25,13 @@
 Tests for grid generation
 '''
 
-from ecmwf_models.grid import ERA_RegularImgGrid, get_grid_resolution, ERA_IrregularImgGrid
+from ecmwf_models.grid import ERA_RegularImgGrid, get_grid_resolution, ERA_IrregularImgGrid, \
+    ERA_CachedImgGrid, grid_cache_info, clear_grid_cache, grid_store_path, ERA_LandGrid, \
+    get_subgrid_window
+import os
 import numpy as np
+import numpy.testing as nptest
+import pytest
 
 def test_ERA_regular_grid():
     reg_grid = ERA_RegularImgGrid(0.3, 0.3)
@@ -36,6 +41,73 @@ def test_ERA_regular_grid():
                                reg_grid.activearrlon) == (0.3, 0.3)
 
 
+def test_grid_resolution_inputs():
+    lat = np.arange(90, -90.1, -0.5)
+    lon = np.arange(0, 360, 0.5)
+    lons, lats = np.meshgrid(lon, lat)
+    # axis vectors, 2D coordinate fields and flattened coordinates
+    assert get_grid_resolution(lat, lon) == (0.5, 0.5)
+    assert get_grid_resolution(lats, lons) == (0.5, 0.5)
+    assert get_grid_resolution(lats.flatten(), lons.flatten()) == (0.5, 0.5)
+    # known ERA5 and ERA Interim grid shapes
+    assert get_grid_resolution(np.arange(90, -90.1, -0.25),
+                               np.arange(0, 360, 0.25)) == (0.25, 0.25)
+    assert get_grid_resolution(np.arange(90, -90.1, -0.75),
+                               np.arange(0, 360, 0.75)) == (0.75, 0.75)
+    # regional grid, crossing the equator
+    assert get_grid_resolution(np.arange(10.1, -10, -0.2),
+                               np.arange(-5.1, 5, 0.2)) == (0.2, 0.2)
+
+    with pytest.raises(ValueError):
+        get_grid_resolution(np.array([90., 89., 87.5]), lon)
+    with pytest.raises(ValueError):
+        get_grid_resolution(lat, np.array([0., 1., 2.5]))
+
+
+def test_grid_resolution_dateline():
+    # regional grids across the dateline (-180..180) and the 0 meridian
+    # (0..360), the longitudes wrap in the image
+    lat = np.arange(10, -10.1, -0.25)
+    for lon in [np.r_[np.arange(170, 180, 0.25), np.arange(-180, -169.9, 0.25)],
+                np.r_[np.arange(350, 360, 0.25), np.arange(0, 10.1, 0.25)]]:
+        lons, lats = np.meshgrid(lon, lat)
+        assert get_grid_resolution(lat, lon) == (0.25, 0.25)
+        assert get_grid_resolution(lats, lons) == (0.25, 0.25)
+        assert get_grid_resolution(lats.flatten(), lons.flatten()) == \
+            (0.25, 0.25)
+
+        grid = ERA_RegularImgGrid(0.25, 0.25,
+                                  extent=(lat[0], lat[-1], lon[0], lon[-1]))
+        assert grid.activegpis.size == lons.size
+        nptest.assert_allclose(np.mod(grid.activearrlon, 360.),
+                               np.mod(lons.flatten(), 360.))
+
+
+def _get_grid_resolution_loop(lats, lons):
+    # previous, loop based implementation for comparison
+    lats = np.unique(lats)
+    lons = np.unique(lons)
+    lats_res, lons_res = [], []
+    for i, j in zip(lats[:-1], lats[1:]):
+        lats_res.append(np.abs(np.abs(j)-np.abs(i)))
+    for i, j in zip(lons[:-1], lons[1:]):
+        lons_res.append(np.abs(np.abs(j)-np.abs(i)))
+    return np.round(lats_res, 3)[0], np.round(lons_res, 3)[0]
+
+
+def test_grid_resolution_vectorized():
+    # the vectorized detection gives the same results as the loop, e.g. for
+    # the 2D coordinates as returned from grib messages for ERA5
+    for res in [0.25, 0.75, 1.]:
+        lon = np.arange(0, 360, res)
+        lat = np.arange(90, -90.1, -res)
+        lons, lats = np.meshgrid(lon, lat)
+        should = _get_grid_resolution_loop(lats, lons)
+        assert get_grid_resolution(lats, lons) == should
+        assert get_grid_resolution(lat, lon) == should
+        assert get_grid_resolution(lats.flatten(), lons.flatten()) == should
+
+
 def test_ERA_irregular_grid():
     # we test this with a regular grid, because it's easier
     lon = np.arange(0, 360 - 1. / 2, 1.)
@@ -45,3 +117,116 @@ def test_ERA_irregular_grid():
     grid = ERA_IrregularImgGrid(lons, lats)
 
     assert grid == ERA_RegularImgGrid(1.,1.)
+
+
+def test_ERA_cached_grid():
+    clear_grid_cache()
+    grid = ERA_CachedImgGrid(1., 1., extent=(90., -90., 0., 359.))
+    assert grid == ERA_RegularImgGrid(1., 1.)
+    assert grid_cache_info() == {'hits': 0, 'misses': 1, 'size': 1}
+
+    # same resolution and extent: the same grid object is returned
+    assert ERA_CachedImgGrid(1., 1., extent=(90., -90., 0., 359.)) is grid
+    assert grid_cache_info() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    # a subgrid is cached separately and returned instead of the global grid
+    subgrid = grid.subgrid_from_cells([1000])
+    assert ERA_CachedImgGrid(1., 1., extent=(90., -90., 0., 359.),
+                             subgrid=subgrid) is subgrid
+    assert grid_cache_info() == {'hits': 1, 'misses': 2, 'size': 2}
+
+    clear_grid_cache()
+    assert grid_cache_info() == {'hits': 0, 'misses': 0, 'size': 0}
+
+
+def test_ERA_regional_grid():
+    clear_grid_cache()
+    # images that are not global get a grid of their extent
+    grid = ERA_CachedImgGrid(1., 1., extent=(60., 30., -10., 30.))
+    assert grid.activegpis.size == 31 * 41
+    nptest.assert_equal(grid.activegpis, np.arange(31 * 41))
+    assert (grid.activearrlat[0], grid.activearrlon[0]) == (60., -10.)
+    assert (grid.activearrlat[-1], grid.activearrlon[-1]) == (30., 30.)
+
+    # extent across the border of the lon range (350..10)
+    grid = ERA_CachedImgGrid(1., 1., extent=(10., 0., 350., 10.))
+    assert grid.activegpis.size == 11 * 21
+    nptest.assert_allclose(grid.activearrlon[:21], np.arange(-10., 11.))
+
+    # global images in -180..180 are not read with the 0..360 grid
+    grid = ERA_CachedImgGrid(1., 1., extent=(90., -90., -180., 179.))
+    assert grid.activearrlon[0] == -180.
+    assert grid != ERA_RegularImgGrid(1., 1.)
+    clear_grid_cache()
+
+
+def test_ERA_grid_store(monkeypatch, tmpdir):
+    monkeypatch.setenv('ECMWF_MODELS_GRID_STORE', str(tmpdir))
+    store = grid_store_path()
+    assert store == os.path.join(str(tmpdir), 'v1')
+
+    grid = ERA_RegularImgGrid(2., 2.)
+    assert sorted(os.listdir(os.path.join(store, 'regular_2.000_2.000'))) == \
+        ['cell.npy', 'lat.npy', 'lon.npy']
+
+    # second call loads the stored arrays as memory maps
+    stored = ERA_RegularImgGrid(2., 2.)
+    assert isinstance(stored.arrlon, np.memmap)
+    assert stored == grid
+    np.testing.assert_equal(stored.activearrcell, grid.activearrcell)
+
+    lons, lats = np.meshgrid(np.arange(0, 360, 3.), np.arange(90, -91, -3.))
+    grid = ERA_IrregularImgGrid(lons, lats)
+    assert lons.max() > 180  # passed coordinates are not changed
+    stored = ERA_IrregularImgGrid(lons, lats)
+    assert isinstance(stored.arrlat, np.memmap)
+    assert stored == grid
+
+    # a corrupt (e.g. half written) entry is created and stored again
+    entry = os.path.join(store, 'regular_2.000_2.000')
+    with open(os.path.join(entry, 'lat.npy'), 'wb') as f:
+        f.write(b'\x93NUMPY')
+    with pytest.warns(UserWarning):
+        rebuilt = ERA_RegularImgGrid(2., 2.)
+    assert not isinstance(rebuilt.arrlat, np.memmap)
+    stored = ERA_RegularImgGrid(2., 2.)
+    assert isinstance(stored.arrlat, np.memmap)
+    np.testing.assert_equal(stored.arrlat, rebuilt.arrlat)
+    assert not [name for name in os.listdir(store) if name.startswith('tmp')]
+
+    # deactivate the store
+    monkeypatch.setenv('ECMWF_MODELS_GRID_STORE', '')
+    assert grid_store_path() is None
+    assert not isinstance(ERA_RegularImgGrid(2., 2.).arrlon, np.memmap)
+
+
+def test_ERA_land_grid():
+    lons, lats = np.meshgrid(np.arange(0, 360, 5.), np.arange(90, -91, -5.))
+    lsm = np.zeros(lons.shape)
+    lsm[3:6, 10:20] = 1.
+    lsm[3, 10] = 0.4  # below threshold
+
+    land_grid = ERA_LandGrid(lsm, lons.flatten(), lats.flatten(), threshold=0.5)
+    assert land_grid.activegpis.size == 29
+    # gpis are the same as in the full grid
+    full_grid = ERA_IrregularImgGrid(lons, lats)
+    nptest.assert_equal(land_grid.activegpis, np.where(lsm.flatten() > 0.5)[0])
+    nptest.assert_equal(land_grid.activearrcell,
+                        full_grid.activearrcell[land_grid.activegpis])
+
+
+def test_subgrid_window():
+    grid = ERA_RegularImgGrid(1., 1.)
+    # region crossing the image border in lon (0..359 deg)
+    subgrid = grid.subgrid_from_gpis(
+        grid.get_bbox_grid_points(latmin=35., latmax=60., lonmin=-10., lonmax=30.))
+    window = get_subgrid_window(subgrid, 181, 360)
+    assert window['lat'] == slice(30, 56)
+    assert window['lon'] == [slice(350, 360), slice(0, 31)]
+
+    img = np.arange(181 * 360).reshape(181, 360)
+    data = np.concatenate([img[window['lat'], s] for s in window['lon']], axis=1)
+    nptest.assert_equal(data.ravel()[window['index']], subgrid.activegpis)
+
+    # cached for the subgrid
+    assert get_subgrid_window(subgrid, 181, 360) is window
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2019, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Tests for the functions that are shared by the reshuffle modules.
+'''
+
+import argparse
+import pytest
+import numpy as np
+
+from ecmwf_models.reshuffle import imgbuffer_for_memory, format_bytes
+from ecmwf_models.utils import parse_memory
+
+
+def test_parse_memory():
+    assert parse_memory('16G') == 16 * 1024 ** 3
+    assert parse_memory('512mb') == 512 * 1024 ** 2
+    assert parse_memory('1.5K') == 1536
+    assert parse_memory('1000') == 1000
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_memory('lots')
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_memory('0G')
+
+
+def test_imgbuffer_for_memory():
+    n_points = 721 * 1440
+    imgbuffer, image_bytes = imgbuffer_for_memory(
+        parse_memory('16G'), n_points, 2, np.float32)
+    assert image_bytes == n_points * 2 * 5
+    assert imgbuffer > 100
+    # more memory allows more images, more variables fewer images
+    assert imgbuffer_for_memory(parse_memory('32G'), n_points, 2,
+                                np.float32)[0] > imgbuffer
+    assert imgbuffer_for_memory(parse_memory('16G'), n_points, 4,
+                                np.float32)[0] < imgbuffer
+    with pytest.raises(ValueError):
+        imgbuffer_for_memory(parse_memory('1M'), n_points, 2, np.float32)
+
+
+def test_format_bytes():
+    assert format_bytes(512) == '512.0B'
+    assert format_bytes(1536) == '1.5K'
+    assert format_bytes(16 * 1024 ** 3) == '16.0G'
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2019, TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+Tests for the utility functions.
+'''
+
+import os
+import errno
+import pytest
+from ecmwf_models.utils import retry, is_transient_error, parse_filetype, \
+    download_with_retry
+
+
+class HTTPError(Exception):
+    # stub of the http errors of the requests package
+    def __init__(self, status_code):
+        super(HTTPError, self).__init__('{} error'.format(status_code))
+        self.response = type('Response', (object,), {'status_code': status_code})
+
+
+def test_is_transient_error():
+    assert is_transient_error(IOError('Connection reset by peer'))
+    assert is_transient_error(Exception('Request aborted by the server'))
+    assert is_transient_error(HTTPError(503))
+    assert is_transient_error(HTTPError(429))
+
+    assert not is_transient_error(HTTPError(400))
+    assert not is_transient_error(Exception('the request you have submitted is not valid'))
+    assert not is_transient_error(Exception('required licences not accepted'))
+    assert not is_transient_error(ValueError('unknown variable'))
+    assert not is_transient_error(IOError(errno.ENOSPC, 'No space left on device'))
+
+
+def test_retry():
+    waits, calls = [], []
+
+    def func():
+        calls.append(1)
+        if len(calls) < 4:
+            raise IOError('timeout')
+        return 'done'
+
+    assert retry(func, tries=5, delay=10., backoff=2., max_delay=30.,
+                 jitter=0.5, sleep=waits.append) == 'done'
+    assert len(calls) == 4
+    # exponential backoff up to max_delay, with jitter of +-50 %
+    for wait, base in zip(waits, [10., 20., 30.]):
+        assert 0.5 * base <= wait <= 1.5 * base
+
+    # all tries failed: the last error is raised
+    waits = []
+
+    def timeout():
+        raise IOError('timeout')
+
+    with pytest.raises(IOError):
+        retry(timeout, tries=2, sleep=waits.append)
+    assert len(waits) == 1
+
+    # permanent errors are not repeated
+    calls = []
+
+    def invalid():
+        calls.append(1)
+        raise ValueError('invalid request')
+
+    with pytest.raises(ValueError):
+        retry(invalid, sleep=waits.append)
+    assert len(calls) == 1
+
+
+def test_download_with_retry(tmpdir):
+    target = os.path.join(str(tmpdir), '20100101_20100131.nc')
+    calls = []
+
+    def download():
+        calls.append(1)
+        with open(target, 'w') as f:
+            f.write('partial')
+        if len(calls) < 2:
+            raise IOError('Connection reset by peer')
+
+    waits = []
+    assert download_with_retry(download, target, sleep=waits.append) is None
+    assert len(calls) == 2 and len(waits) == 1
+
+    # a permanent error: the partly downloaded file is deleted
+    def invalid():
+        open(target, 'w').close()
+        raise ValueError('invalid request')
+
+    assert download_with_retry(invalid, target) == \
+        'ValueError: invalid request'
+    assert not os.path.exists(target)
+    assert download_with_retry(lambda: None, target) == \
+        'No file was downloaded'
+
+
+def test_parse_filetype(tmpdir):
+    root = str(tmpdir)
+    os.makedirs(os.path.join(root, '2010', '001'))
+    open(os.path.join(root, '2010', '001', 'ERA5_AN_20100101_0000.nc'),
+         'w').close()
+    # files and folders of a download next to the images
+    open(os.path.join(root, '.tmp_manifest_abc'), 'w').close()
+    open(os.path.join(root, '0_download_manifest.json'), 'w').close()
+    os.mkdir(os.path.join(root, 'temp_downloaded'))
+    assert parse_filetype(root) == 'netcdf'
+
+    # multi-time files of a download
+    open(os.path.join(root, 'temp_downloaded', '20100101_20100131.grb'),
+         'w').close()
+    assert parse_filetype(os.path.join(root, 'temp_downloaded')) == 'grib'
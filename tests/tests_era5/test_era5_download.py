@@ -24,12 +24,16 @@
 '''
 Tests for transferring downloaded data to netcdf or grib files
 '''
-from ecmwf_models.era5.download import download_and_move
+from ecmwf_models.era5.download import download_and_move, plan_chunks, \
+    area_points
+from ecmwf_models.download_manifest import DownloadManifest
 
 import os
 import tempfile
 import shutil
-from datetime import datetime
+import threading
+from netCDF4 import Dataset
+from datetime import datetime, timedelta
 
 def test_dry_download_nc_era5():
 
@@ -87,4 +91,190 @@ def test_dry_download_grb_era5():
 
     assert(sorted(os.listdir(os.path.join(dl_path, '2010', '001'))) == sorted(should_dlfiles))
 
-    shutil.rmtree(dl_path)
\ No newline at end of file
+    shutil.rmtree(dl_path)
+
+
+class FakeClient(object):
+    """
+    Local stub of cdsapi.Client, that stores the example file for each
+    request and records the requests.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def retrieve(self, name, request, target):
+        with self.lock:
+            self.requests.append(request)
+        shutil.copyfile(self.source, target)
+
+
+def test_parallel_download_nc_era5():
+
+    dl_path = tempfile.mkdtemp()
+
+    thefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+              "ecmwf_models-test-data", "download", "era5_example_downloaded_raw.nc")
+    client = FakeClient(thefile)
+
+    download_and_move(dl_path, datetime(2010, 1, 1), datetime(2010, 3, 15),
+                      variables=['swvl1', 'swvl2', 'lsm'], keep_original=False,
+                      h_steps=[0, 12], grb=False, max_parallel=3, client=client)
+
+    # one request per month
+    assert(sorted([(r['month'], r['day'][0], r['day'][-1]) for r in client.requests]) ==
+           [(['01'], '01', '31'), (['02'], '01', '28'), (['03'], '01', '15')])
+
+    # the example file contains the images of 2010-01-01
+    assert(os.listdir(dl_path) == ['2010'])
+    assert(sorted(os.listdir(os.path.join(dl_path, '2010', '001'))) ==
+           ['ERA5_AN_20100101_0000.nc', 'ERA5_AN_20100101_1200.nc'])
+
+    shutil.rmtree(dl_path)
+
+
+def test_download_manifest_era5():
+
+    dl_path = tempfile.mkdtemp()
+    manifest = os.path.join(dl_path, 'download_manifest.json')
+
+    thefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+              "ecmwf_models-test-data", "download", "era5_example_downloaded_raw.nc")
+
+    # a file that was downloaded, but not split by an interrupted run
+    os.mkdir(os.path.join(dl_path, 'temp_downloaded'))
+    dl_file = os.path.join(dl_path, 'temp_downloaded', '20100101_20100101.nc')
+    shutil.copyfile(thefile, dl_file)
+    request = {'product': 'ERA5',
+               'variables': ['volumetric_soil_water_layer_1',
+                             'volumetric_soil_water_layer_2', 'land_sea_mask'],
+               'h_steps': [0, 12], 'format': 'netcdf', 'days': ['2010-01-01']}
+    DownloadManifest(manifest).update('20100101_20100101.nc', request=request)
+    DownloadManifest(manifest).record_download('20100101_20100101.nc', dl_file)
+
+    client = FakeClient(thefile)
+    kwargs = {'variables': ['volumetric_soil_water_layer_1',
+                            'volumetric_soil_water_layer_2', 'land_sea_mask'],
+              'h_steps': [0, 12], 'client': client, 'manifest': manifest}
+
+    download_and_move(dl_path, datetime(2010, 1, 1), datetime(2010, 1, 2),
+                      **kwargs)
+    # the downloaded file is split, only the missing day is requested
+    assert([r['day'] for r in client.requests] == [['02']])
+    assert(DownloadManifest(manifest).get('20100101_20100101.nc')['status'] == 'split')
+    assert(DownloadManifest(manifest).get('20100102_20100102.nc')['status'] == 'split')
+    assert(sorted(os.listdir(os.path.join(dl_path, '2010', '001'))) ==
+           ['ERA5_AN_20100101_0000.nc', 'ERA5_AN_20100101_1200.nc'])
+
+    # nothing is requested again for the day that exists
+    client.requests = []
+    download_and_move(dl_path, datetime(2010, 1, 1), datetime(2010, 1, 1),
+                      **kwargs)
+    assert(client.requests == [])
+
+    shutil.rmtree(dl_path)
+
+
+def test_plan_chunks_era5():
+
+    days = [datetime(2010, 1, 1) + timedelta(days=i) for i in range(365)]
+
+    def spans(chunks):
+        return [(c[0].strftime('%m%d'), c[-1].strftime('%m%d')) for c in chunks]
+
+    assert(len(plan_chunks(days, 1, 4, chunking='month')) == 12)
+    # a year of one variable fits into one request
+    assert(spans(plan_chunks(days, 1, 4, chunking='auto')) == [('0101', '1231')])
+    # many variables are requested in smaller chunks within each month
+    chunks = plan_chunks(days[:31], 20, 24, chunking='auto')
+    assert(spans(chunks) == [('0101', '0104'), ('0105', '0108'), ('0109', '0112'),
+                             ('0113', '0116'), ('0117', '0120'), ('0121', '0124'),
+                             ('0125', '0128'), ('0129', '0131')])
+    assert(spans(plan_chunks(days[:40], 1, 4, chunking=10)) ==
+           [('0101', '0108'), ('0109', '0116'), ('0117', '0124'),
+            ('0125', '0131'), ('0201', '0209')])
+    # incomplete months are not merged, as requests are combinations of
+    # years, months and days
+    assert(spans(plan_chunks(days[5:70], 1, 4, chunking='year')) ==
+           [('0106', '0131'), ('0201', '0228'), ('0301', '0311')])
+
+
+def test_download_area_era5():
+
+    dl_path = tempfile.mkdtemp()
+
+    thefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+              "ecmwf_models-test-data", "download", "era5_example_downloaded_raw.nc")
+    client = FakeClient(thefile)
+
+    download_and_move(dl_path, datetime(2010, 1, 1), datetime(2010, 1, 1),
+                      variables=['swvl1'], h_steps=[0], client=client,
+                      area=[72, -25, 34, 45], grid=[0.5])
+
+    assert(client.requests[0]['area'] == [72., -25., 34., 45.])
+    assert(client.requests[0]['grid'] == [0.5, 0.5])
+
+    # the area and grid are recorded in the split images
+    with Dataset(os.path.join(dl_path, '2010', '001', 'ERA5_AN_20100101_0000.nc')) as ds:
+        assert(list(ds.getncattr('download_area')) == [72., -25., 34., 45.])
+        assert(list(ds.getncattr('download_grid')) == [0.5, 0.5])
+
+    assert(area_points() == 721 * 1440)
+    assert(area_points([72, -25, 34, 45], [0.5, 0.5]) == 77 * 141)
+    assert(area_points([10, 350, 0, 10]) == 41 * 81)
+
+    shutil.rmtree(dl_path)
+
+
+class FailingClient(FakeClient):
+    """
+    Stub of cdsapi.Client, that fails with the passed errors before it
+    stores the example file.
+    """
+    def __init__(self, source, errors):
+        super(FailingClient, self).__init__(source)
+        self.errors = list(errors)
+
+    def retrieve(self, name, request, target):
+        with self.lock:
+            self.requests.append(request)
+            error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            open(target, 'w').close()  # partly downloaded file
+            raise error
+        shutil.copyfile(self.source, target)
+
+
+def test_download_retry_era5():
+
+    dl_path = tempfile.mkdtemp()
+    manifest = os.path.join(dl_path, 'download_manifest.json')
+
+    thefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+              "ecmwf_models-test-data", "download", "era5_example_downloaded_raw.nc")
+
+    # transient errors are retried
+    client = FailingClient(thefile, [IOError('Connection reset'), IOError('Timeout')])
+    failed = download_and_move(dl_path, datetime(2010, 1, 1), datetime(2010, 1, 1),
+                               variables=['swvl1'], h_steps=[0, 12], client=client,
+                               manifest=manifest, retry_delay=0.)
+    assert(failed == {})
+    assert(len(client.requests) == 3)
+    assert(DownloadManifest(manifest).get('20100101_20100101.nc')['status'] == 'split')
+
+    # permanent errors are not retried, the chunk is reported as failed
+    client = FailingClient(thefile, [Exception('the request you have submitted is not valid')])
+    failed = download_and_move(dl_path, datetime(2010, 1, 2), datetime(2010, 1, 2),
+                               variables=['swvl1'], h_steps=[0, 12], client=client,
+                               manifest=manifest, retry_delay=0.)
+    assert(list(failed.keys()) == ['20100102_20100102.nc'])
+    assert(len(client.requests) == 1)
+    entry = DownloadManifest(manifest).get('20100102_20100102.nc')
+    assert(entry['status'] == 'failed')
+    assert('not valid' in entry['error'])
+    # the partly downloaded file is removed
+    assert(not os.path.exists(os.path.join(dl_path, 'temp_downloaded',
+                                           '20100102_20100102.nc')))
+
+    shutil.rmtree(dl_path)
@@ -25,7 +25,10 @@
 import os
 import numpy.testing as nptest
 from ecmwf_models.era5.interface import ERA5NcDs, ERA5NcImg, ERA5GrbImg, ERA5GrbDs
+from ecmwf_models.interface import open_archive
+from ecmwf_models.grid import ERA_RegularImgGrid
 import numpy as np
+import xarray as xr
 from datetime import datetime
 
 def test_ERA5_nc_image():
@@ -249,3 +252,236 @@ def test_ERA5_grb_ds():
         nptest.assert_allclose(data.lat[-1], -90.0)
         nptest.assert_allclose(data.lon[0], 0.0)
         nptest.assert_allclose(data.lon[720], 180.0)  # middle of image
+
+
+def test_ERA5_nc_image_regional_subgrid():
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                         "ecmwf_models-test-data", "ERA5", "netcdf", "2010", "001",
+                         'ERA5_AN_20100101_0000.nc')
+
+    # europe, crosses the 0 deg meridian
+    grid = ERA_RegularImgGrid(0.25, 0.25)
+    subgrid = grid.subgrid_from_gpis(
+        grid.get_bbox_grid_points(latmin=35., latmax=60., lonmin=-10., lonmax=30.))
+
+    data_global = ERA5NcImg(fname, parameter=['swvl1', 'swvl2'], mask_seapoints=True,
+                            array_1D=True).read()
+    data = ERA5NcImg(fname, parameter=['swvl1', 'swvl2'], mask_seapoints=True,
+                     array_1D=True, subgrid=subgrid).read()
+
+    nptest.assert_equal(data.lon, data_global.lon[subgrid.activegpis])
+    nptest.assert_equal(data.lat, data_global.lat[subgrid.activegpis])
+    for var in ['swvl1', 'swvl2']:
+        assert data.data[var].shape == subgrid.activegpis.shape
+        nptest.assert_equal(data.data[var], data_global.data[var][subgrid.activegpis])
+
+
+def test_ERA5_nc_ds_static_sea_mask():
+    root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             "ecmwf_models-test-data", "ERA5", "netcdf")
+    lsm_file = os.path.join(root_path, "2010", "001", 'ERA5_AN_20100101_0000.nc')
+
+    img = ERA5NcImg(lsm_file, parameter=['swvl1'], mask_seapoints=True,
+                    array_1D=True).read()
+
+    for kwargs in [{}, {'lsm_file': lsm_file}]:
+        ds = ERA5NcDs(root_path, parameter=['swvl1'], array_1D=True,
+                      mask_seapoints=True, h_steps=[0, 12], **kwargs)
+        assert ds.ioclass_kws['sea_mask'] is None
+        data = ds.read(datetime(2010, 1, 1, 12))
+        # mask is read once and used for all images of the stack
+        sea_mask = ds.ioclass_kws['sea_mask']
+        nptest.assert_equal(sea_mask, np.isnan(img.data['swvl1']))
+        data = ds.read(datetime(2010, 1, 1))
+        assert ds.ioclass_kws['sea_mask'] is sea_mask
+        assert data.data['swvl1'].dtype == np.float32
+        nptest.assert_equal(data.data['swvl1'], img.data['swvl1'])
+
+
+def test_ERA5_ds_parallel_iter_images():
+    root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             "ecmwf_models-test-data", "ERA5")
+
+    for ds_class, subdir in [(ERA5NcDs, 'netcdf'), (ERA5GrbDs, 'grib')]:
+        ds = ds_class(os.path.join(root_path, subdir), parameter=['swvl1'],
+                      array_1D=True, mask_seapoints=True, h_steps=[0, 12])
+        should = list(ds.iter_images(datetime(2010, 1, 1),
+                                     datetime(2010, 1, 1)))
+
+        for kwargs in [{'workers': 2}, {'workers': 1, 'prefetch': 1},
+                       {'workers': 2, 'processes': True}]:
+            imgs = list(ds.iter_images(datetime(2010, 1, 1),
+                                       datetime(2010, 1, 1), **kwargs))
+            assert [img.timestamp for img in imgs] == \
+                [datetime(2010, 1, 1), datetime(2010, 1, 1, 12)]
+            for img, img_should in zip(imgs, should):
+                nptest.assert_equal(img.data['swvl1'],
+                                    img_should.data['swvl1'])
+                nptest.assert_equal(img.lon, img_should.lon)
+
+
+def test_ERA5_ds_parallel_iter_images_kwargs(monkeypatch):
+    # keywords of iter_images are passed to the readers of the workers
+    import ecmwf_models.interface as interface
+    root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             "ecmwf_models-test-data", "ERA5", "netcdf")
+    read, calls = interface.ERANcImg.read, []
+
+    def recording_read(self, timestamp=None, **kwargs):
+        calls.append(kwargs)
+        return read(self, timestamp, **kwargs)
+
+    monkeypatch.setattr(interface.ERANcImg, 'read', recording_read)
+    ds = ERA5NcDs(root_path, parameter=['swvl1'], array_1D=True,
+                  h_steps=[0, 12])
+    imgs = list(ds.iter_images(datetime(2010, 1, 1), datetime(2010, 1, 1),
+                               workers=2, out=None))
+    assert len(imgs) == 2
+    assert calls == [{'out': None}, {'out': None}]
+
+
+def test_ERA5_nc_image_unpack_outside_lock(monkeypatch):
+    # only opening and reading netcdf files is serialized between threads
+    import ecmwf_models.interface as interface
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                         "ecmwf_models-test-data", "ERA5", "netcdf", "2010", "001",
+                         'ERA5_AN_20100101_0000.nc')
+    unpack, unpacked = interface._unpack, []
+
+    def checked_unpack(*args, **kwargs):
+        assert not interface._netcdf_lock.locked()
+        unpacked.append(1)
+        return unpack(*args, **kwargs)
+    monkeypatch.setattr(interface, '_unpack', checked_unpack)
+
+    img = ERA5NcImg(fname, parameter=['swvl1', 'swvl2'],
+                    mask_seapoints=True).read()
+    assert len(unpacked) == 3  # swvl1, swvl2 and the land-sea mask
+    assert img.data['swvl1'].shape == (721, 1440)
+
+
+def test_ERA5_ds_read_block():
+    root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             "ecmwf_models-test-data", "ERA5")
+
+    grid = ERA_RegularImgGrid(0.25, 0.25)
+    subgrid = grid.subgrid_from_gpis(
+        grid.get_bbox_grid_points(latmin=35., latmax=60., lonmin=-10., lonmax=30.))
+
+    for ds_class, subdir in [(ERA5NcDs, 'netcdf'), (ERA5GrbDs, 'grib')]:
+        # there is no image at 06:00, it is filled with nans
+        ds = ds_class(os.path.join(root_path, subdir), parameter=['swvl1'],
+                      mask_seapoints=True, h_steps=[0, 6, 12])
+        block = ds.read_block(datetime(2010, 1, 1), datetime(2010, 1, 1),
+                              parameters=['swvl1', 'swvl2'])
+
+        assert block.timestamp == [datetime(2010, 1, 1),
+                                   datetime(2010, 1, 1, 6),
+                                   datetime(2010, 1, 1, 12)]
+        assert sorted(block.data.keys()) == ['swvl1', 'swvl2']
+        for var in ['swvl1', 'swvl2']:
+            assert block.data[var].shape == (3, 721 * 1440)
+            assert block.data[var].dtype == np.float32
+            assert np.all(np.isnan(block.data[var][1]))
+        for i in [0, 2]:
+            img = ds_class(os.path.join(root_path, subdir),
+                           parameter=['swvl1', 'swvl2'], mask_seapoints=True,
+                           array_1D=True).read(block.timestamp[i])
+            nptest.assert_equal(block.lon, img.lon)
+            for var in ['swvl1', 'swvl2']:
+                nptest.assert_allclose(block.data[var][i], img.data[var],
+                                       rtol=1e-6)
+
+        block_eu = ds.read_block(datetime(2010, 1, 1), datetime(2010, 1, 1),
+                                 subgrid=subgrid)
+        assert block_eu.data['swvl1'].shape == (3, subgrid.activegpis.size)
+        nptest.assert_equal(block_eu.data['swvl1'],
+                            block.data['swvl1'][:, subgrid.activegpis])
+
+
+def test_ERA5_open_archive():
+    root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             "ecmwf_models-test-data", "ERA5", "netcdf")
+
+    ds = open_archive(root_path, 'ERA5', parameters=['swvl1', 'swvl2'],
+                      chunks={'latitude': 100, 'longitude': 500})
+    assert ds['swvl1'].dims == ('time', 'latitude', 'longitude')
+    assert ds['swvl1'].shape == (2, 721, 1440)
+    assert ds['swvl1'].dtype == np.float32
+    assert ds['swvl1'].attrs['units'] == 'm**3 m**-3'
+    assert ds['swvl1'].data.chunks == ((1, 1), (100,) * 7 + (21,),
+                                       (500, 500, 440))
+    nptest.assert_equal(ds['time'].values,
+                        np.array([datetime(2010, 1, 1),
+                                  datetime(2010, 1, 1, 12)],
+                                 dtype='datetime64[ns]'))
+
+    img = ERA5NcImg(os.path.join(root_path, '2010', '001',
+                                 'ERA5_AN_20100101_1200.nc'),
+                    parameter=['swvl1', 'swvl2']).read()
+    for var in ['swvl1', 'swvl2']:
+        nptest.assert_equal(ds[var].isel(time=1).values, img.data[var])
+
+    # only the blocks of the region are read
+    region = ds['swvl1'].sel(latitude=slice(60, 35), longitude=slice(0, 30))
+    nptest.assert_equal(region.isel(time=1).values,
+                        img.data['swvl1'][120:221, 0:121])
+    assert region.mean('time').shape == (101, 121)
+
+    ds_day = open_archive(root_path, 'ERA5', parameters='swvl1',
+                          start=datetime(2010, 1, 1, 6),
+                          end=datetime(2010, 1, 2), chunks={'time': 2})
+    assert ds_day['swvl1'].shape == (1, 721, 1440)
+    assert list(ds_day.data_vars) == ['swvl1']
+
+
+def test_ERA5_image_dtype():
+    root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             "ecmwf_models-test-data", "ERA5")
+    for img_class, fname in [
+            (ERA5NcImg, os.path.join('netcdf', '2010', '001',
+                                     'ERA5_AN_20100101_0000.nc')),
+            (ERA5GrbImg, os.path.join('grib', '2010', '001',
+                                      'ERA5_AN_20100101_0000.grb'))]:
+        fname = os.path.join(root_path, fname)
+        data32 = img_class(fname, parameter=['swvl1'], mask_seapoints=True,
+                           array_1D=True).read()
+        data64 = img_class(fname, parameter=['swvl1'], mask_seapoints=True,
+                           array_1D=True, dtype=np.float64).read()
+
+        assert data32.data['swvl1'].dtype == np.float32
+        assert data64.data['swvl1'].dtype == np.float64
+        nptest.assert_allclose(data32.data['swvl1'], data64.data['swvl1'],
+                               rtol=1e-6)
+        assert np.isnan(data32.data['swvl1']).any()
+
+    ds = ERA5GrbDs(os.path.join(root_path, 'grib'), parameter=['swvl1'],
+                   h_steps=[0, 12], dtype=np.float64)
+    block = ds.read_block(datetime(2010, 1, 1), datetime(2010, 1, 1))
+    assert block.data['swvl1'].dtype == np.float64
+
+
+def test_ERA5_nc_image_regional_extent(tmpdir):
+    # images of a download with an area, or with lons in -180..180
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                         "ecmwf_models-test-data", "ERA5", "netcdf", "2010", "001",
+                         'ERA5_AN_20100101_0000.nc')
+    glob = ERA5NcImg(fname, parameter=['swvl1']).read()
+
+    with xr.open_dataset(fname) as ds:
+        ds.sel(latitude=slice(60, 30), longitude=slice(10, 40)).to_netcdf(
+            str(tmpdir.join('regional.nc')))
+        ds = ds.assign_coords(longitude=((ds.longitude + 180) % 360) - 180)
+        ds.sortby('longitude').to_netcdf(str(tmpdir.join('shifted.nc')))
+
+    img = ERA5NcImg(str(tmpdir.join('regional.nc')), parameter=['swvl1']).read()
+    assert img.data['swvl1'].shape == (121, 121)
+    assert img.lat[0, 0] == 60. and img.lon[0, 0] == 10.
+    assert img.lat[-1, -1] == 30. and img.lon[-1, -1] == 40.
+    nptest.assert_allclose(img.data['swvl1'], glob.data['swvl1'][120:241, 40:161])
+
+    img = ERA5NcImg(str(tmpdir.join('shifted.nc')), parameter=['swvl1']).read()
+    assert img.data['swvl1'].shape == (721, 1440)
+    assert img.lon[0, 0] == -180. and img.lon[0, -1] == 179.75
+    nptest.assert_allclose(img.data['swvl1'][:, 720:], glob.data['swvl1'][:, :720])
+    nptest.assert_allclose(img.data['swvl1'][:, :720], glob.data['swvl1'][:, 720:])
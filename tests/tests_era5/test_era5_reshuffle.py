@@ -27,12 +27,15 @@ Test module for image to time series conversion.
 
 import os
 import glob
+import json
 import tempfile
+import pytest
 import numpy as np
 import numpy.testing as nptest
 
 from ecmwf_models.era5.reshuffle import main
-from ecmwf_models.interface import ERATs
+from ecmwf_models.interface import ERATs, ERANcImg
+from ecmwf_models.era5.interface import ERA5NcImg
 import shutil
 
 def test_ERA5_reshuffle_nc():
@@ -87,4 +90,187 @@ def test_ERA5_reshuffle_grb():
         shutil.rmtree(ts_path)
     except Exception as e:
         shutil.rmtree(ts_path)
-        raise e
\ No newline at end of file
+        raise e
+
+def test_ERA5_reshuffle_nc_land_only():
+    # test reshuffling only land points of era5 netcdf images to time series
+
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          "ecmwf_models-test-data", "ERA5", "netcdf")
+    ts_path = tempfile.mkdtemp()
+    startdate = '2010-01-01'
+    enddate = '2010-01-01'
+    parameters = ["swvl1"]
+    h_steps = ['--h_steps', '0', '12']
+    land_only = ['--land_only', 'True']
+
+    args = [inpath, ts_path, startdate, enddate] + parameters + h_steps + land_only
+    try:
+        main(args)
+        assert len(glob.glob(os.path.join(ts_path, "*.nc"))) < 2593
+        lsm = ERA5NcImg(os.path.join(inpath, '2010', '001', 'ERA5_AN_20100101_0000.nc'),
+                        parameter='lsm', array_1D=True).read()
+        land_gpis = np.where(lsm.data['lsm'] > 0.5)[0]
+        ds = ERATs(ts_path, ioclass_kws={'read_bulk': True})
+        nptest.assert_equal(ds.grid.activegpis, land_gpis)
+        ts = ds.read(15, 48)
+        swvl1_values_should = np.array([0.402825,  0.390983], dtype=np.float32)
+        nptest.assert_allclose(ts['swvl1'].values, swvl1_values_should, rtol=1e-5)
+        shutil.rmtree(ts_path)
+    except Exception as e:
+        shutil.rmtree(ts_path)
+        raise e
+
+def test_ERA5_reshuffle_nc_workers():
+    # test reshuffling groups of cells in parallel processes
+
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          "ecmwf_models-test-data", "ERA5", "netcdf")
+    ts_path = tempfile.mkdtemp()
+    startdate = '2010-01-01'
+    enddate = '2010-01-01'
+    parameters = ["swvl1"]
+    h_steps = ['--h_steps', '0', '12']
+    workers = ['--workers', '2']
+
+    args = [inpath, ts_path, startdate, enddate] + parameters + h_steps + workers
+    try:
+        main(args)
+        assert len(glob.glob(os.path.join(ts_path, "*.nc"))) == 2593
+        # the grid files of the workers are removed
+        assert len(glob.glob(os.path.join(ts_path, ".grid_*"))) == 0
+        # the checkpoints of the groups of cells are removed after the run
+        assert len(glob.glob(os.path.join(ts_path,
+                                          "reshuffle_checkpoint*.json"))) == 0
+        ds = ERATs(ts_path, ioclass_kws={'read_bulk': True})
+        assert ds.grid.activegpis.size == 721 * 1440
+        for lon, lat, swvl1_values_should in [
+                (15, 48, np.array([0.402825, 0.390983], dtype=np.float32)),
+                (-120, -45, None)]:
+            ts = ds.read(lon, lat)
+            if swvl1_values_should is not None:
+                nptest.assert_allclose(ts['swvl1'].values, swvl1_values_should,
+                                       rtol=1e-5)
+            assert ts['swvl1'].values.size == 2
+        shutil.rmtree(ts_path)
+    except Exception as e:
+        shutil.rmtree(ts_path)
+        raise e
+
+def test_ERA5_reshuffle_nc_append():
+    # test extending existing time series with new images
+
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          "ecmwf_models-test-data", "ERA5", "netcdf")
+    ts_path = tempfile.mkdtemp()
+    startdate = '2010-01-01'
+    enddate = '2010-01-01'
+    land_only = ['--land_only', 'True']
+    append = ['--append', 'True']
+
+    try:
+        main([inpath, ts_path, startdate, enddate, 'swvl1',
+              '--h_steps', '0'] + land_only)
+        ds = ERATs(ts_path, ioclass_kws={'read_bulk': True})
+        assert ds.read(15, 48)['swvl1'].values.size == 1
+        ds.close()
+
+        # the variables must match the existing time series
+        with pytest.raises(ValueError):
+            main([inpath, ts_path, startdate, enddate, 'swvl2',
+                  '--h_steps', '0', '12'] + land_only + append)
+
+        # only the image at 12:00 is appended, again nothing is appended
+        for i in range(2):
+            main([inpath, ts_path, startdate, enddate, 'swvl1',
+                  '--h_steps', '0', '12'] + land_only + append)
+            ds = ERATs(ts_path, ioclass_kws={'read_bulk': True})
+            ts = ds.read(15, 48)
+            swvl1_values_should = np.array([0.402825,  0.390983],
+                                           dtype=np.float32)
+            nptest.assert_allclose(ts['swvl1'].values, swvl1_values_should,
+                                   rtol=1e-5)
+            assert ts.index[-1].hour == 12
+            ds.close()
+        shutil.rmtree(ts_path)
+    except Exception as e:
+        shutil.rmtree(ts_path)
+        raise e
+
+def test_ERA5_reshuffle_nc_resume(monkeypatch):
+    # test continuing an interrupted reshuffle run from its checkpoint
+
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          "ecmwf_models-test-data", "ERA5", "netcdf")
+    ts_path = tempfile.mkdtemp()
+    startdate = '2010-01-01'
+    enddate = '2010-01-01'
+    args = [inpath, ts_path, startdate, enddate, 'swvl1', '--h_steps', '0',
+            '12', '--imgbuffer', '1', '--land_only', 'True']
+    checkpoint = os.path.join(ts_path, 'reshuffle_checkpoint.json')
+
+    read = ERANcImg.read
+
+    def interrupted_read(self, timestamp=None, **kwargs):
+        if timestamp is not None and timestamp.hour == 12:
+            raise RuntimeError('interrupted')
+        return read(self, timestamp, **kwargs)
+
+    try:
+        # interrupted before the second image was read
+        with monkeypatch.context() as m:
+            m.setattr(ERANcImg, 'read', interrupted_read)
+            with pytest.raises(RuntimeError):
+                main(args)
+        with open(checkpoint) as f:
+            assert json.load(f)['last'] == '2010-01-01T00:00:00'
+
+        # the variables must match the checkpoint
+        with pytest.raises(ValueError):
+            main(args[:4] + ['swvl2'] + args[5:] + ['--resume', 'True'])
+
+        main(args + ['--resume', 'True'])
+        # the checkpoint is removed after the run
+        assert not os.path.exists(checkpoint)
+        ds = ERATs(ts_path, ioclass_kws={'read_bulk': True})
+        ts = ds.read(15, 48)
+        swvl1_values_should = np.array([0.402825,  0.390983], dtype=np.float32)
+        nptest.assert_allclose(ts['swvl1'].values, swvl1_values_should,
+                               rtol=1e-5)
+        ds.close()
+        shutil.rmtree(ts_path)
+    except Exception as e:
+        shutil.rmtree(ts_path)
+        raise e
+
+def test_ERA5_reshuffle_nc_download_root():
+    # reshuffle the root folder of a download, with the download manifest
+    # and its temporary files next to the image folders
+
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          "ecmwf_models-test-data", "ERA5", "netcdf")
+    root = tempfile.mkdtemp()
+    ts_path = tempfile.mkdtemp()
+    img_path = os.path.join(root, 'images')
+
+    try:
+        shutil.copytree(inpath, img_path)
+        for fname in ['download_manifest.json', '.tmp_manifest_x', '0.json']:
+            with open(os.path.join(img_path, fname), 'w') as f:
+                f.write('{}')
+        os.mkdir(os.path.join(img_path, 'temp_downloaded'))
+
+        main([img_path, ts_path, '2010-01-01', '2010-01-01', 'swvl1',
+              '--h_steps', '0', '12', '--land_only', 'True'])
+        ds = ERATs(ts_path, ioclass_kws={'read_bulk': True})
+        ts = ds.read(15, 48)
+        swvl1_values_should = np.array([0.402825,  0.390983], dtype=np.float32)
+        nptest.assert_allclose(ts['swvl1'].values, swvl1_values_should,
+                               rtol=1e-5)
+        ds.close()
+        shutil.rmtree(ts_path)
+        shutil.rmtree(root)
+    except Exception as e:
+        shutil.rmtree(ts_path)
+        shutil.rmtree(root)
+        raise e